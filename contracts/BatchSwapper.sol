@@ -0,0 +1,58 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.20;
+
+interface IERC20 {
+    function balanceOf(address account) external view returns (uint256);
+    function transfer(address to, uint256 amount) external returns (bool);
+}
+
+/// @notice Fills several users' buys of one token with a single router swap and splits the
+/// output pro rata to what each contributed. The bot's batch executor fronts the ETH.
+contract BatchSwapper {
+    address public immutable operator;
+
+    event BatchFilled(bytes32 indexed batchId, address indexed token, uint256 amountIn, uint256 amountOut);
+
+    constructor() {
+        operator = msg.sender;
+    }
+
+    /// @param swapData Router calldata that spends msg.value and pays `token` to this contract
+    /// @return shares Tokens sent to each recipient; the last one also gets the rounding dust
+    function batchBuy(
+        bytes32 batchId,
+        address router,
+        bytes calldata swapData,
+        address token,
+        address[] calldata recipients,
+        uint256[] calldata amounts
+    ) external payable returns (uint256[] memory shares) {
+        require(msg.sender == operator, "not operator");
+        require(recipients.length == amounts.length && recipients.length > 0, "bad batch");
+        uint256 total;
+        for (uint256 i = 0; i < amounts.length; i++) {
+            total += amounts[i];
+        }
+        require(total == msg.value, "value mismatch");
+
+        uint256 balanceBefore = IERC20(token).balanceOf(address(this));
+        (bool ok, bytes memory result) = router.call{value: msg.value}(swapData);
+        if (!ok) {
+            assembly {
+                revert(add(result, 32), mload(result))
+            }
+        }
+        uint256 amountOut = IERC20(token).balanceOf(address(this)) - balanceBefore;
+
+        shares = new uint256[](recipients.length);
+        uint256 distributed;
+        for (uint256 i = 0; i < recipients.length; i++) {
+            shares[i] = i + 1 == recipients.length ? amountOut - distributed : amountOut * amounts[i] / total;
+            distributed += shares[i];
+            require(IERC20(token).transfer(recipients[i], shares[i]), "transfer failed");
+        }
+        emit BatchFilled(batchId, token, msg.value, amountOut);
+    }
+
+    receive() external payable {}
+}
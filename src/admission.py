@@ -0,0 +1,284 @@
+import time
+import asyncio
+import logging
+import threading
+import collections
+import contextvars
+import concurrent.futures
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from config import (RPC_URL, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATIO, BREAKER_COOLDOWN, BREAKER_SLOW_SECONDS,
+                    TRADE_WORKERS, TRADE_QUEUE_SIZE, STALE_VIEW_MAX_AGE)
+import metrics
+
+# Seconds between checks of a queued trade's place in line
+POSITION_INTERVAL = 1.0
+# Last known values kept for stale read-only views (one per user and view)
+LAST_KNOWN_MAX = 10000
+
+# Set while a background worker runs: its calls neither pass through nor count against the breakers
+_background = contextvars.ContextVar('admission_background', default=False)
+
+
+class Unavailable(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, dependency):
+        super().__init__(f"The {dependency} service is degraded right now. Please try again in a few seconds.")
+        self.dependency = dependency
+
+
+class Busy(Exception):
+    """Raised when the trade queue is full."""
+
+    def __init__(self):
+        super().__init__("Too many trades are waiting right now. Please try again in a moment.")
+
+
+class Breaker:
+    """
+    Circuit breaker of one dependency (or one endpoint of it). It opens when at least
+    BREAKER_FAILURE_RATIO of the last BREAKER_WINDOW calls failed or took longer than its slow
+    threshold, refuses calls for BREAKER_COOLDOWN seconds, then lets a single probe call through:
+    its success closes the breaker, its failure opens it for another cooldown. Calls admitted
+    before it opened don't count once it is open.
+    """
+
+    def __init__(self, name, slow_seconds, endpoint=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.labels = {'dependency': name} if endpoint is None else {'dependency': name, 'endpoint': endpoint}
+        self.slow_seconds = slow_seconds
+        self.outcomes = collections.deque(maxlen=BREAKER_WINDOW)  # True for a failed call
+        self.opened_at = None  # monotonic time it opened; None while closed
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def __str__(self):
+        return self.name if self.endpoint is None else f"{self.name} ({self.endpoint})"
+
+    def admit(self):
+        """(allowed, probe): whether a call may go ahead, and whether it is the probe of an open breaker."""
+        with self._lock:
+            if self.opened_at is None:
+                return True, False
+            if self.probing or time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                return False, False
+            self.probing = True
+            return True, True
+
+    def record(self, ok, seconds, probe=False):
+        """The outcome of an admitted call; probe as admit() returned it."""
+        failed = not ok or seconds > self.slow_seconds
+        with self._lock:
+            if probe:
+                self.probing = False
+                if failed:
+                    self.opened_at = time.monotonic()
+                    return
+                self.opened_at = None
+                self.outcomes.clear()
+                metrics.gauge_set('breaker_open', 0, **self.labels)
+                logging.warning("[Admission] %s recovered, breaker closed", self)
+                return
+            if self.opened_at is not None:
+                # Admitted before the breaker opened: only the probe decides when it closes
+                return
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= BREAKER_MIN_CALLS and sum(self.outcomes) >= BREAKER_FAILURE_RATIO * len(self.outcomes):
+                self.opened_at = time.monotonic()
+                metrics.gauge_set('breaker_open', 1, **self.labels)
+                logging.warning("[Admission] %s degraded (%d of the last %d calls failed or slow), breaker open",
+                                self, sum(self.outcomes), len(self.outcomes))
+
+
+# (dependency, endpoint) -> Breaker; endpoint is None except for RPC, which has one per host
+BREAKERS = {(name, None): Breaker(name, slow_seconds) for name, slow_seconds in BREAKER_SLOW_SECONDS.items()}
+_breakers_lock = threading.Lock()
+
+
+def endpoint_host(url):
+    """The host of an endpoint URL: breakers and metrics never see its path (API keys) or credentials."""
+    return urlsplit(url).hostname or url
+
+
+def breaker(dependency, endpoint=None):
+    """The breaker of dependency, or of one of its endpoints (created on first use)."""
+    key = (dependency, endpoint)
+    found = BREAKERS.get(key)
+    if found is None:
+        with _breakers_lock:
+            found = BREAKERS.setdefault(key, Breaker(dependency, BREAKER_SLOW_SECONDS[dependency], endpoint))
+    return found
+
+
+@contextmanager
+def background():
+    """
+    Runs the block as background work (polling loops, Lambda's post-update checks): its calls skip
+    the breakers, so a slow getLogs scan can't refuse users' requests, and an open breaker can't stall it.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+@contextmanager
+def guard(dependency, endpoint=None):
+    """
+    Runs the block as a call to dependency (at endpoint): refused with Unavailable while its breaker
+    is open, otherwise timed and recorded (raising and running slow both count against it). Also
+    usable as a decorator. Background work passes straight through.
+    """
+    if _background.get():
+        yield
+        return
+    guarding = breaker(dependency, endpoint)
+    allowed, probe = guarding.admit()
+    if not allowed:
+        metrics.inc('breaker_rejections_total', **guarding.labels)
+        raise Unavailable(dependency)
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        guarding.record(ok, time.perf_counter() - started, probe)
+
+
+_last_known = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def read(key, fetch):
+    """
+    fetch() for a read-only view, remembering the result under key (a tuple starting with the view
+    name). When fetch raises (its dependency down, or its breaker open) the last known value is
+    served instead, if it is at most STALE_VIEW_MAX_AGE seconds old. Returns (value, age in
+    seconds, 0 when fresh).
+    """
+    try:
+        value = fetch()
+    except Exception:
+        with _lock:
+            known = _last_known.get(key)
+        if known is None or time.time() - known[1] > STALE_VIEW_MAX_AGE:
+            raise
+        metrics.inc('stale_views_total', view=key[0])
+        return known[0], time.time() - known[1]
+    with _lock:
+        _last_known[key] = (value, time.time())
+        _last_known.move_to_end(key)
+        if len(_last_known) > LAST_KNOWN_MAX:
+            _last_known.popitem(last=False)
+    return value, 0
+
+
+class TradeQueue:
+    """
+    Trade executions, run in order by TRADE_WORKERS threads so they never block the event loop.
+    At most TRADE_QUEUE_SIZE trades wait; more are refused rather than left to pile up.
+    """
+
+    def __init__(self, workers, size):
+        self.workers = workers
+        self.size = size
+        self.waiting = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, fn, *args):
+        """Queues fn(*args) in the caller's context (its trace); a concurrent Future, or None when full."""
+        future = concurrent.futures.Future()
+        with self._cond:
+            if len(self.waiting) >= self.size:
+                return None
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._work, name=f"trade-worker-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self.waiting.append((future, contextvars.copy_context(), fn, args))
+            metrics.gauge_set('trade_queue_depth', len(self.waiting))
+            self._cond.notify()
+        return future
+
+    def position(self, future):
+        """1-based place of a waiting trade in line, or 0 once a worker runs it."""
+        with self._cond:
+            for i, job in enumerate(self.waiting):
+                if job[0] is future:
+                    return i + 1
+        return 0
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self.waiting:
+                    self._cond.wait()
+                future, context, fn, args = self.waiting.popleft()
+                metrics.gauge_set('trade_queue_depth', len(self.waiting))
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(context.run(fn, *args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+trades = TradeQueue(TRADE_WORKERS, TRADE_QUEUE_SIZE)
+
+
+async def run_trade(fn, *args, on_position=None):
+    """
+    Runs fn(*args) (e.g. swap_handler.execute_buy) through the trade queue and returns its result.
+    Fails fast with Unavailable while the breaker of RPC_URL's host is open, or Busy when the queue is full.
+    on_position(n) is awaited whenever the trade's place in line changes (0: it is being sent).
+    """
+    if breaker('rpc', endpoint_host(RPC_URL)).is_open():
+        raise Unavailable('rpc')
+    future = trades.submit(fn, *args)
+    if future is None:
+        metrics.inc('breaker_rejections_total', dependency='trade_queue')
+        raise Busy()
+    waiting = asyncio.wrap_future(future)
+    shown = 0  # the caller already shows the trade as being sent
+    while not waiting.done():
+        position = trades.position(future)
+        if position != shown and on_position is not None:
+            shown = position
+            try:
+                await on_position(position)
+            except Exception as e:
+                logging.warning("[Admission] Could not show queue position: %s", e)
+        await asyncio.wait([waiting], timeout=POSITION_INTERVAL)
+    return waiting.result()
+
+
+def instrument_web3():
+    """Puts every HTTPProvider request (single and batched) behind the 'rpc' breaker of its endpoint's host."""
+    from web3 import HTTPProvider
+    if getattr(HTTPProvider, '_guarded', False):
+        return
+    make_request, make_batch_request = HTTPProvider.make_request, HTTPProvider.make_batch_request
+
+    def guarded_make_request(self, method, params):
+        with guard('rpc', endpoint_host(self.endpoint_uri)):
+            return make_request(self, method, params)
+
+    def guarded_make_batch_request(self, requests):
+        with guard('rpc', endpoint_host(self.endpoint_uri)):
+            return make_batch_request(self, requests)
+
+    HTTPProvider.make_request = guarded_make_request
+    HTTPProvider.make_batch_request = guarded_make_batch_request
+    HTTPProvider._guarded = True
+
+
+instrument_web3()
@@ -0,0 +1,442 @@
+import os
+import sys
+import time
+import logging
+import threading
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+from eth_account import Account
+from config import (RPC_URL, CHAIN_ID, ROUTERS, BATCH_SWAPPER, BATCH_EXECUTOR_KEY, BATCH_WINDOW, BATCH_FILE,
+                    BATCH_TABLE, EXPLORER_URL)
+import routing
+import broadcast
+import simulation
+import swap_handler
+import token_metadata
+import tx_tracker
+import fee_ledger
+import wallet_lock
+import tracing
+import metrics
+import record_store
+import admission
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+WETH = ROUTERS[0]['weth']
+# telegram_id recorded on the executor's own transactions, so the tracker's signer can re-sign them
+EXECUTOR_ID = 'batch-executor'
+EXECUTOR_ADDRESS = Account.from_key(BATCH_EXECUTOR_KEY).address if BATCH_EXECUTOR_KEY else None
+BATCH_BASE_GAS = 600000
+BATCH_GAS_PER_ORDER = 60000
+
+# Seconds between attempts to send refunds that failed
+REFUND_RETRY_INTERVAL = 60
+
+# Records in BATCH_TABLE (DynamoDB) or BATCH_FILE. The orders collecting for a token sit under 'open:<token>':
+# {'token', 'opened_at', 'orders': [{'telegram_id', 'chat_id', 'address', 'amount', 'fee', 'deposit_hash', 'queued_at',
+# 'sent' (False until the deposit is broadcast)}],
+# 'flushing' (a batch being handed over, or None)}. A flushed batch sits under its id (0x bytes32): {'batch_id',
+# 'token', 'status' (ready, sending, sent, refunding), 'opened_at', 'tx_hash', 'orders', 'reason', 'retry_at'},
+# until it is filled or every refund is sent. Every change is a conditional write, so instances sharing the
+# table hand each deposit to exactly one batch, and each batch is sent or refunded by one instance.
+_store = record_store.open_store(BATCH_TABLE, BATCH_FILE, 'batch_id', 'Batcher')
+_batch_thread = None
+
+
+def _open_key(token):
+    return 'open:' + token.lower()
+
+
+def _modify(key, change):
+    """
+    Applies change(record) to the record under key (None if there is none), retrying whenever another
+    writer got in first. change returns (the record to write, or None to write nothing, result).
+    """
+    while True:
+        record = _store.get(key)
+        record, result = change(record)
+        if record is None or _store.update(key, record):
+            return result
+
+
+def enabled():
+    return bool(BATCH_SWAPPER and BATCH_EXECUTOR_KEY)
+
+
+@tracing.traced()
+@metrics.in_flight('trades_in_flight', side='buy')
+def submit_buy(telegram_id, chat_id, user_address, user_private_key, eth_amount, token_out):
+    """
+    Queues a buy to be filled together with other buys of token_out in the next BATCH_WINDOW. The
+    user's ETH (minus the fee, which stays in the wallet for fee_ledger) is deposited with the
+    executor right away. Returns {'deposit_hash'} or {'error': ...}. Blocking (wallet lock, RPCs).
+
+    The order is stored (keyed by the signed deposit's hash) before the deposit is broadcast, so no
+    ETH reaches the executor without an order to fill or refund; it is marked sent afterwards.
+    """
+    key = _open_key(token_out)
+    try:
+        fee = swap_handler.calculate_fee(eth_amount)
+        amount = eth_amount - fee
+        with wallet_lock.hold(user_address) as wallet:
+            deposit_tx = {
+                'to': EXECUTOR_ADDRESS,
+                'value': amount,
+                'gas': 21000,
+                'gasPrice': int(w3.eth.gas_price * 2),
+                'nonce': wallet.nonce,
+                'chainId': CHAIN_ID
+            }
+            signed = w3.eth.account.sign_transaction(deposit_tx, user_private_key)
+            deposit_hash = Web3.to_hex(signed.hash)
+            order = {'telegram_id': telegram_id, 'chat_id': chat_id, 'address': user_address, 'amount': amount,
+                     'fee': fee, 'deposit_hash': deposit_hash, 'queued_at': time.time(), 'sent': False}
+
+            def add(record):
+                record = record or {'token': Web3.to_checksum_address(token_out), 'opened_at': time.time(), 'orders': [], 'flushing': None}
+                record['orders'].append(order)
+                return record, None
+            _modify(key, add)
+            try:
+                broadcast.send_raw_transaction(signed.raw_transaction)
+            except Exception:
+                _modify(key, lambda record: _set_order(record, deposit_hash, None))
+                raise
+            wallet.used(deposit_tx['nonce'])
+    except Exception as e:
+        if 'nonce too low' in str(e):
+            return {'error': 'A previous transaction is still pending. Please wait for it to confirm before making another trade.'}
+        return {'error': str(e)}
+    try:
+        _modify(key, lambda record: _set_order(record, deposit_hash, {'sent': True}))
+        tx_tracker.track(deposit_hash, 'deposit', chat_id, telegram_id, user_address)
+    except Exception as e:
+        # The order is stored either way: it is batched once its deposit is mined
+        logging.error("[Batcher] Deposit %s from %s is out but could not be marked sent: %s", deposit_hash, user_address, e)
+    return {'deposit_hash': deposit_hash}
+
+
+def _set_order(record, deposit_hash, changes):
+    """_modify change for an open record: updates the order with deposit_hash (changes None removes it)."""
+    orders = (record or {}).get('orders', [])
+    order = next((o for o in orders if o['deposit_hash'] == deposit_hash), None)
+    if order is None:
+        return None, None
+    if changes is None:
+        orders.remove(order)
+    else:
+        order.update(changes)
+    return record, None
+
+
+def _never_sent(orders, statuses):
+    """
+    Orders left unsent by a crash between storing them and broadcasting: unsent for a whole window,
+    no receipt, and unknown to the node.
+    """
+    unsent = []
+    for order in orders:
+        if order.get('sent', True) or order['deposit_hash'] in statuses or time.time() - order['queued_at'] < BATCH_WINDOW:
+            continue
+        try:
+            w3.eth.get_transaction(order['deposit_hash'])
+        except TransactionNotFound:
+            unsent.append(order)
+    return unsent
+
+
+def _deposit_statuses(orders):
+    """deposit hash -> receipt status (True/False) for the mined deposits, in one JSON-RPC batch."""
+    if not orders:
+        return {}
+    responses = w3.provider.make_batch_request([("eth_getTransactionReceipt", [o['deposit_hash']]) for o in orders])
+    return {order['deposit_hash']: int(response['result']['status'], 16) == 1
+            for order, response in zip(orders, responses) if response.get('result')}
+
+
+def _send_from_executor(tx, wallet):
+    signed = w3.eth.account.sign_transaction(tx, BATCH_EXECUTOR_KEY)
+    tx_hash = Web3.to_hex(broadcast.send_raw_transaction(signed.raw_transaction))
+    wallet.used(tx['nonce'])
+    return tx_hash
+
+
+def _refund(batch):
+    """
+    Sends back every deposit of a refunding batch that hasn't been refunded yet, recording each refund
+    as it is sent; the batch record is deleted once all are. Failed refunds stay on the record and are
+    retried after REFUND_RETRY_INTERVAL. The caller has claimed the batch (its write moved retry_at).
+    Each refund is marked started before it is sent: one a crash left started but unrecorded is never
+    sent again (it may be out) and is logged for a manual check instead.
+    """
+    reason = batch['reason']
+    gas_price = w3.eth.gas_price
+    with wallet_lock.hold(EXECUTOR_ADDRESS) as wallet:
+        for order in batch['orders']:
+            if order.get('refund_hash'):
+                continue
+            if order.get('refund_started'):
+                logging.error("[Batcher] Refund to %s for batch %s was interrupted; check it was sent", order['address'], batch['batch_id'])
+                continue
+            order['refund_started'] = True
+            if not _store.update(batch['batch_id'], batch):
+                logging.error("[Batcher] Batch %s changed while refunding", batch['batch_id'])
+                return
+            try:
+                order['refund_hash'] = _send_from_executor({'to': Web3.to_checksum_address(order['address']), 'value': order['amount'],
+                                                            'gas': 21000, 'gasPrice': gas_price, 'nonce': wallet.nonce, 'chainId': CHAIN_ID}, wallet)
+            except Exception as e:
+                logging.error("[Batcher] Refund to %s failed for batch %s: %s", order['address'], batch['batch_id'], e)
+                order['refund_started'] = False
+                if not order.get('refund_notified') and order['chat_id'] is not None:
+                    tx_tracker.send_message(order['chat_id'], f"❌ <b>Buy failed:</b> {reason}\nThe refund could not be sent yet; it will be retried.")
+                order['refund_notified'] = True
+                continue
+            if not _store.update(batch['batch_id'], batch):
+                logging.error("[Batcher] Batch %s changed while refunding %s", batch['batch_id'], order['refund_hash'])
+                return
+            tx_tracker.track(order['refund_hash'], 'refund', None, EXECUTOR_ID, EXECUTOR_ADDRESS)
+            if order['chat_id'] is not None:
+                tx_tracker.send_message(order['chat_id'], f"❌ <b>Buy failed:</b> {reason}\nYour <code>{order['amount'] / 1e18:,.6f} ETH</code> has been refunded.")
+    if all(order.get('refund_hash') for order in batch['orders']):
+        _store.delete(batch['batch_id'], batch)
+    else:
+        batch['retry_at'] = time.time() + REFUND_RETRY_INTERVAL
+        _store.update(batch['batch_id'], batch)
+
+
+def _fail(batch, reason):
+    """Refunds a batch this instance owns (it is sending it, or settling its reverted swap)."""
+    batch.update(status='refunding', reason=reason, retry_at=time.time() + REFUND_RETRY_INTERVAL)
+    if not _store.update(batch['batch_id'], batch):
+        logging.error("[Batcher] Batch %s changed before it could be refunded", batch['batch_id'])
+        return
+    _refund(batch)
+
+
+def _send_batch(batch, route, total):
+    """Builds, simulates and sends the batchBuy along route. Returns the simulation error, or None once it is sent."""
+    token = batch['token']
+    router_type = route['protocol']
+    router_contract = w3.eth.contract(address=Web3.to_checksum_address(route['router']['router']),
+                                      abi=swap_handler.load_abi(swap_handler.ROUTER_ABI_FILES[router_type]))
+    swapper = Web3.to_checksum_address(BATCH_SWAPPER)
+    if router_type == 'v3':
+        fn_name, params = swap_handler.v3_swap_params(route, swapper, total, route['amount_out_min'])
+        swap_data = router_contract.encode_abi(fn_name, args=[params])
+    else:
+        swap_data = router_contract.encode_abi('swapExactETHForTokens',
+                                               args=[route['amount_out_min'], route['path'], swapper, int(time.time()) + 300])
+    swapper_contract = w3.eth.contract(address=swapper, abi=swap_handler.load_abi('BatchSwapper_ABI.json'))
+    batch_call = swapper_contract.functions.batchBuy(
+        batch['batch_id'],
+        router_contract.address,
+        swap_data,
+        token,
+        [Web3.to_checksum_address(order['address']) for order in batch['orders']],
+        [order['amount'] for order in batch['orders']]
+    )
+    with wallet_lock.hold(EXECUTOR_ADDRESS) as wallet:
+        tx = batch_call.build_transaction({
+            'from': EXECUTOR_ADDRESS,
+            'value': total,
+            'gas': BATCH_BASE_GAS + BATCH_GAS_PER_ORDER * len(batch['orders']),
+            'gasPrice': int(w3.eth.gas_price * 2),
+            'nonce': wallet.nonce,
+            'chainId': CHAIN_ID
+        })
+        error = simulation.simulate(tx, token, 'buy', total, route['amount_out_min'])
+        if not error:
+            batch['tx_hash'] = _send_from_executor(tx, wallet).lower()
+    return error
+
+
+def _execute(batch):
+    """
+    One BatchSwapper.batchBuy for every order in a ready batch, fronted by the executor. The batch is
+    claimed (ready -> sending) with a conditional write first, so only one instance sends it. A batch
+    left 'sending' by a crash is never sent again, since the swap may already be out.
+    """
+    batch['status'] = 'sending'
+    if not _store.update(batch['batch_id'], batch):
+        return
+    token = batch['token']
+    total = sum(order['amount'] for order in batch['orders'])
+    try:
+        route = routing.best_route(WETH, token, total)
+        error = route.get('error') or _send_batch(batch, route, total)
+    except Exception as e:
+        if batch['tx_hash'] is not None:
+            raise
+        logging.error("[Batcher] Batch %s failed: %s", batch['batch_id'], e)
+        error = str(e)
+    if error:
+        _fail(batch, error)
+        return
+    batch['status'] = 'sent'
+    if not _store.update(batch['batch_id'], batch):
+        logging.error("[Batcher] Batch %s changed while it was being sent", batch['batch_id'])
+    tx_tracker.track(batch['tx_hash'], 'batch', None, EXECUTOR_ID, EXECUTOR_ADDRESS, {'batch_id': batch['batch_id']})
+    logging.info("[Batcher] Sent batch %s: %d buys of %s for %.6f ETH, %s", batch['batch_id'], len(batch['orders']), token, total / 1e18, batch['tx_hash'])
+
+
+def _hand_over(key, pending):
+    """
+    Turns the 'flushing' batch of an open record into its own (ready) record, then clears it from the
+    open record and sends it. Safe to repeat after a crash: the batch is only inserted if absent.
+    """
+    batch = pending['flushing']
+    if batch is not None and _store.update(batch['batch_id'], dict(batch)):
+        logging.info("[Batcher] Batch %s of %s is ready: %d order(s)", batch['batch_id'], batch['token'], len(batch['orders']))
+
+    def clear(record):
+        if record is None or record['flushing'] is None or record['flushing']['batch_id'] != batch['batch_id']:
+            return None, None
+        record['flushing'] = None
+        return record, None
+    if batch is not None:
+        _modify(key, clear)
+    record = _store.get(key)
+    if record is not None and not record['orders'] and record['flushing'] is None:
+        _store.delete(key, record)
+    if batch is not None:
+        batch = _store.get(batch['batch_id'])
+        if batch is not None and batch['status'] == 'ready':
+            _execute(batch)
+
+
+def _flush(key, pending):
+    """
+    Moves the orders of an open record whose deposit is mined into a new batch, and sends it. Pending
+    deposits stay for the next window and reverted ones are dropped. The move is one conditional write
+    of the open record, so an order queued meanwhile makes it fail and the flush is retried next round.
+    """
+    if not pending['orders']:
+        # Its only orders were withdrawn when their deposits could not be broadcast
+        _store.delete(key, pending)
+        return
+    statuses = _deposit_statuses(pending['orders'])
+    ready = [o for o in pending['orders'] if statuses.get(o['deposit_hash'])]
+    reverted = [o for o in pending['orders'] if statuses.get(o['deposit_hash']) is False]
+    unsent = _never_sent(pending['orders'], statuses)
+    if not ready and not reverted and not unsent:
+        return
+    for order in unsent:
+        logging.warning("[Batcher] Dropping order %s from %s: its deposit was never broadcast", order['deposit_hash'], order['address'])
+    dropped = {o['deposit_hash'] for o in unsent}
+    pending['orders'] = [o for o in pending['orders'] if o['deposit_hash'] not in statuses and o['deposit_hash'] not in dropped]
+    if ready:
+        batch_id = Web3.to_hex(os.urandom(32))
+        pending['flushing'] = {'batch_id': batch_id, 'token': pending['token'], 'status': 'ready', 'opened_at': pending['opened_at'],
+                               'tx_hash': None, 'orders': ready}
+    # Deposits still pending wait a full window for company
+    pending['opened_at'] = time.time()
+    if not _store.update(key, pending):
+        return
+    for order in reverted:
+        if order['chat_id'] is not None:
+            tx_tracker.send_message(order['chat_id'], "❌ <b>Buy failed:</b> the deposit transaction reverted.")
+    _hand_over(key, pending)
+
+
+def flush_due():
+    """
+    Sends every batch whose BATCH_WINDOW has passed, resumes hand-overs a crash interrupted, and
+    retries failed refunds. No lock is held across the RPCs: every step claims its record first.
+    """
+    now = time.time()
+    for key, record in _store.all().items():
+        try:
+            if key.startswith('open:'):
+                if record['flushing'] is not None:
+                    _hand_over(key, record)
+                elif now - record['opened_at'] >= BATCH_WINDOW:
+                    _flush(key, record)
+            elif record['status'] == 'ready':
+                _execute(record)
+            elif record['status'] == 'refunding' and now >= record['retry_at']:
+                record['retry_at'] = now + REFUND_RETRY_INTERVAL
+                if _store.update(key, record):
+                    _refund(record)
+            elif record['status'] == 'sending' and not record.get('stuck_logged'):
+                logging.error("[Batcher] Batch %s was left sending by a crash; check %s before refunding it", key, EXECUTOR_ADDRESS)
+                record['stuck_logged'] = True
+                _store.update(key, record)
+        except Exception as e:
+            logging.error("[Batcher] Batch %s failed: %s", key, e)
+
+
+def settle_batch(record, receipt):
+    """tx_tracker hook: credits each order its share (from the batch's Transfer logs) or refunds a reverted batch."""
+    # Batches sent before the tracker carried their id are found by hash
+    batch_id = record['data'].get('batch_id') or next(
+        (key for key, batch in _store.all().items() if batch.get('tx_hash') == record['tx_hash']), None)
+    batch = _store.get(batch_id) if batch_id else None
+    if batch is None:
+        return None
+    if int(receipt['status'], 16) != 1:
+        _fail(batch, "the batch swap reverted.")
+        return None
+    metadata = token_metadata.get(batch['token'])
+    tx_hash = record.get('mined_hash') or record['tx_hash']
+    # The Transfer logs are per address: a user with several orders in the batch gets one transfer for all of them
+    received, deposited = {}, {}
+    for order in batch['orders']:
+        address = order['address'].lower()
+        if address not in received:
+            received[address] = tx_tracker.tokens_received(receipt, order['address']).get(batch['token'], 0)
+        deposited[address] = deposited.get(address, 0) + order['amount']
+    for order in batch['orders']:
+        address = order['address'].lower()
+        share = received[address] * order['amount'] // deposited[address]
+        # Keyed by the order's own deposit: every order in the batch shares the swap's hash
+        fee_ledger.accrue(order['telegram_id'], order['address'], order['fee'], order['deposit_hash'])
+        logging.info("[Batcher] Batch %s filled %s with %d of %s", batch_id, order['address'], share, batch['token'])
+        if order['chat_id'] is not None:
+            tx_tracker.send_message(order['chat_id'], (
+                f"✅ <b>Buy confirmed</b> in block <code>{int(receipt['blockNumber'], 16)}</code>, "
+                f"filled together with {len(batch['orders']) - 1} other buy(s)\n"
+                f"• <b>Received:</b> <code>{share / 10 ** metadata['decimals']:,.6f} {metadata['symbol']}</code>\n"
+                f"• <b>Fee:</b> <code>{order['fee'] / 1e18:,.6f} ETH</code> (1%, collected in a batched sweep)\n"
+                f"<a href='{EXPLORER_URL}/tx/{tx_hash}'>View on Explorer</a>"))
+    # Filled: nothing is owed to anyone any more
+    _store.delete(batch_id)
+    return None
+
+
+def _batch_loop():
+    with admission.background():
+        while True:
+            try:
+                flush_due()
+            except Exception as e:
+                logging.error("[Batcher] Flush failed: %s", e)
+            time.sleep(0.5)
+
+
+def start_batching():
+    """Starts the background worker that sends batches as their windows close (polling mode)."""
+    global _batch_thread
+    if _batch_thread is not None and _batch_thread.is_alive():
+        return
+    _batch_thread = threading.Thread(target=_batch_loop, name="batcher", daemon=True)
+    _batch_thread.start()
+
+
+tx_tracker.add_hook('batch', settle_batch)
+
+
+if __name__ == "__main__":
+    # Usage: python batcher.py <token> <user private key> [<user private key> ...]
+    # Devnet check with a deployed BatchSwapper (BATCH_SWAPPER, owned by BATCH_EXECUTOR_KEY): queues a
+    # 0.001 ETH buy of token from every funded key, sends them as one batch and logs each share.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    token, keys = sys.argv[1], sys.argv[2:]
+    for i, key in enumerate(keys):
+        print(submit_buy(f"devnet-{i}", None, Account.from_key(key).address, key, 10 ** 15, token))
+    # Shares are logged as each batch is filled; a filled batch leaves the store
+    while _store.all():
+        time.sleep(BATCH_WINDOW)
+        flush_due()
+        tx_tracker.check_pending()
@@ -0,0 +1,341 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from dotenv import load_dotenv
+from telegram.request import BaseRequest
+
+# Conversations driven per simulated user, as (update kind, text or callback data). {token},
+# {recipient} and the amounts are filled in from the command line.
+FLOWS = {
+    'start': [('message', '/start')],
+    'buy': [('callback', 'menu_buy'), ('message', '{token}'), ('message', '{buy_amount}'), ('callback', 'buy_confirm')],
+    'sell': [('callback', 'menu_sell'), ('message', '{token}'), ('callback', 'sell_pct_50'), ('callback', 'sell_confirm')],
+    'withdraw': [('callback', 'menu_withdraw'), ('callback', 'withdraw_eth'), ('message', '{recipient}'),
+                 ('message', '{withdraw_amount}'), ('callback', 'withdraw_confirm')],
+}
+# Settings pointed at the stand-ins or a scratch directory before config is first imported
+STATE_FILES = ('PENDING_TX_FILE', 'FEE_LEDGER_FILE', 'BATCH_FILE', 'POOL_INDEX_FILE', 'TOKEN_METADATA_FILE',
+               'TOKEN_PROFILE_FILE')
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Inky', 'username': 'inky_benchmark_bot'}
+FUNDING_WEI = 10 * 10 ** 18
+BALANCE_OF = '0x70a08231'
+DECIMALS = '0x313ce567'
+
+_update_ids = itertools.count(1)
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls in memory instead of calling api.telegram.org, counting them by method."""
+
+    def __init__(self):
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method.startswith(('send', 'edit')):
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()), 'from': BOT_USER,
+                      'chat': {'id': params.get('chat_id', 0), 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+def _user(telegram_id):
+    return {'id': telegram_id, 'is_bot': False, 'first_name': f"bench{telegram_id}"}
+
+
+def message_update(telegram_id, text):
+    """A raw Bot API update for a private-chat message; a leading /command is tagged as one."""
+    update_id = next(_update_ids)
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'chat': {'id': telegram_id, 'type': 'private'},
+        'from': _user(telegram_id), 'text': text, 'entities': entities}}
+
+
+def callback_update(telegram_id, data):
+    """A raw Bot API update for an inline button press on one of the bot's messages."""
+    update_id = next(_update_ids)
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': _user(telegram_id), 'chat_instance': str(telegram_id), 'data': data,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'from': BOT_USER,
+                    'chat': {'id': telegram_id, 'type': 'private'}, 'text': 'menu'}}}
+
+
+def _rpc(rpc_url, method, params):
+    """A JSON-RPC call that bypasses web3, so the stand-ins' own calls don't count against the bot's."""
+    response = requests.post(rpc_url, json={'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}, timeout=10)
+    body = response.json()
+    if 'error' in body:
+        raise RuntimeError(f"{method}: {body['error']}")
+    return body['result']
+
+
+def _explorer_handler(rpc_url, token):
+    class ExplorerHandler(BaseHTTPRequestHandler):
+        """/api/v2/addresses/<address>/token-balances, answered from the devnet for the benchmark token."""
+
+        def do_GET(self):
+            parts = self.path.split('?')[0].strip('/').split('/')
+            if len(parts) != 5 or parts[:3] != ['api', 'v2', 'addresses'] or parts[4] != 'token-balances':
+                self.send_error(404)
+                return
+            owner = parts[3].lower()[2:].rjust(64, '0')
+            balance = int(_rpc(rpc_url, 'eth_call', [{'to': token, 'data': BALANCE_OF + owner}, 'latest']), 16)
+            decimals = int(_rpc(rpc_url, 'eth_call', [{'to': token, 'data': DECIMALS}, 'latest']), 16)
+            entries = [{'token': {'address': token, 'decimals': str(decimals), 'symbol': 'BENCH'}, 'value': str(balance)}]
+            body = json.dumps(entries if balance else []).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return ExplorerHandler
+
+
+def start_explorer(rpc_url, token):
+    """Serves the explorer token-balances endpoint on a free local port; returns its base URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _explorer_handler(rpc_url, token))
+    threading.Thread(target=server.serve_forever, name="explorer-stub", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def prepare_environment(args, state_dir):
+    """Points every external dependency of the bot at a stand-in. Must run before config is imported."""
+    # .env first, so its table names are the ones created below; the settings here override it
+    load_dotenv()
+    os.environ.update({
+        'RPC_URL': args.rpc,
+        'BROADCAST_RPC_URLS': '',
+        'BOT_TOKEN': '123456:benchmark',
+        'BATCH_SWAPPER': '',
+        'METRICS_PORT': '0',
+        'EXPLORER_URL': start_explorer(args.rpc, args.token),
+        # moto answers DynamoDB; these only have to look like credentials
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_SESSION_TOKEN': 'testing',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+    for name in STATE_FILES:
+        os.environ[name] = os.path.join(state_dir, f"{name.lower()}.json")
+    if not os.environ.get('ENCRYPTION_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['ENCRYPTION_KEY'] = Fernet.generate_key().decode()
+
+
+def create_tables():
+    import boto3
+    dynamodb = boto3.client('dynamodb')
+    tables = [(os.environ.get('DYNAMODB_TABLE', 'InkyWallets'), 'telegram_id')]
+    if os.environ.get('WALLET_LOCK_TABLE'):
+        tables.append((os.environ['WALLET_LOCK_TABLE'], 'address'))
+    for name, key in tables:
+        dynamodb.create_table(TableName=name, KeySchema=[{'AttributeName': key, 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'}],
+                              BillingMode='PAY_PER_REQUEST')
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Recorder:
+    """Per flow: latency of every run, and the RPC and Bot API calls made while the flow's runs were in progress."""
+
+    def __init__(self, fake_request):
+        self.fake_request = fake_request
+        self.flows = {}
+        self.updates = 0
+        self.elapsed = 0.0
+
+    def begin(self):
+        import metrics
+        return metrics.counter_values('rpc_requests_total'), self.fake_request.total(), time.perf_counter()
+
+    def end(self, flow, latencies, mark):
+        import metrics
+        rpc_before, telegram_before, started = mark
+        if flow in FLOWS:
+            self.elapsed += time.perf_counter() - started
+        stats = self.flows.setdefault(flow, {'latencies': [], 'rpc': {}, 'telegram': 0})
+        stats['latencies'].extend(latencies)
+        stats['telegram'] += self.fake_request.total() - telegram_before
+        for labels, value in metrics.counter_values('rpc_requests_total').items():
+            delta = value - rpc_before.get(labels, 0)
+            if delta:
+                method = dict(labels)['method']
+                stats['rpc'][method] = stats['rpc'].get(method, 0) + delta
+
+    def report(self):
+        flows = {}
+        for flow, stats in self.flows.items():
+            latencies = sorted(stats['latencies'])
+            runs = len(latencies)
+            flows[flow] = {
+                'runs': runs,
+                'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1),
+                'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'rpc_per_flow': round(sum(stats['rpc'].values()) / runs, 2),
+                'rpc_methods': {method: round(count / runs, 2) for method, count in sorted(stats['rpc'].items())},
+                'telegram_calls_per_flow': round(stats['telegram'] / runs, 2),
+            }
+        return {'flows': flows, 'updates': self.updates,
+                'updates_per_second': round(self.updates / self.elapsed, 2) if self.elapsed else 0.0}
+
+
+async def run_flow(app, recorder, flow, telegram_id, values):
+    """Feeds one user's conversation through the application, one update after the other; returns its latency."""
+    from telegram import Update
+    started = time.perf_counter()
+    for kind, template in FLOWS[flow]:
+        text = template.format(**values)
+        raw = message_update(telegram_id, text) if kind == 'message' else callback_update(telegram_id, text)
+        await app.process_update(Update.de_json(raw, app.bot))
+        recorder.updates += 1
+    return time.perf_counter() - started
+
+
+def fund(rpc_url, telegram_ids):
+    import wallet_utils
+    for telegram_id in telegram_ids:
+        address, _ = wallet_utils.get_wallet(str(telegram_id))
+        _rpc(rpc_url, 'anvil_setBalance', [address, hex(FUNDING_WEI)])
+
+
+async def benchmark(args):
+    """
+    Runs every flow in args.flows for all simulated users, args.rounds times, settling mined
+    transactions after each trade flow the way the tx tracker worker would.
+    """
+    import bot
+    import tx_tracker
+    fake_request = FakeTelegramRequest()
+    recorder = Recorder(fake_request)
+
+    def count_notification(chat_id, text):
+        # Trade notifications bypass the application; count them as Bot API calls too
+        fake_request.calls['sendMessage'] = fake_request.calls.get('sendMessage', 0) + 1
+    tx_tracker.send_message = count_notification
+    app = bot.get_application(request=fake_request)
+    await app.initialize()
+    telegram_ids = [args.first_user + i for i in range(args.users)]
+    values = {'token': args.token, 'recipient': args.recipient,
+              'buy_amount': args.buy_amount, 'withdraw_amount': args.withdraw_amount}
+    for round_number in range(args.rounds):
+        for flow in args.flows:
+            # All users start the flow at once; handlers block the loop, so later users queue behind earlier ones
+            mark = recorder.begin()
+            latencies = await asyncio.gather(*(run_flow(app, recorder, flow, telegram_id, values)
+                                               for telegram_id in telegram_ids))
+            recorder.end(flow, latencies, mark)
+            if flow == 'start':
+                if round_number == 0:
+                    fund(args.rpc, telegram_ids)
+                continue
+            # anvil mines each transaction as it arrives; confirm them before the users' next trade
+            mark = recorder.begin()
+            started = time.perf_counter()
+            tx_tracker.check_pending()
+            recorder.end('settle', [time.perf_counter() - started], mark)
+    await app.shutdown()
+    return recorder.report()
+
+
+def compare(report, baseline, tolerance):
+    """Flows whose p95 latency or RPC count per flow grew by more than tolerance over the baseline."""
+    regressions = []
+    for flow, current in report['flows'].items():
+        previous = baseline['flows'].get(flow)
+        if not previous:
+            continue
+        for key in ('p95_ms', 'rpc_per_flow'):
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{flow} {key}: {previous[key]} -> {current[key]}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'flow':<10} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'rpc/flow':>9} {'tg/flow':>8}")
+    for flow, stats in report['flows'].items():
+        print(f"{flow:<10} {stats['runs']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} "
+              f"{stats['max_ms']:>9.1f} {stats['rpc_per_flow']:>9.2f} {stats['telegram_calls_per_flow']:>8.2f}")
+    for flow, stats in report['flows'].items():
+        methods = ', '.join(f"{method} {count}" for method, count in stats['rpc_methods'].items())
+        print(f"  {flow}: {methods or 'no RPC'}")
+    print(f"{report['updates']} updates, {report['updates_per_second']:.1f} updates/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the bot's conversations against local stand-ins.")
+    parser.add_argument('token', help="ERC-20 with a WETH pool on the devnet, bought and sold by the buy and sell flows")
+    parser.add_argument('--rpc', default='http://127.0.0.1:8545', help="anvil (e.g. forking Ink mainnet)")
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--flows', nargs='+', default=list(FLOWS), choices=list(FLOWS))
+    parser.add_argument('--first-user', type=int, default=900000000)
+    parser.add_argument('--buy-amount', default='0.001')
+    parser.add_argument('--withdraw-amount', default='0.0001')
+    parser.add_argument('--recipient', default='0x000000000000000000000000000000000000dEaD')
+    parser.add_argument('--json', help="also write the report to this file (a baseline for --compare)")
+    parser.add_argument('--compare', help="baseline report; exit 1 if any flow regressed beyond --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if 'start' not in args.flows:
+        args.flows.insert(0, 'start')  # creates and funds the wallets the other flows use
+    from moto import mock_aws
+    with tempfile.TemporaryDirectory() as state_dir, mock_aws():
+        prepare_environment(args, state_dir)
+        create_tables()
+        report = asyncio.run(benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Usage: anvil --fork-url https://ink.drpc.org &
+    #        python benchmark.py <token> [--users 5] [--rounds 5] [--json report.json] [--compare baseline.json]
+    # Drives start/buy/sell/withdraw conversations through bot.get_application() with fake Telegram
+    # updates, against the devnet, a moto DynamoDB and a local explorer stub. Nothing leaves the machine.
+    main()
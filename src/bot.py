@@ -4,14 +4,33 @@ from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, Conve
 from dotenv import load_dotenv
 import wallet_utils
 import swap_handler
-from config import BOT_TOKEN, BRIDGE_URL, CHAIN_ID # Make sure CHAIN_ID is imported or defined
+import routing
+import pool_state
+import pair_state
+import pool_index
+import token_metadata
+import token_profile
+import tx_tracker
+import fee_ledger
+import batcher
+import wallet_lock
+import broadcast
+import tx_codec
+import tracing
+import metrics
+import log_setup
+import recorder
+import profiler
+import admission
+from config import BOT_TOKEN, BRIDGE_URL
 from web3 import Web3
 import requests
 import json
 import logging
 import telegram # Import telegram for specific error handling
 import threading
-from config import ROUTERS, EXPLORER_URL
+import html
+from config import ROUTERS, EXPLORER_URL, SLIPPAGE_BPS, PRICE_IMPACT_WARN_BPS, BATCH_EXECUTOR_KEY, BATCH_WINDOW, ADMIN_TELEGRAM_IDS
 import asyncio
 
 # Ensure RPC_URL is properly configured and accessible
@@ -37,28 +56,34 @@ main_menu_inline_keyboard = InlineKeyboardMarkup([
 
 # Removed persistent_menu_keyboard and associated logic
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s'
-)
+# Set up logging: JSON lines written by a background thread, off the event loop
+log_setup.setup()
 
 # Global application instance for Lambda
 app = None
-
-def get_application():
-    """Get or create the Telegram application instance"""
+# Event loop of the Lambda container; the application and its HTTP client stay bound to it across invocations
+lambda_loop = None
+
+def get_application(request=None):
+    """
+    Get or create the Telegram application instance. request replaces the HTTP layer of Bot API
+    calls (e.g. an in-memory fake for benchmark.py).
+    """
     global app
     if app is None:
         if not BOT_TOKEN:
             raise ValueError("BOT_TOKEN environment variable is required")
-        app = ApplicationBuilder().token(BOT_TOKEN).build()
+        builder = ApplicationBuilder().token(BOT_TOKEN)
+        if request is not None:
+            builder = builder.request(request).get_updates_request(request)
+        app = builder.build()
         
         # Add all handlers
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("wallet", wallet))
         app.add_handler(CommandHandler("export_keys", export_keys))
         app.add_handler(CommandHandler("reset_wallet", reset_wallet))
+        app.add_handler(CommandHandler("profile", profile))
 
         # General menu callback handlers that should not interfere with conversations
         app.add_handler(CallbackQueryHandler(wallet, pattern="^menu_wallet$"))
@@ -162,6 +187,9 @@ def get_application():
         
         # Add global debug text handler LAST, so it only catches unhandled text messages
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, debug_text_handler))
+        app.add_error_handler(degraded_error_handler)
+        if recorder.enabled():
+            recorder.install(app)
     
     return app
 
@@ -173,16 +201,33 @@ def lambda_handler(event, context):
         
         # Create the application
         application = get_application()
+        global lambda_loop
+        if lambda_loop is None:
+            lambda_loop = asyncio.new_event_loop()
+            lambda_loop.run_until_complete(application.initialize())
         
         # Process the update
-        application.process_update(Update.de_json(body, application.bot))
+        lambda_loop.run_until_complete(application.process_update(Update.de_json(body, application.bot)))
+
+        # No background worker in Lambda: confirm whatever has been mined since the last update
+        with admission.background():
+            tx_tracker.check_pending()
+            fee_ledger.sweep_due()
+            if batcher.enabled():
+                batcher.flush_due()
+        # The invocation may be frozen right after returning, before the flush thread runs
+        tracing.flush()
+        metrics.flush_emf()
+        log_setup.flush()
+        if recorder.enabled():
+            recorder.flush()
         
         return {
             'statusCode': 200,
             'body': json.dumps('OK')
         }
     except Exception as e:
-        logging.error(f"Error in lambda_handler: {e}")
+        logging.error("Error in lambda_handler: %s", e)
         return {
             'statusCode': 500,
             'body': json.dumps(f'Error: {str(e)}')
@@ -191,23 +236,32 @@ def lambda_handler(event, context):
 
 # Utility to log user actions
 def log_action(update, context, handler_name, extra_info=None):
-    user_id = getattr(update.effective_user, 'id', None)
-    chat_id = getattr(update.effective_chat, 'id', None)
-    msg = f"[Handler: {handler_name}] [User: {user_id}] [Chat: {chat_id}] "
+    # Structured fields only; the message is built (or sampled away) on the log writer thread
+    fields = {
+        'handler': handler_name,
+        'user': getattr(update.effective_user, 'id', None),
+        'chat': getattr(update.effective_chat, 'id', None),
+    }
     if update.message:
-        msg += f"[Text: {update.message.text}] "
+        fields['text'] = update.message.text
     if update.callback_query:
-        msg += f"[Callback: {update.callback_query.data}] "
+        fields['callback'] = update.callback_query.data
     if extra_info:
-        msg += f"[Info: {extra_info}] "
-    logging.info(msg)
+        fields['info'] = extra_info
+    logging.info("[Handler: %s] [User: %s] [Chat: %s]", handler_name, fields['user'], fields['chat'], extra={'fields': fields})
 
+@recorder.recorded('explorer')
 def get_token_balances_from_explorer(address):
-    url = f"https://explorer.inkonchain.com/api/v2/addresses/{address}/token-balances"
-    try:
+    url = f"{EXPLORER_URL}/api/v2/addresses/{address}/token-balances"
+
+    @admission.guard('explorer')
+    def fetch():
         resp = requests.get(url, headers={"accept": "application/json"}, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        return resp.json()
+    try:
+        # The last known balances stand in while the explorer is down
+        data, _ = admission.read(('tokens', address), fetch)
         tokens = []
         for entry in data:
             try:
@@ -224,18 +278,131 @@ def get_token_balances_from_explorer(address):
                         "decimals": decimals # Store decimals for accurate conversion later
                     })
             except Exception as e:
-                logging.warning(f"Error parsing token entry for {address}: {e} - Entry: {entry}")
+                logging.warning("Error parsing token entry for %s: %s - Entry: %s", address, e, entry)
                 pass
         return tokens
     except Exception as e:
-        logging.error(f"Error fetching token balances from explorer.inkonchain.com for {address}: {e}")
+        logging.error("Error fetching token balances from explorer.inkonchain.com for %s: %s", address, e)
         return []
 
+def view_wallet_address(telegram_id):
+    """
+    The user's wallet address (None without one) for read-only views, and its age in seconds:
+    while DynamoDB is degraded the last known address is shown instead (see admission.read).
+    """
+    return admission.read(('wallet', telegram_id), lambda: wallet_utils.get_wallet(telegram_id)[0])
+
+def stale_note(age):
+    return f"\n\n⚠️ <i>Shown as of {age:.0f}s ago; the network is degraded right now.</i>" if age else ""
+
+def trade_queue_reporter(query):
+    """on_position callback of admission.run_trade: keeps a queued trade's place in line on its message."""
+    async def show(position):
+        if position:
+            text = f"⏳ <b>Trade queued</b> — position {position} in line. It will be sent shortly."
+        else:
+            text = "⏳ <b>Sending swap...</b>"
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=None)
+    return show
+
+async def degraded_error_handler(update, context):
+    """Tells the user when a handler was refused by an open circuit breaker or a full trade queue."""
+    if not isinstance(context.error, (admission.Unavailable, admission.Busy)):
+        logging.error("Unhandled error in handler: %s", context.error, exc_info=context.error)
+        return
+    logging.warning("[Admission] Refused update: %s", context.error)
+    if isinstance(update, Update) and update.effective_chat:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"⚠️ {context.error}",
+                                       reply_markup=main_menu_inline_keyboard)
+
+def quote_summary_lines(token_in, token_out, amount_in, out_decimals, out_symbol, fee_on_output=False):
+    """
+    Expected-output lines for the buy/sell confirm screens, quoted on the best route from the pool cache.
+    Blocking: a stale cache, a cache miss or an unseen token reaches the chain, so handlers run it in a worker thread.
+    """
+    quote = routing.best_route(token_in, token_out, amount_in)
+    if 'error' in quote:
+        logging.warning("Quote unavailable for %s -> %s: %s", token_in, token_out, quote['error'])
+        return "• <b>Expected:</b> <code>unavailable</code>\n"
+    amount_out, amount_out_min = quote['amount_out'], quote['amount_out_min']
+    if fee_on_output:
+        # Sells pay the 1% fee out of the ETH received
+        amount_out -= swap_handler.calculate_fee(amount_out)
+        amount_out_min -= swap_handler.calculate_fee(amount_out_min)
+    lines = (
+        f"• <b>Expected:</b> <code>{amount_out / (10 ** out_decimals):,.6f} {out_symbol}</code>\n"
+        f"• <b>Minimum received:</b> <code>{amount_out_min / (10 ** out_decimals):,.6f} {out_symbol}</code> ({SLIPPAGE_BPS / 100:.1f}% slippage)\n"
+    )
+    if len(quote['hops']) > 1:
+        via = html.escape(token_metadata.get(quote['hops'][0]['token_out'])['symbol'])
+        lines += f"• <b>Route:</b> <code>via {via} ({quote['protocol'].upper()})</code>\n"
+    if quote['price_impact'] is not None:
+        lines += f"• <b>Price impact:</b> <code>{quote['price_impact'] * 100:.2f}%</code>\n"
+        if quote['price_impact'] * 10000 >= PRICE_IMPACT_WARN_BPS:
+            lines += "⚠️ <b>High price impact!</b> Consider a smaller amount.\n"
+    return lines
+
+def settle_buy(record, receipt):
+    """tx_tracker hook: a mined buy owes its fee, which is collected by a later fee_ledger sweep."""
+    fee = record['data'].get('fee')
+    if int(receipt['status'], 16) != 1 or not fee:
+        return None
+    fee_ledger.accrue(record['telegram_id'], record['address'], fee, record['tx_hash'])
+    fee_ledger.sweep_due(record['address'])
+    return f"• <b>Fee:</b> <code>{fee / 1e18:,.6f} ETH</code> (1%, collected in a batched sweep)\n"
+
+def settle_sell(record, receipt):
+    """
+    tx_tracker hook: V3 sells unwrap and take the fee in the swap itself. Sells recorded before
+    that (with 'unwrap') paid out WETH, which is unwrapped here before the fee is taken.
+    """
+    if int(receipt['status'], 16) != 1:
+        return None
+    if record['data'].get('fee_in_swap'):
+        eth_out = tx_tracker.eth_unwrapped(receipt)
+        fee = swap_handler.calculate_fee(eth_out)
+        return f"• <b>Net proceeds:</b> <code>{(eth_out - fee) / 1e18:,.6f} ETH</code> (after 1% fee)\n"
+    if not record['data'].get('unwrap'):
+        return None
+    weth = Web3.to_checksum_address(ROUTERS[0]['weth'])
+    weth_received = tx_tracker.tokens_received(receipt, record['address']).get(weth, 0)
+    if not weth_received:
+        return None
+    address, encrypted_pk = wallet_utils.get_wallet(record['telegram_id'])
+    unwrap_hash = swap_handler.unwrap_weth(address, wallet_utils.decrypt_private_key(encrypted_pk), weth_received)
+    tx_tracker.track(unwrap_hash, 'unwrap', record['chat_id'], record['telegram_id'], address)
+    return f"⏳ <b>Unwrapping</b> <code>{weth_received / 1e18:,.6f} WETH</code> to ETH...\n"
+
+def settle_unwrap(record, receipt):
+    """tx_tracker hook: accrues the 1% sell fee on the ETH a (legacy) unwrap produced."""
+    if int(receipt['status'], 16) != 1:
+        return None
+    eth_delta = tx_tracker.eth_unwrapped(receipt)
+    if not eth_delta:
+        return "⚠️ <b>No ETH received from unwrap, fee not applied.</b>\n"
+    fee = swap_handler.calculate_fee(eth_delta)
+    fee_ledger.accrue(record['telegram_id'], record['address'], fee, record['tx_hash'])
+    fee_ledger.sweep_due(record['address'])
+    return f"• <b>Net proceeds:</b> <code>{(eth_delta - fee) / 1e18:,.6f} ETH</code> (after 1% fee)\n"
+
+def wallet_private_key(telegram_id):
+    if telegram_id == batcher.EXECUTOR_ID:
+        return BATCH_EXECUTOR_KEY
+    return wallet_utils.decrypt_private_key(wallet_utils.get_wallet(telegram_id)[1])
+
+tx_tracker.add_hook('buy', settle_buy)
+tx_tracker.add_hook('sell', settle_sell)
+tx_tracker.add_hook('unwrap', settle_unwrap)
+# Lets the tracker re-sign stuck transactions with a bumped gas price, and the ledger sign fee sweeps
+tx_tracker.set_signer(wallet_private_key)
+fee_ledger.set_signer(wallet_private_key)
+
 def is_valid_eth_address(address):
     return isinstance(address, str) and address.startswith('0x') and len(address) == 42 and Web3.is_checksum_address(address)
 
 
 # --- Main Menu Handlers ---
+@tracing.handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'start')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -248,7 +415,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
     telegram_id = str(update.effective_user.id)
-    address, _ = wallet_utils.get_wallet(telegram_id)
+    address, age = view_wallet_address(telegram_id)
     if not address:
         address, encrypted_pk = wallet_utils.create_wallet()
         wallet_utils.store_wallet(telegram_id, address, encrypted_pk)
@@ -257,6 +424,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👛 <b>Your wallet:</b> <code>{address}</code>\n"
         f"🌉 <b>Bridge ETH to Ink:</b> <a href='{BRIDGE_URL}'>{BRIDGE_URL}</a>\n\n"
         "💡 <i>Use the menu below or type a command.</i>"
+        + stale_note(age)
     )
     if update.message:
         await update.message.reply_text(msg, parse_mode='HTML', disable_web_page_preview=True,
@@ -271,6 +439,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     return ConversationHandler.END
 
+@tracing.handler
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'menu')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -282,13 +451,13 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text="❗️ Unable to determine your user ID.",
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
-    wallet = wallet_utils.get_wallet(str(update.effective_user.id))
-    address = wallet[0] if wallet and wallet[0] else None
+    address, age = view_wallet_address(str(update.effective_user.id))
     msg = (
         "🦑 <b>Welcome to <i>Inky Buy Bot</i>!</b>\n\n"
         f"👛 <b>Your wallet:</b> <code>{address if address else 'N/A'}</code>\n"
         f"🌉 <b>Bridge ETH to Ink:</b> <a href='{BRIDGE_URL}'>{BRIDGE_URL}</a>\n\n"
         "💡 <i>Use the menu below or type a command.</i>"
+        + stale_note(age)
     )
     if update.message:
         await update.message.reply_text(msg, parse_mode='HTML', disable_web_page_preview=True, reply_markup=main_menu_inline_keyboard)
@@ -301,6 +470,7 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     return ConversationHandler.END
 
+@tracing.handler
 async def manage_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'manage_wallet')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -323,6 +493,7 @@ async def manage_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@tracing.handler
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'back_to_menu')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -330,6 +501,7 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await start(update, context)
     return ConversationHandler.END
 
+@tracing.handler
 async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'wallet')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -342,7 +514,7 @@ async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
     telegram_id = str(update.effective_user.id)
-    address, _ = wallet_utils.get_wallet(telegram_id)
+    address, age = view_wallet_address(telegram_id)
     if not address:
         response_text = "❗️ <b>No wallet found.</b> Use /start to create one."
         if update.message:
@@ -358,7 +530,8 @@ async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     try:
-        balance_wei = w3.eth.get_balance(address)
+        balance_wei, balance_age = admission.read(('balance', address), lambda: w3.eth.get_balance(address))
+        age = max(age, balance_age)
         balance_eth = balance_wei / 1e18
         balance_str = f"{balance_eth:.6f} ETH"
     except Exception as e:
@@ -368,6 +541,7 @@ async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👛 <b>Your wallet:</b> <code>{address}</code>\n"
         f"💰 <b>Balance:</b> <code>{balance_str}</code>\n"
         f"🌉 <b>Bridge ETH:</b> <a href='{BRIDGE_URL}'>{BRIDGE_URL}</a>"
+        + stale_note(age)
     )
     if update.message:
         await update.message.reply_text(msg, parse_mode='HTML', disable_web_page_preview=True, reply_markup=main_menu_inline_keyboard)
@@ -381,6 +555,7 @@ async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     return ConversationHandler.END
 
+@tracing.handler
 async def export_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'export_keys')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -422,6 +597,7 @@ async def export_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@tracing.handler
 async def reset_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'reset_wallet')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -451,11 +627,12 @@ async def reset_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # --- Buy Flow (Token First, Inline Only) ---
+@tracing.handler
 async def buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'buy')
     if hasattr(context, 'user_data') and context.user_data is not None:
         context.user_data.clear()
-    prompt = "🛒 <b>Buy Tokens</b>\n\n⚠️ <b>Only Inky Factory contracts can be traded.</b>\n\n🔗 <b>Enter the token address you want to buy:</b>"
+    prompt = "🛒 <b>Buy Tokens</b>\n\n⚠️ <b>Only Inky Factory contracts can be traded.</b>\n\n🔗 <b>Enter the token address (or symbol to search) you want to buy:</b>"
     if update.callback_query:
         await update.callback_query.answer()
         if update.effective_chat:
@@ -483,31 +660,13 @@ async def buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return BUY_TOKEN
     return ConversationHandler.END
 
-# --- V3 Pool Existence Check ---
-def is_token_in_v3_pool(token_address):
-    v3_router = next(r for r in ROUTERS if r['type'] == 'v3')
-    factory_address = v3_router['factory']
-    fee = v3_router['fee']
-    weth = v3_router['weth']
-    V3_FACTORY_ABI = [{
-        "inputs": [
-            {"internalType": "address", "name": "tokenA", "type": "address"},
-            {"internalType": "address", "name": "tokenB", "type": "address"},
-            {"internalType": "uint24", "name": "fee", "type": "uint24"}
-        ],
-        "name": "getPool",
-        "outputs": [{"internalType": "address", "name": "pool", "type": "address"}],
-        "stateMutability": "view",
-        "type": "function"
-    }]
-    factory = w3.eth.contract(address=Web3.to_checksum_address(factory_address), abi=V3_FACTORY_ABI)
-    try:
-        pool = factory.functions.getPool(weth, Web3.to_checksum_address(token_address), fee).call()
-        return pool != "0x0000000000000000000000000000000000000000"
-    except Exception as e:
-        print(f"[V3 Pool Check] Error: {e}")
-        return False
+# --- Route Existence Check ---
+def is_token_tradable(token_address):
+    # Route tables are a dict lookup; only tokens the index hasn't seen (yet) hit the factories, and one
+    # without a WETH pool does so at most once per NO_ROUTE_TTL. Handlers call it in a worker thread.
+    return routing.has_route(token_address)
 
+@tracing.handler
 async def buy_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'buy_token')
     if update.callback_query:
@@ -531,18 +690,33 @@ async def buy_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return BUY_TOKEN
     text = update.message.text.strip() if update.message and update.message.text else ""
     if not is_valid_eth_address(text):
+        matches = pool_index.search(text) if text and not text.startswith('0x') else []
+        if matches:
+            msg = f"🔎 <b>Tokens matching</b> <code>{text}</code>:\n"
+            for t in matches:
+                msg += f"• <code>{html.escape(t['symbol'])}</code>: <code>{t['address']}</code>\n"
+            msg += "\n🔗 <b>Enter the token address you want to buy:</b>"
+            await update.message.reply_text(msg, parse_mode='HTML', reply_markup=ForceReply(selective=True))
+            return BUY_TOKEN
         if update.message:
             await update.message.reply_text(
-                "❗️ <b>Invalid token address. Enter a valid token address (0x...):</b>",
+                "❗️ <b>Invalid token address. Enter a valid token address (0x...) or a token symbol:</b>",
                 parse_mode='HTML', reply_markup=ForceReply(selective=True))
         return BUY_TOKEN
-    # --- V3 POOL CHECK ---
-    if not is_token_in_v3_pool(text):
+    # --- ROUTE CHECK ---
+    if not await asyncio.to_thread(is_token_tradable, text):
         if update.message:
             await update.message.reply_text(
-                "❗️ <b>This token cannot be traded. No Inky Factory pool exists for this token.</b>",
+                "❗️ <b>This token cannot be traded. No pool or route to WETH exists for this token.</b>",
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
+    # --- TAX / HONEYPOT CHECK ---
+    blocked, warning = await asyncio.to_thread(token_profile.assess, text, 'buy')
+    if blocked:
+        if update.message:
+            await update.message.reply_text(
+                f"⛔️ <b>{warning}</b>", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
+        return ConversationHandler.END
     if not update.effective_user:
         if update.message:
             await update.message.reply_text(
@@ -550,6 +724,13 @@ async def buy_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
     context.user_data['buy_token_address'] = text
+    try:
+        metadata = token_metadata.get(text)
+    except Exception as e:
+        logging.warning("Token metadata unavailable for %s: %s", text, e)
+        metadata = {'symbol': 'tokens', 'decimals': 18}
+    context.user_data['buy_token_symbol'] = html.escape(metadata['symbol'])
+    context.user_data['buy_token_decimals'] = metadata['decimals']
     telegram_id = str(update.effective_user.id)
     wallet = wallet_utils.get_wallet(telegram_id)
     if not wallet or not wallet[0]:
@@ -560,19 +741,24 @@ async def buy_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     address = wallet[0]
     try:
-        balance_wei = w3.eth.get_balance(address)
+        # Fees owed to the fee wallet stay in the wallet until swept, so they can't be spent on a buy
+        balance_wei = max(0, w3.eth.get_balance(address) - fee_ledger.reserved(address))
+        context.user_data['buy_eth_balance'] = balance_wei
         balance_eth = balance_wei / 1e18
         balance_str = f"{balance_eth:.6f} ETH"
     except Exception:
+        context.user_data.pop('buy_eth_balance', None)
         balance_str = "(unavailable)"
     if update.message:
         await update.message.reply_text(
-            text=f"💰 <b>Your ETH balance:</b> <code>{balance_str}</code>\nHow much ETH do you want to swap?",
+            text=(f"⚠️ <b>{warning}</b>\n\n" if warning else "") +
+                 f"💰 <b>Your ETH balance:</b> <code>{balance_str}</code>\nHow much ETH do you want to swap?",
             parse_mode='HTML',
             reply_markup=ForceReply(selective=True)
         )
     return BUY_AMOUNT
 
+@tracing.handler
 async def buy_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'buy_amount')
     
@@ -592,13 +778,22 @@ async def buy_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if eth_amount <= 0:
             raise ValueError
         context.user_data['buy_eth_amount'] = int(eth_amount * 1e18)
+        balance_wei = context.user_data.get('buy_eth_balance')
+        if balance_wei is not None and context.user_data['buy_eth_amount'] > balance_wei:
+            await update.message.reply_text("❗️ <b>Buy amount exceeds your available ETH balance, please enter a valid amount.</b>", parse_mode='HTML', reply_markup=ForceReply(selective=True))
+            return BUY_AMOUNT
         token_address = context.user_data['buy_token_address']
         eth_amount_display = eth_amount
+        swap_amount = context.user_data['buy_eth_amount'] - swap_handler.calculate_fee(context.user_data['buy_eth_amount'])
+        token_symbol = context.user_data.get('buy_token_symbol', 'tokens')
+        quote_lines = await asyncio.to_thread(quote_summary_lines, ROUTERS[0]['weth'], token_address, swap_amount,
+                                              context.user_data.get('buy_token_decimals', 18), token_symbol)
         
         msg = (
             f"🛒 <b>Swap Summary</b>\n"
             f"• <b>Amount:</b> <code>{eth_amount_display:.4f} ETH</code>\n"
-            f"• <b>Token:</b> <code>{token_address}</code>\n\n"
+            f"• <b>Token:</b> <code>{token_symbol}</code> (<code>{token_address}</code>)\n"
+            f"{quote_lines}\n"
             "Do you want to proceed?"
         )
         keyboard = InlineKeyboardMarkup([
@@ -616,6 +811,7 @@ async def buy_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                          reply_markup=keyboard)
         return BUY_AMOUNT
 
+@tracing.handler
 async def buy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'buy_confirm')
     query = update.callback_query
@@ -632,7 +828,19 @@ async def buy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         token_address = context.user_data['buy_token_address']
         await query.edit_message_text("⏳ <b>Sending swap...</b>", parse_mode='HTML', reply_markup=None)
         try:
-            result = swap_handler.execute_buy(address, private_key, eth_amount, token_address)
+            if batcher.enabled():
+                # Filled together with other users' buys of this token in one swap
+                result = await asyncio.to_thread(batcher.submit_buy, telegram_id, query.message.chat_id, address, private_key,
+                                                 eth_amount, token_address)
+                if 'error' not in result:
+                    await query.edit_message_text(
+                        f"⏳ <b>Buy queued!</b> It will be filled with other buys of this token within {BATCH_WINDOW:g}s. You'll get a message here once it's confirmed.",
+                        parse_mode='HTML', reply_markup=None)
+                    await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
+                    return ConversationHandler.END
+            else:
+                result = await admission.run_trade(swap_handler.execute_buy, address, private_key, eth_amount, token_address,
+                                                   on_position=trade_queue_reporter(query))
             if 'error' in result:
                 await query.edit_message_text(f"❌ <b>Error:</b> {result['error']}", parse_mode='HTML', reply_markup=None)
                 await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
@@ -640,12 +848,13 @@ async def buy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 tx_hash = result['tx_hash']
                 if not tx_hash.startswith('0x'):
                     tx_hash = '0x' + tx_hash
+                tx_tracker.track(tx_hash, 'buy', query.message.chat_id, telegram_id, address, {'fee': result['fee']})
                 await query.edit_message_text(
-                    f"✅ <b>Success!</b>\n<a href='https://explorer.inkonchain.com/tx/{tx_hash}'>View on Explorer</a>",
+                    f"⏳ <b>Swap submitted!</b> You'll get a message here once it's confirmed.\n<a href='https://explorer.inkonchain.com/tx/{tx_hash}'>View on Explorer</a>",
                     parse_mode='HTML', disable_web_page_preview=True, reply_markup=None)
                 await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         except Exception as e:
-            print(f"Error executing buy swap: {e}")
+            logging.error("Error executing buy swap: %s", e)
             await query.edit_message_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=None)
             await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     else: # buy_cancel
@@ -654,6 +863,7 @@ async def buy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # --- Sell Flow (Robust) ---
+@tracing.handler
 async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'sell')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -697,7 +907,7 @@ async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for t in tokens:
             # Format balance with commas and two decimals
             formatted_balance = f"{t['balance']:,.2f}"
-            msg += f"• <code>{t['symbol']}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
+            msg += f"• <code>{html.escape(t['symbol'])}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
         msg += "\n🔗 <b>Enter the token address you want to sell:</b>"
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("⬅️ Back to Menu", callback_data="menu_home")]
@@ -716,7 +926,7 @@ async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(chat_id=update.effective_chat.id, text="Please enter the token address...", reply_markup=ForceReply(selective=True))
         return SELL_TOKEN
     except Exception as e:
-        print(f"Error in sell: {e}")
+        logging.error("Error in sell: %s", e)
         if update.callback_query:
             await update.callback_query.edit_message_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         elif update.message:
@@ -728,6 +938,7 @@ async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
 
+@tracing.handler
 async def sell_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'sell_token')
     
@@ -743,11 +954,11 @@ async def sell_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "❗️ <b>Invalid token address. Enter a valid token address (0x...):</b>",
                 parse_mode='HTML', reply_markup=ForceReply(selective=True))
         return SELL_TOKEN
-    # --- V3 POOL CHECK ---
-    if not is_token_in_v3_pool(token_address):
+    # --- ROUTE CHECK ---
+    if not await asyncio.to_thread(is_token_tradable, token_address):
         if update.message:
             await update.message.reply_text(
-                "❗️ <b>This token cannot be sold. No Inky Factory pool exists for this token.</b>",
+                "❗️ <b>This token cannot be sold. No pool or route to WETH exists for this token.</b>",
                 parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return SELL_TOKEN
 
@@ -769,8 +980,12 @@ async def sell_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❗️ <b>Token not found in your wallet or invalid address.</b> Please enter a valid token address:", parse_mode='HTML', reply_markup=ForceReply(selective=True))
             return SELL_TOKEN
         
+        # On-chain metadata is authoritative; the explorer's copy can be missing or stale
+        metadata = token_metadata.get(token_address)
         context.user_data['sell_token_balance'] = token['balance']
-        context.user_data['sell_token_decimals'] = token['decimals'] # Store decimals
+        context.user_data['sell_token_decimals'] = metadata['decimals']
+        context.user_data['sell_token_symbol'] = html.escape(metadata['symbol'])
+        _, warning = await asyncio.to_thread(token_profile.assess, token_address, 'sell')
         
         keyboard = InlineKeyboardMarkup([
             [
@@ -786,15 +1001,17 @@ async def sell_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
         
         await update.message.reply_text(
-            f"<b>{token['symbol']}</b> balance: <b>{token['balance']:.6f}</b>\nSelect the percentage to sell, or enter a specific amount:",
+            (f"⚠️ <b>{warning}</b>\n\n" if warning else "") +
+            f"<b>{html.escape(metadata['symbol'])}</b> balance: <b>{token['balance']:.6f}</b>\nSelect the percentage to sell, or enter a specific amount:",
             parse_mode='HTML', reply_markup=keyboard)
         
         return SELL_AMOUNT
     except Exception as e:
-        print(f"Error in sell_token: {e}")
+        logging.error("Error in sell_token: %s", e)
         await update.message.reply_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
 
+@tracing.handler
 async def sell_amount_percent(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'sell_amount_percent')
     query = update.callback_query
@@ -825,10 +1042,15 @@ async def sell_amount_percent(update: Update, context: ContextTypes.DEFAULT_TYPE
     token_address = context.user_data['sell_token_address']
     token_symbol = context.user_data.get('sell_token_symbol', 'Token')
     
+    token_decimals = context.user_data.get('sell_token_decimals', 18)
+    quote_lines = await asyncio.to_thread(quote_summary_lines, token_address, ROUTERS[0]['weth'], int(amount * (10**token_decimals)),
+                                          18, 'ETH', fee_on_output=True)
+    
     msg = (
         f"💸 <b>Sell Summary</b>\n"
         f"• <b>Token:</b> <code>{token_address}</code>\n"
-        f"• <b>Amount:</b> <code>{amount:.6f} {token_symbol}</code>\n\n"
+        f"• <b>Amount:</b> <code>{amount:.6f} {token_symbol}</code>\n"
+        f"{quote_lines}\n"
         "Do you want to proceed?"
     )
     keyboard = InlineKeyboardMarkup([
@@ -838,6 +1060,7 @@ async def sell_amount_percent(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.edit_message_text(msg, parse_mode='HTML', reply_markup=keyboard)
     return SELL_CONFIRM
 
+@tracing.handler
 async def sell_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'sell_amount')
     # This handler processes text input for the amount.
@@ -870,13 +1093,19 @@ async def sell_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❗️ <b>Insufficient token balance or invalid amount.</b> Please enter a valid amount:", parse_mode='HTML', reply_markup=ForceReply(selective=True))
             return SELL_AMOUNT
 
+        metadata = token_metadata.get(token_address)
         context.user_data['sell_token_amount'] = amount # Store as float for display, convert to int(wei) later for transaction
-        context.user_data['sell_token_decimals'] = token['decimals'] # Ensure decimals are stored
+        context.user_data['sell_token_decimals'] = metadata['decimals'] # Ensure decimals are stored
+        context.user_data['sell_token_symbol'] = html.escape(metadata['symbol'])
+
+        quote_lines = await asyncio.to_thread(quote_summary_lines, token_address, ROUTERS[0]['weth'], int(amount * (10**metadata['decimals'])),
+                                              18, 'ETH', fee_on_output=True)
 
         msg = (
             f"💸 <b>Sell Summary</b>\n"
             f"• <b>Token:</b> <code>{token_address}</code>\n"
-            f"• <b>Amount:</b> <code>{amount}</code>\n\n"
+            f"• <b>Amount:</b> <code>{amount} {html.escape(metadata['symbol'])}</code>\n"
+            f"{quote_lines}\n"
             "Do you want to proceed?"
         )
         keyboard = InlineKeyboardMarkup([
@@ -889,10 +1118,11 @@ async def sell_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❗️ <b>Please enter a valid numeric amount.</b>", parse_mode='HTML', reply_markup=ForceReply(selective=True))
         return SELL_AMOUNT
     except Exception as e:
-        print(f"Error in sell_amount: {e}")
+        logging.error("Error in sell_amount: %s", e)
         await update.message.reply_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
 
+@tracing.handler
 async def sell_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'sell_confirm')
     query = update.callback_query
@@ -917,7 +1147,8 @@ async def sell_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await query.edit_message_text("⏳ <b>Sending swap...</b>", parse_mode='HTML', reply_markup=None)
         try:
-            result = swap_handler.execute_sell(address, private_key, token_address, amount_wei)
+            result = await admission.run_trade(swap_handler.execute_sell, address, private_key, token_address, amount_wei,
+                                               on_position=trade_queue_reporter(query))
             if 'error' in result:
                 await query.edit_message_text(f"❌ <b>Error:</b> {result['error']}", parse_mode='HTML', reply_markup=None)
                 await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
@@ -925,12 +1156,14 @@ async def sell_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 tx_hash = result['tx_hash']
                 if not tx_hash.startswith('0x'):
                     tx_hash = '0x' + tx_hash
+                tx_tracker.track(result['approve_hash'], 'approve', query.message.chat_id, telegram_id, address)
+                tx_tracker.track(tx_hash, 'sell', query.message.chat_id, telegram_id, address, {'fee_in_swap': result['fee_in_swap']})
                 await query.edit_message_text(
-                    f"✅ <b>Sell sent!</b>\n<a href='https://explorer.inkonchain.com/tx/{tx_hash}'>View on Explorer</a>",
+                    f"⏳ <b>Sell submitted!</b> You'll get a message here once it's confirmed.\n<a href='https://explorer.inkonchain.com/tx/{tx_hash}'>View on Explorer</a>",
                     parse_mode='HTML', disable_web_page_preview=True, reply_markup=None)
                 await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         except Exception as e:
-            print(f"Error executing sell swap: {e}")
+            logging.error("Error executing sell swap: %s", e)
             await query.edit_message_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=None)
             await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     else: # sell_cancel
@@ -939,6 +1172,7 @@ async def sell_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # --- Withdraw Flow (Revised) ---
+@tracing.handler
 async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'withdraw')
     if hasattr(context, 'user_data') and context.user_data is not None:
@@ -963,7 +1197,7 @@ async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         return WITHDRAW_TYPE
     except Exception as e:
-        logging.error(f"Error in withdraw: {e}")
+        logging.error("Error in withdraw: %s", e)
         if effective_chat_id:
             await context.bot.send_message(
                 chat_id=effective_chat_id,
@@ -973,6 +1207,7 @@ async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         return ConversationHandler.END
 
+@tracing.handler
 async def withdraw_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'withdraw_type')
     query = update.callback_query
@@ -994,6 +1229,7 @@ async def withdraw_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     return WITHDRAW_RECIPIENT_ADDRESS # Changed from WITHDRAW_ADDRESS to reflect new state name
 
+@tracing.handler
 async def withdraw_recipient_address(update: Update, context: ContextTypes.DEFAULT_TYPE): # Renamed function
     log_action(update, context, 'withdraw_recipient_address')
     
@@ -1037,7 +1273,8 @@ async def withdraw_recipient_address(update: Update, context: ContextTypes.DEFAU
 
     try:
         if context.user_data.get('withdraw_type') == 'eth':
-            balance_wei = w3.eth.get_balance(user_address)
+            # Fees owed to the fee wallet are swept before the withdrawal, so they can't be withdrawn
+            balance_wei = max(0, w3.eth.get_balance(user_address) - fee_ledger.reserved(user_address))
             balance_eth = balance_wei / 1e18
             context.user_data['withdraw_eth_balance'] = balance_eth
             await update.message.reply_text(
@@ -1059,7 +1296,7 @@ async def withdraw_recipient_address(update: Update, context: ContextTypes.DEFAU
             msg = "<b>Your tokens available for withdrawal:</b>\n"
             for t in tokens:
                 formatted_balance = f"{t['balance']:,.2f}"
-                msg += f"• <code>{t['symbol']}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
+                msg += f"• <code>{html.escape(t['symbol'])}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
             msg += "\n🔗 <b>Enter the token address you want to withdraw:</b>"
             
             await update.message.reply_text(
@@ -1069,10 +1306,11 @@ async def withdraw_recipient_address(update: Update, context: ContextTypes.DEFAU
             )
             return WITHDRAW_TOKEN_SELECT
     except Exception as e:
-        logging.error(f"Error in withdraw_recipient_address: {e}")
+        logging.error("Error in withdraw_recipient_address: %s", e)
         await update.message.reply_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
 
+@tracing.handler
 async def withdraw_token_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'withdraw_token_select')
     
@@ -1105,18 +1343,18 @@ async def withdraw_token_select(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Store token info in context
         context.user_data['withdraw_token_address'] = selected_token['address']
-        context.user_data['withdraw_token_symbol'] = selected_token['symbol']
+        context.user_data['withdraw_token_symbol'] = html.escape(selected_token['symbol'])
         context.user_data['withdraw_token_balance'] = selected_token['balance']
         context.user_data['withdraw_token_decimals'] = selected_token.get('decimals', 18) # Store decimals
 
         # Ask for withdrawal amount
         formatted_balance = f"{selected_token['balance']:,.6f}" # Display more decimals for tokens
         msg = (
-            f"💰 <b>Withdraw {selected_token['symbol']}</b>\n"
+            f"💰 <b>Withdraw {context.user_data['withdraw_token_symbol']}</b>\n"
             f"• <b>Token:</b> <code>{selected_token['address']}</code>\n"
-            f"• <b>Your Balance:</b> <b>{formatted_balance} {selected_token['symbol']}</b>\n"
+            f"• <b>Your Balance:</b> <b>{formatted_balance} {context.user_data['withdraw_token_symbol']}</b>\n"
             f"• <b>Recipient:</b> <code>{context.user_data['withdraw_recipient']}</code>\n\n"
-            f"💬 <b>Enter the amount of {selected_token['symbol']} to withdraw:</b>"
+            f"💬 <b>Enter the amount of {context.user_data['withdraw_token_symbol']} to withdraw:</b>"
         )
         await update.message.reply_text(msg, parse_mode='HTML', reply_markup=ForceReply(selective=True))
         return WITHDRAW_AMOUNT
@@ -1164,7 +1402,7 @@ async def withdraw_token_select(update: Update, context: ContextTypes.DEFAULT_TY
     msg = "<b>Your tokens available for withdrawal:</b>\n"
     for t in tokens:
         formatted_balance = f"{t['balance']:,.2f}"
-        msg += f"• <code>{t['symbol']}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
+        msg += f"• <code>{html.escape(t['symbol'])}</code>: <b>{formatted_balance}</b> (<code>{t['address']}</code>)\n"
     msg += "\n🔗 <b>Enter the token address you want to withdraw:</b>"
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("⬅️ Back to Menu", callback_data="menu_home")]
@@ -1182,6 +1420,7 @@ async def withdraw_token_select(update: Update, context: ContextTypes.DEFAULT_TY
     return WITHDRAW_TOKEN_SELECT
 
 
+@tracing.handler
 async def withdraw_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'withdraw_amount')
     
@@ -1236,11 +1475,31 @@ async def withdraw_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❗️ <b>Please enter a valid numeric amount.</b>", parse_mode='HTML', reply_markup=ForceReply(selective=True))
         return WITHDRAW_AMOUNT
     except Exception as e:
-        logging.error(f"Error in withdraw_amount: {e}")
+        logging.error("Error in withdraw_amount: %s", e)
         await update.message.reply_text(f"❌ <b>Error:</b> {e}", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         return ConversationHandler.END
 
 
+def send_withdrawal(address, private_key, recipient, value, token_address=None):
+    """
+    Sends value wei of ETH (or of token_address) from the wallet to recipient and returns the tx
+    hash. ETH withdrawals sweep owed fees first. Blocking: holds the wallet lease.
+    """
+    if token_address is None:
+        fee_ledger.sweep(address)
+    with wallet_lock.hold(address) as wallet:
+        if token_address is None:
+            # 21000 is the standard ETH transfer gas limit
+            tx = tx_codec.transaction(address, recipient, b'', wallet.nonce, 21000, w3.eth.gas_price, value)
+        else:
+            data = tx_codec.encode_call('transfer', tx_codec.checksum(recipient), value)
+            # 60000 is a common gas limit for ERC-20 transfers, but can vary
+            tx = tx_codec.transaction(address, token_address, data, wallet.nonce, 60000, w3.eth.gas_price)
+        tx_hash = broadcast.send_raw_transaction(tx_codec.sign(tx, private_key))
+        wallet.used(tx['nonce'])
+    return tx_hash
+
+@tracing.handler
 async def withdraw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'withdraw_confirm')
     query = update.callback_query
@@ -1268,62 +1527,27 @@ async def withdraw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             if withdraw_type == 'eth':
                 value = int(amount * 1e18) # Convert ETH to Wei
-                nonce = w3.eth.get_transaction_count(address)
-                tx = {
-                    'to': Web3.to_checksum_address(recipient),
-                    'value': value,
-                    'gas': 21000, # Standard ETH transfer gas limit
-                    'gasPrice': w3.eth.gas_price,
-                    'nonce': nonce,
-                    'chainId': CHAIN_ID
-                }
-                signed_tx = w3.eth.account.sign_transaction(tx, private_key)
-                tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                # The sweep and the transfer wait on the wallet lease and the chain; keep them off the event loop
+                tx_hash = await asyncio.to_thread(send_withdrawal, address, private_key, recipient, value)
+                tx_tracker.track(tx_hash.hex(), 'withdraw', query.message.chat_id, telegram_id, address)
                 await query.edit_message_text(
-                    f"✅ <b>ETH sent!</b>\n<a href='https://explorer.inkonchain.com/tx/{tx_hash.hex()}'>View on Explorer</a>",
+                    f"⏳ <b>ETH withdrawal submitted!</b> You'll get a message here once it's confirmed.\n<a href='https://explorer.inkonchain.com/tx/0x{tx_hash.hex().removeprefix('0x')}'>View on Explorer</a>",
                     parse_mode='HTML', disable_web_page_preview=True, reply_markup=None)
             else: # withdraw_type is 'token'
                 token_address = context.user_data['withdraw_token_address']
                 token_decimals = context.user_data.get('withdraw_token_decimals', 18) # Get decimals from stored data
                 
-                # ERC-20 ABI for transfer function
-                erc20_abi = [
-                    {
-                        "constant": False,
-                        "inputs": [
-                            {"name": "_to", "type": "address"},
-                            {"name": "_value", "type": "uint256"}
-                        ],
-                        "name": "transfer",
-                        "outputs": [
-                            {"name": "success", "type": "bool"}
-                        ],
-                        "type": "function",
-                        "stateMutability": "nonpayable"
-                    }
-                ]
-                token_contract = w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=erc20_abi)
-                
                 value = int(amount * (10**token_decimals)) # Convert token amount to its smallest unit using correct decimals
 
-                nonce = w3.eth.get_transaction_count(address)
-                
-                tx = token_contract.functions.transfer(Web3.to_checksum_address(recipient), value).build_transaction({
-                    'from': address,
-                    'gas': 60000, # A common gas limit for ERC-20 transfers, but can vary
-                    'gasPrice': w3.eth.gas_price,
-                    'nonce': nonce,
-                    'chainId': CHAIN_ID
-                })
-                signed_tx = w3.eth.account.sign_transaction(tx, private_key)
-                tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                tx_hash = await asyncio.to_thread(send_withdrawal, address, private_key, recipient, value, token_address)
+                tx_tracker.track(tx_hash.hex(), 'withdraw', query.message.chat_id, telegram_id, address)
                 await query.edit_message_text(
-                    f"✅ <b>Token sent!</b>\n<a href='https://explorer.inkonchain.com/tx/{tx_hash.hex()}'>View on Explorer</a>",
+                    f"⏳ <b>Token withdrawal submitted!</b> You'll get a message here once it's confirmed.\n<a href='https://explorer.inkonchain.com/tx/0x{tx_hash.hex().removeprefix('0x')}'>View on Explorer</a>",
                     parse_mode='HTML', disable_web_page_preview=True, reply_markup=None)
             
             await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
         except Exception as e:
-            logging.error(f"Error executing withdrawal: {e}")
+            logging.error("Error executing withdrawal: %s", e)
             await query.edit_message_text(f"❌ <b>Error during withdrawal:</b> {e}", parse_mode='HTML', reply_markup=None)
             await context.bot.send_message(chat_id=query.message.chat_id, text="🏠 <b>Main Menu</b>\nChoose an option below.", parse_mode='HTML', reply_markup=main_menu_inline_keyboard)
     else: # withdraw_cancel
@@ -1332,10 +1556,12 @@ async def withdraw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@tracing.handler
 async def debug_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'debug_text_handler')
-    print(f"DEBUG: Received text message: {update.message.text}")
+    logging.debug("Received text message: %s", update.message.text)
 
+@tracing.handler
 async def reset_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_action(update, context, 'reset_to_menu_handler')
     query = update.callback_query
@@ -1345,14 +1571,14 @@ async def reset_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TY
     
     try:
         telegram_id = str(query.from_user.id) if query.from_user else None
-        wallet_address = wallet_utils.get_wallet(telegram_id)[0] if telegram_id else 'N/A'
+        wallet_address, age = view_wallet_address(telegram_id) if telegram_id else ('N/A', 0)
 
         await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="🦑 <b>Welcome to <i>Inky Buy Bot</i>!</b>\n\n"
                  f"👛 <b>Your wallet:</b> <code>{wallet_address}</code>\n"
                  f"🌉 <b>Bridge ETH to Ink:</b> <a href='{BRIDGE_URL}'>{BRIDGE_URL}</a>\n\n"
-                 "💡 <i>Use the menu below or type a command.</i>",
+                 "💡 <i>Use the menu below or type a command.</i>" + stale_note(age),
             parse_mode='HTML',
             disable_web_page_preview=True,
             reply_markup=main_menu_inline_keyboard
@@ -1362,16 +1588,60 @@ async def reset_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TY
         if "Message is not modified" in str(e) or "message is not found" in str(e) or "message can't be edited" in str(e):
             pass # Ignore "Message is not modified" errors or if message is gone
         else:
-            logging.error(f"Error sending main menu in reset_to_menu_handler: {e}")
+            logging.error("Error sending main menu in reset_to_menu_handler: %s", e)
             raise
     return ConversationHandler.END
 
+@tracing.handler
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [seconds]: admins only. Profiles this process for a window and sends back the results."""
+    log_action(update, context, 'profile')
+    if not update.effective_user or str(update.effective_user.id) not in ADMIN_TELEGRAM_IDS or not update.message:
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else 30
+    except ValueError:
+        seconds = 30
+    await update.message.reply_text(f"🔬 Profiling for {min(seconds, profiler.PROFILE_MAX_SECONDS):g}s...")
+    # The window outlives this update; the results are sent when it closes
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, seconds))
+
+async def send_profile(bot, chat_id, seconds):
+    results = await profiler.profile(seconds)
+    if results is None:
+        await bot.send_message(chat_id=chat_id, text="❗️ A profiling window is already open.")
+        return
+    summary, paths = results
+    await bot.send_message(chat_id=chat_id, text=f"<pre>{html.escape(summary[:4000])}</pre>", parse_mode='HTML')
+    for path in paths:
+        with open(path, 'rb') as f:
+            await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path))
+
+def start_background_workers():
+    """Threads a long-running bot process needs (polling mode, or each worker of sharded.py)."""
+    # Keep cached pool state and pair reserves current every block while polling (Lambda catches up on demand)
+    pool_state.start_streaming()
+    pair_state.start_streaming()
+    pool_index.start_indexing()
+    # Confirm broadcast transactions in the background and push their outcome to the chat
+    tx_tracker.start_tracking()
+    # Collect accrued trading fees in batched sweeps
+    fee_ledger.start_sweeping()
+    if batcher.enabled():
+        # Send cross-user batch buys as their windows close
+        batcher.start_batching()
+    # Prometheus scrape endpoint (METRICS_PORT, 0 disables it)
+    metrics.start_server()
+    # kill -USR1 <pid> profiles the running process (like /profile, results in the log and PROFILE_DIR)
+    profiler.install_signal()
+
 def main():
     app = ApplicationBuilder().token(BOT_TOKEN).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("wallet", wallet))
     app.add_handler(CommandHandler("export_keys", export_keys))
     app.add_handler(CommandHandler("reset_wallet", reset_wallet))
+    app.add_handler(CommandHandler("profile", profile))
 
     # General menu callback handlers that should not interfere with conversations
     app.add_handler(CallbackQueryHandler(wallet, pattern="^menu_wallet$"))
@@ -1476,7 +1746,11 @@ def main():
     
     # Add global debug text handler LAST, so it only catches unhandled text messages
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, debug_text_handler))
+    app.add_error_handler(degraded_error_handler)
+    if recorder.enabled():
+        recorder.install(app)
 
+    start_background_workers()
     app.run_polling()
 
 if __name__ == "__main__":
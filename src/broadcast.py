@@ -0,0 +1,99 @@
+import time
+import contextvars
+import logging
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from web3 import Web3
+from config import RPC_URL, BROADCAST_RPC_URLS, SEQUENCER_URL, BROADCAST_TIMEOUT
+import tracing
+
+# Errors that mean the endpoint already has the transaction (another endpoint's copy got there first)
+ALREADY_KNOWN_ERRORS = ('already known', 'known transaction', 'already imported')
+# Broadcasts awaiting inclusion that are remembered for time-to-inclusion metrics
+MAX_INFLIGHT = 10000
+
+
+def _label(url):
+    # Hostnames only: endpoint URLs often carry API keys
+    return 'sequencer' if url == SEQUENCER_URL else (urlsplit(url).hostname or url)
+
+
+ENDPOINTS = list(dict.fromkeys([RPC_URL] + BROADCAST_RPC_URLS + ([SEQUENCER_URL] if SEQUENCER_URL else [])))
+_clients = {url: Web3(Web3.HTTPProvider(url, request_kwargs={'timeout': BROADCAST_TIMEOUT})) for url in ENDPOINTS}
+_executor = ThreadPoolExecutor(max_workers=4 * len(ENDPOINTS), thread_name_prefix='broadcast')
+
+# endpoint label -> counters; ack latencies are per endpoint, inclusion latencies are credited to the first ack
+_stats = {_label(url): {'sent': 0, 'errors': 0, 'wins': 0, 'ack_seconds': 0.0, 'inclusions': 0, 'inclusion_seconds': 0.0}
+          for url in ENDPOINTS}
+# tx hash (lowercase, 0x-prefixed) -> {'sent_at', 'winner'}
+_inflight = {}
+_lock = threading.Lock()
+
+
+def _send(url, raw_transaction, sent_at):
+    label = _label(url)
+    try:
+        tx_hash = _clients[url].eth.send_raw_transaction(raw_transaction)
+    except Exception as e:
+        if not any(message in str(e) for message in ALREADY_KNOWN_ERRORS):
+            with _lock:
+                _stats[label]['errors'] += 1
+            raise
+        tx_hash = Web3.keccak(raw_transaction)
+    with _lock:
+        _stats[label]['sent'] += 1
+        _stats[label]['ack_seconds'] += time.time() - sent_at
+    return label, tx_hash
+
+
+@tracing.traced()
+def send_raw_transaction(raw_transaction):
+    """
+    Submits a signed transaction to every endpoint concurrently and returns the hash from the first
+    one that accepts it (slower endpoints keep going in the background). Raises the first error
+    when no endpoint accepts it.
+    """
+    sent_at = time.time()
+    # Each send runs in the caller's context, so its RPC span lands in the caller's trace
+    futures = [_executor.submit(contextvars.copy_context().run, _send, url, raw_transaction, sent_at) for url in ENDPOINTS]
+    errors = []
+    for future in as_completed(futures):
+        try:
+            label, tx_hash = future.result()
+        except Exception as e:
+            errors.append(e)
+            continue
+        with _lock:
+            _stats[label]['wins'] += 1
+            _inflight[Web3.to_hex(tx_hash).lower()] = {'sent_at': sent_at, 'winner': label}
+            if len(_inflight) > MAX_INFLIGHT:
+                _inflight.pop(next(iter(_inflight)))
+        return tx_hash
+    raise errors[0]
+
+
+def record_inclusion(tx_hash):
+    """Called once a broadcast transaction is seen mined; credits its time-to-inclusion to the first endpoint to ack it."""
+    tx_hash = tx_hash.lower() if tx_hash.startswith('0x') else '0x' + tx_hash.lower()
+    with _lock:
+        entry = _inflight.pop(tx_hash, None)
+        if entry is None:
+            return None
+        elapsed = time.time() - entry['sent_at']
+        _stats[entry['winner']]['inclusions'] += 1
+        _stats[entry['winner']]['inclusion_seconds'] += elapsed
+    logging.info("[Broadcast] %s included %.1fs after broadcast (first ack: %s)", tx_hash, elapsed, entry['winner'])
+    return elapsed
+
+
+def stats():
+    """Per-endpoint summary: acks, errors, first-ack wins, mean ack latency and mean time-to-inclusion."""
+    with _lock:
+        return {label: {
+            'sent': s['sent'],
+            'errors': s['errors'],
+            'wins': s['wins'],
+            'mean_ack_seconds': s['ack_seconds'] / s['sent'] if s['sent'] else None,
+            'mean_inclusion_seconds': s['inclusion_seconds'] / s['inclusions'] if s['inclusions'] else None,
+        } for label, s in _stats.items()}
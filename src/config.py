@@ -24,15 +24,128 @@ ROUTERS = [
 
 # Network
 RPC_URL = os.getenv("RPC_URL", "https://ink.drpc.org")
+# Extra endpoints every signed transaction is also broadcast to (comma-separated), plus an optional direct sequencer
+BROADCAST_RPC_URLS = [url.strip() for url in os.getenv("BROADCAST_RPC_URLS", "").split(",") if url.strip()]
+SEQUENCER_URL = os.getenv("SEQUENCER_URL", "")
+BROADCAST_TIMEOUT = float(os.getenv("BROADCAST_TIMEOUT", 5))  # seconds per endpoint
 CHAIN_ID = int(os.getenv("CHAIN_ID", 57073))
-EXPLORER_URL = "https://explorer.inkonchain.com"
+EXPLORER_URL = os.getenv("EXPLORER_URL", "https://explorer.inkonchain.com")
 BRIDGE_URL = "https://inkonchain.com/bridge"
 
 # Fee wallet
 FEE_WALLET = os.getenv("FEE_WALLET", "0x557bf05A32fc154203C54D9a16b7382AE3ab527a")
+FEE_BIPS = 100  # 1% trading fee
+FEE_LEDGER_FILE = os.getenv("FEE_LEDGER_FILE", "fee_ledger.json")
+FEE_LEDGER_TABLE = os.getenv("FEE_LEDGER_TABLE", "")  # DynamoDB table with partition key 'address' (string); required under Lambda
+FEE_SWEEP_THRESHOLD_WEI = int(os.getenv("FEE_SWEEP_THRESHOLD_WEI", 10 ** 16))  # sweep a wallet once it owes 0.01 ETH
+FEE_SWEEP_INTERVAL = float(os.getenv("FEE_SWEEP_INTERVAL", 24 * 3600))  # ...or once a day, whatever it owes
 
 # Encryption key
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 
 # Telegram bot token
-BOT_TOKEN = os.getenv("BOT_TOKEN") 
\ No newline at end of file
+BOT_TOKEN = os.getenv("BOT_TOKEN") 
+
+# Quoting
+QUOTER_V2 = os.getenv("QUOTER_V2", "")
+SLIPPAGE_BPS = int(os.getenv("SLIPPAGE_BPS", 300))  # 3% default, memes move fast
+POOL_STATE_TTL = float(os.getenv("POOL_STATE_TTL", 5))  # without the stream, quotes catch the pool cache up once it is this many seconds behind
+
+# Pool state streaming
+MULTICALL3 = os.getenv("MULTICALL3", "0xcA11bde05977b3631167028862bE2a173976CA11")
+POOL_STATE_POLL_INTERVAL = float(os.getenv("POOL_STATE_POLL_INTERVAL", 1))  # Ink produces a block per second
+LOG_BLOCK_RANGE = int(os.getenv("LOG_BLOCK_RANGE", 2000))  # max blocks per eth_getLogs request
+PRICE_IMPACT_WARN_BPS = int(os.getenv("PRICE_IMPACT_WARN_BPS", 500))  # warn on confirm screens above 5%
+
+# Pool discovery index
+POOL_INDEX_FILE = os.getenv("POOL_INDEX_FILE", "pool_index.json")
+POOL_INDEX_START_BLOCK = int(os.getenv("POOL_INDEX_START_BLOCK") or -1)  # earliest factory deployment block; -1 finds it on chain
+POOL_INDEX_POLL_INTERVAL = float(os.getenv("POOL_INDEX_POLL_INTERVAL", 5))
+
+# Token metadata cache
+TOKEN_METADATA_FILE = os.getenv("TOKEN_METADATA_FILE", "token_metadata.json")
+TOKEN_METADATA_RETRY = float(os.getenv("TOKEN_METADATA_RETRY", 60))  # seconds a failed symbol/decimals read is served as ?/18 before it is retried
+
+# Routing
+V3_FEE_TIERS = [100, 500, 3000, 10000]
+MAX_ROUTE_CANDIDATES = int(os.getenv("MAX_ROUTE_CANDIDATES", 4))  # routes quoted per trade, best static rank first
+NO_ROUTE_TTL = float(os.getenv("NO_ROUTE_TTL", 60))  # seconds a token found without a WETH pool is answered from memory
+V2_SWAP_FEE_BPS = int(os.getenv("V2_SWAP_FEE_BPS", 30))  # InkySwap pair fee, 0.3% like Uniswap V2
+
+# Transaction tracker
+PENDING_TX_FILE = os.getenv("PENDING_TX_FILE", "pending_txs.json")
+PENDING_TX_TABLE = os.getenv("PENDING_TX_TABLE", "")  # DynamoDB table with partition key 'tx_hash' (string); required under Lambda
+TX_TRACKER_POLL_INTERVAL = float(os.getenv("TX_TRACKER_POLL_INTERVAL", 1))  # checks once per new block
+STUCK_TX_BLOCKS = int(os.getenv("STUCK_TX_BLOCKS", 10))  # blocks a tx may sit pending before it is repriced
+TX_REPLACE_BUMP_PCT = int(os.getenv("TX_REPLACE_BUMP_PCT", 20))  # nodes require at least +10% to replace
+TX_REPLACE_MAX_GAS_MULTIPLIER = int(os.getenv("TX_REPLACE_MAX_GAS_MULTIPLIER", 10))  # cap, times the network gas price
+
+# Pre-flight simulation
+SIMULATION_BLOCK = os.getenv("SIMULATION_BLOCK", "pending")  # use "latest" for RPCs without pending-state eth_call
+SIMULATION_CACHE_TTL = float(os.getenv("SIMULATION_CACHE_TTL", 30))  # seconds a simulated trade's outcome is reused
+
+# Token profiles (transfer tax / honeypot detection)
+TOKEN_PROFILE_FILE = os.getenv("TOKEN_PROFILE_FILE", "token_profiles.json")
+TOKEN_PROFILE_TABLE = os.getenv("TOKEN_PROFILE_TABLE", "")  # DynamoDB table with partition key 'token' (string), shared by every instance
+TOKEN_PROFILE_TTL = float(os.getenv("TOKEN_PROFILE_TTL", 6 * 3600))  # seconds a measured profile is trusted
+TOKEN_PROFILE_PROBE_WEI = int(os.getenv("TOKEN_PROFILE_PROBE_WEI", 10 ** 15))  # ETH spent by the simulated round trip
+TOKEN_TAX_WARN_BPS = int(os.getenv("TOKEN_TAX_WARN_BPS", 500))  # warn above a 5% buy or sell tax
+TOKEN_TAX_BLOCK_BPS = int(os.getenv("TOKEN_TAX_BLOCK_BPS", 5000))  # refuse buys above a 50% tax
+
+# Cross-user batch buys (enabled when both the helper contract and its executor key are set)
+BATCH_SWAPPER = os.getenv("BATCH_SWAPPER", "")  # deployed contracts/BatchSwapper.sol, owned by the executor
+BATCH_EXECUTOR_KEY = os.getenv("BATCH_EXECUTOR_KEY", "")  # hot wallet that fronts and sends batch swaps
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", 2))  # seconds same-token buys are collected before one swap
+BATCH_FILE = os.getenv("BATCH_FILE", "batches.json")
+BATCH_TABLE = os.getenv("BATCH_TABLE", "")  # DynamoDB table with partition key 'batch_id' (string); required under Lambda
+
+# Per-wallet lease lock and shared nonce counter (unset: in-process locks, for a single instance)
+WALLET_LOCK_TABLE = os.getenv("WALLET_LOCK_TABLE", "")  # DynamoDB table with partition key 'address' (string)
+WALLET_LEASE_SECONDS = float(os.getenv("WALLET_LEASE_SECONDS", 30))  # a crashed holder's lease expires after this
+WALLET_LOCK_WAIT = float(os.getenv("WALLET_LOCK_WAIT", 10))  # seconds to wait for a busy wallet before giving up
+WALLET_NONCE_GAP_GRACE = float(os.getenv("WALLET_NONCE_GAP_GRACE", 30))  # seconds the counter may lead the node's pending count before the gap counts as dropped
+
+# Sharded runtime (sharded.py)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1))  # worker processes, updates routed by telegram_id
+
+# Span tracing (tracing.py); off unless TRACE_FILE is set
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # OTLP/JSON lines, one ExportTraceServiceRequest per flush
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1))  # fraction of handler updates traced
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 1))  # seconds between writes
+
+# Metrics (metrics.py): Prometheus endpoint while polling, EMF log lines in Lambda
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))  # 0 disables the endpoint; sharded workers use PORT + index
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "InkyBot")  # CloudWatch namespace of EMF metrics
+
+# Logging (log_setup.py): records are formatted and written by a background thread
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_FILE = os.getenv("LOG_FILE", "")  # also write to this file; stderr only when unset
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, never waited on
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))  # fraction of high-volume handler actions logged
+LOG_SAMPLED_HANDLERS = set(os.getenv("LOG_SAMPLED_HANDLERS", "menu,back_to_menu,wallet,manage_wallet,reset_to_menu_handler,debug_text_handler").split(","))
+
+# Update recorder (recorder.py); off unless RECORD_FILE is set
+RECORD_FILE = os.getenv("RECORD_FILE", "")  # sanitized updates and their RPC responses, JSON lines (gzipped if .gz)
+RECORD_SALT = os.getenv("RECORD_SALT") or os.urandom(16).hex()  # keys user id pseudonyms; set it to keep them stable across restarts
+
+# On-demand profiling (profiler.py): /profile from an admin, or SIGUSR1
+ADMIN_TELEGRAM_IDS = {id.strip() for id in os.getenv("ADMIN_TELEGRAM_IDS", "").split(",") if id.strip()}  # may run /profile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # folded-stack files are written here
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.01))  # seconds between stack samples
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 300))  # longest window /profile may ask for
+
+# Admission control (admission.py): circuit breakers per dependency, the trade queue and stale views
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))  # recent calls a breaker judges a dependency by
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))  # calls in the window before a breaker may open
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", 0.5))  # failed or slow share of the window that opens it
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 5))  # seconds an open breaker refuses calls before probing
+BREAKER_SLOW_SECONDS = {  # a call slower than this counts as failed
+    'rpc': float(os.getenv("BREAKER_SLOW_RPC", 3)),
+    'dynamodb': float(os.getenv("BREAKER_SLOW_DYNAMODB", 1)),
+    'explorer': float(os.getenv("BREAKER_SLOW_EXPLORER", 5)),
+}
+TRADE_WORKERS = int(os.getenv("TRADE_WORKERS", 4))  # trades executed at once
+TRADE_QUEUE_SIZE = int(os.getenv("TRADE_QUEUE_SIZE", 50))  # trades waiting beyond this are refused
+STALE_VIEW_MAX_AGE = float(os.getenv("STALE_VIEW_MAX_AGE", 300))  # oldest wallet/menu data shown while a dependency is down
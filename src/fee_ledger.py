@@ -0,0 +1,162 @@
+import time
+import logging
+import threading
+from config import FEE_LEDGER_FILE, FEE_LEDGER_TABLE, FEE_SWEEP_THRESHOLD_WEI, FEE_SWEEP_INTERVAL
+import swap_handler
+import tx_tracker
+import tracing
+import record_store
+import admission
+
+# address (lowercase) -> {'telegram_id', 'owed': {trade hash: wei}, 'in_flight': {trade hash: wei} (a sweep being
+# broadcast), 'sweeps': {sweep hash: {trade hash: wei}}, 'last_sweep'}. Keying fees by the trade that owes them
+# makes accrual idempotent across hook retries. In DynamoDB when FEE_LEDGER_TABLE is set; every change is a
+# conditional write, so instances sharing the table can't lose each other's updates or sweep a fee twice.
+_store = record_store.open_store(FEE_LEDGER_TABLE, FEE_LEDGER_FILE, 'address', 'FeeLedger')
+# signer(telegram_id) -> private key, needed to sign sweeps from the user's wallet
+_signer = None
+_sweep_thread = None
+
+
+def _modify(address, change):
+    """
+    Applies change(entry) to address's entry (None if it has none), retrying whenever another writer
+    got in first. change returns (the entry to write, or None to write nothing, result); returns result.
+    """
+    key = address.lower()
+    while True:
+        entry = _store.get(key)
+        entry, result = change(entry)
+        if entry is None or _store.update(key, entry):
+            return result
+
+
+def set_signer(signer):
+    """Registers signer(telegram_id) -> private key, used to sign sweeps."""
+    global _signer
+    _signer = signer
+
+
+def accrue(telegram_id, address, amount, trade_hash):
+    """Records a fee owed by address for a mined trade. Returns the total now owed (excluding sweeps in flight)."""
+    trade_hash = trade_hash.lower()
+
+    def change(entry):
+        entry = entry or {'telegram_id': telegram_id, 'owed': {}, 'in_flight': {}, 'sweeps': {}, 'last_sweep': time.time()}
+        known = [entry['owed'], entry.get('in_flight', {})] + list(entry['sweeps'].values())
+        if any(trade_hash in fees for fees in known):
+            # A retried hook; the fee is already owed, being swept or swept
+            return None, sum(entry['owed'].values())
+        entry['owed'][trade_hash] = amount
+        return entry, sum(entry['owed'].values())
+    return _modify(address, change)
+
+
+def reserved(address):
+    """ETH in the wallet that belongs to the fee wallet: fees owed plus sweeps not yet mined."""
+    entry = _store.get(address.lower())
+    if not entry:
+        return 0
+    return (sum(entry['owed'].values()) + sum(entry.get('in_flight', {}).values())
+            + sum(sum(fees.values()) for fees in entry['sweeps'].values()))
+
+
+@tracing.traced()
+def sweep(address):
+    """
+    Sends everything address owes to FEE_WALLET in one transfer. Returns the sweep tx hash, or None if
+    nothing is owed (or another sweep of the wallet is being sent).
+
+    The owed fees are moved to in_flight by a conditional write before the transfer is broadcast, so
+    only one instance sends them. A failed send puts them back. A sweep that dies between the broadcast
+    and recording its hash leaves them in flight: they stay reserved and are never sent again (the
+    transfer may have gone out), and every later sweep attempt logs them for a manual check.
+    """
+    def take(entry):
+        if not entry or not entry['owed']:
+            return None, None
+        if entry.get('in_flight'):
+            logging.warning("[FeeLedger] %s has a sweep in flight since %s, not sweeping", address, entry.get('in_flight_at'))
+            return None, None
+        entry['in_flight'], entry['owed'], entry['in_flight_at'] = entry['owed'], {}, time.time()
+        return entry, entry
+    entry = _modify(address, take)
+    if entry is None:
+        return None
+    fees = entry['in_flight']
+
+    def restore(entry):
+        entry['owed'].update(entry['in_flight'])
+        entry['in_flight'] = {}
+        return entry, None
+    try:
+        tx_hash = swap_handler.send_fee(address, _signer(entry['telegram_id']), sum(fees.values()))
+    except Exception:
+        _modify(address, restore)
+        raise
+    tx_hash = tx_hash.lower() if tx_hash.startswith('0x') else '0x' + tx_hash.lower()
+
+    def record(entry):
+        entry['sweeps'][tx_hash] = entry['in_flight']
+        entry['in_flight'] = {}
+        entry['last_sweep'] = time.time()
+        return entry, None
+    _modify(address, record)
+    tx_tracker.track(tx_hash, 'sweep', None, entry['telegram_id'], address)
+    logging.info("[FeeLedger] Swept %.6f ETH for %d trade(s) from %s: %s", sum(fees.values()) / 1e18, len(fees), address, tx_hash)
+    return tx_hash
+
+
+def settle_sweep(record, receipt):
+    """tx_tracker hook: a mined sweep clears its fees; a reverted one puts them back on the ledger."""
+    def settle(entry):
+        fees = entry['sweeps'].pop(record['tx_hash'], None) if entry else None
+        if fees is None:
+            return None, None
+        if int(receipt['status'], 16) != 1:
+            entry['owed'].update(fees)
+        return entry, None
+    return _modify(record['address'], settle)
+
+
+def sweep_due(address=None):
+    """
+    Sweeps every wallet (or just address) that owes at least FEE_SWEEP_THRESHOLD_WEI, or owes
+    anything and hasn't been swept for FEE_SWEEP_INTERVAL seconds.
+    """
+    if address is None:
+        entries = _store.all()
+    else:
+        entry = _store.get(address.lower())
+        entries = {address.lower(): entry} if entry else {}
+    due = [addr for addr, entry in entries.items()
+           if entry['owed'] and (
+               sum(entry['owed'].values()) >= FEE_SWEEP_THRESHOLD_WEI
+               or time.time() - entry['last_sweep'] >= FEE_SWEEP_INTERVAL)]
+    for addr in due:
+        try:
+            sweep(addr)
+        except Exception as e:
+            logging.error("[FeeLedger] Sweep failed for %s: %s", addr, e)
+
+
+def _sweep_loop():
+    with admission.background():
+        while True:
+            try:
+                sweep_due()
+            except Exception as e:
+                logging.error("[FeeLedger] Sweep pass failed: %s", e)
+            time.sleep(60)
+
+
+def start_sweeping():
+    """Starts the background worker that sweeps wallets once their fees are due (polling mode)."""
+    global _sweep_thread
+    if _sweep_thread is not None and _sweep_thread.is_alive():
+        return
+    _sweep_thread = threading.Thread(target=_sweep_loop, name="fee-sweeper", daemon=True)
+    _sweep_thread.start()
+
+
+tx_tracker.add_hook('sweep', settle_sweep)
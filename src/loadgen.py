@@ -0,0 +1,297 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import concurrent.futures
+from abc import ABC, abstractmethod
+import benchmark
+
+# Conversation paths of a simulated user, as (weight, flows); flows are benchmark.FLOWS plus the
+# wallet view. Weighted towards the launch-day pattern: /start, then straight into a buy.
+PATHS = [
+    (0.45, ['start', 'buy']),
+    (0.2, ['start', 'buy', 'sell']),
+    (0.15, ['start', 'wallet']),
+    (0.2, ['start']),
+]
+STEPS = {**benchmark.FLOWS, 'wallet': [('callback', 'menu_wallet')]}
+LOOP_PROBE_INTERVAL = 0.05
+
+
+class Entry(ABC):
+    """Delivers one raw update to the bot and returns once it is handled; True if it went through without error."""
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def deliver(self, update):
+        ...
+
+    async def stop(self):
+        pass
+
+
+class WebhookEntry(Entry):
+    """
+    The long-running bot: updates go onto the application's update queue, exactly where the
+    webhook or polling updater puts them, and are handled by its own dispatch (with the
+    background workers running alongside).
+    """
+
+    def __init__(self, fake_request):
+        import bot
+        from telegram.ext import TypeHandler
+        from telegram import Update
+        self.Update = Update
+        self.app = bot.get_application(request=fake_request)
+        self.waiting = {}
+        # Runs after every other group has handled the update
+        self.app.add_handler(TypeHandler(Update, self._handled), group=1000)
+        self.start_background_workers = bot.start_background_workers
+
+    async def _handled(self, update, context):
+        future = self.waiting.pop(update.update_id, None)
+        if future and not future.done():
+            future.set_result(True)
+
+    async def start(self):
+        self.start_background_workers()
+        await self.app.initialize()
+        await self.app.start()
+
+    async def deliver(self, update):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[update['update_id']] = future
+        await self.app.update_queue.put(self.Update.de_json(update, self.app.bot))
+        return await future
+
+    async def stop(self):
+        await self.app.stop()
+        await self.app.shutdown()
+
+
+class LambdaEntry(Entry):
+    """
+    One warm Lambda container: bot.lambda_handler is invoked with an API Gateway event per update,
+    one invocation at a time, as a container with reserved concurrency 1 would. Its throughput
+    times the concurrency limit is the deployment's capacity.
+    """
+
+    def __init__(self, fake_request):
+        import bot
+        bot.get_application(request=fake_request)
+        self.lambda_handler = bot.lambda_handler
+        self.container = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='lambda')
+
+    async def deliver(self, update):
+        response = await asyncio.get_running_loop().run_in_executor(
+            self.container, self.lambda_handler, {'body': json.dumps(update)}, None)
+        return response['statusCode'] == 200
+
+    async def stop(self):
+        self.container.shutdown()
+
+
+class Collector:
+    """Completed updates and event-loop lag samples, timestamped, plus metric snapshots at each step boundary."""
+
+    def __init__(self):
+        self.updates = []  # (finished, latency, ok)
+        self.lags = []  # (time, lag)
+
+    async def probe_loop(self):
+        """Measures how late a short sleep wakes up: the time the event loop spent blocked on something else."""
+        while True:
+            expected = time.perf_counter() + LOOP_PROBE_INTERVAL
+            await asyncio.sleep(LOOP_PROBE_INTERVAL)
+            now = time.perf_counter()
+            self.lags.append((now, now - expected))
+
+    @staticmethod
+    def snapshot():
+        import metrics
+        totals = lambda values: (sum(count for count, _ in values), sum(seconds for _, seconds in values))
+        return {
+            'rpc': totals(metrics.histogram_totals('rpc_seconds').values()),
+            'rpc_errors': sum(metrics.counter_values('rpc_errors_total').values()),
+            'dynamodb': totals(metrics.histogram_totals('dynamodb_seconds').values()),
+            'handler': totals(metrics.histogram_totals('handler_seconds').values()),
+            'handler_errors': sum(metrics.counter_values('handler_errors_total').values()),
+        }
+
+    def window(self, rate, started, ended, before, after):
+        """One row of the curves: what the bot achieved while users arrived at rate per second."""
+        seconds = ended - started
+        done = [(latency, ok) for finished, latency, ok in self.updates if started <= finished < ended]
+        latencies = sorted(latency for latency, _ in done)
+        lags = sorted(lag for at, lag in self.lags if started <= at < ended)
+        pick = lambda values, q: values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+        delta = lambda key: tuple(a - b for a, b in zip(after[key], before[key]))
+        rpc_count, rpc_seconds = delta('rpc')
+        dynamodb_count, dynamodb_seconds = delta('dynamodb')
+        _, handler_seconds = delta('handler')
+        return {
+            'offered_users_per_s': rate,
+            'updates_per_s': round(len(done) / seconds, 2),
+            'p50_ms': round(pick(latencies, 0.5), 1),
+            'p95_ms': round(pick(latencies, 0.95), 1),
+            'p99_ms': round(pick(latencies, 0.99), 1),
+            'loop_lag_p95_ms': round(pick(lags, 0.95), 1),
+            'busy_pct': round(100 * handler_seconds / seconds, 1),
+            'rpc_per_s': round(rpc_count / seconds, 1),
+            'rpc_avg_ms': round(1000 * rpc_seconds / rpc_count, 1) if rpc_count else 0.0,
+            'dynamodb_avg_ms': round(1000 * dynamodb_seconds / dynamodb_count, 1) if dynamodb_count else 0.0,
+            'errors': sum(1 for _, ok in done if not ok) + after['handler_errors'] - before['handler_errors'],
+            'rpc_errors': after['rpc_errors'] - before['rpc_errors'],
+        }
+
+
+async def simulate_user(entry, collector, telegram_id, args, values):
+    """One user: a weighted random path, with exponential think times between updates."""
+    flows = random.choices([flows for _, flows in PATHS], weights=[weight for weight, _ in PATHS])[0]
+    loop = asyncio.get_running_loop()
+    for flow in flows:
+        for kind, template in STEPS[flow]:
+            await asyncio.sleep(random.expovariate(1 / args.think))
+            text = template.format(**values)
+            raw = (benchmark.message_update(telegram_id, text) if kind == 'message'
+                   else benchmark.callback_update(telegram_id, text))
+            started = time.perf_counter()
+            try:
+                ok = await entry.deliver(raw)
+            except Exception:
+                ok = False
+            collector.updates.append((time.perf_counter(), time.perf_counter() - started, ok))
+        if flow == 'start':
+            try:
+                await loop.run_in_executor(None, benchmark.fund, args.rpc, [telegram_id])
+            except Exception:
+                return  # no wallet: /start failed, and is already counted as an error
+
+
+async def run(args):
+    fake_request = benchmark.FakeTelegramRequest()
+    import tx_tracker
+    tx_tracker.send_message = lambda chat_id, text: None
+    entry = WebhookEntry(fake_request) if args.entry == 'webhook' else LambdaEntry(fake_request)
+    await entry.start()
+    collector = Collector()
+    # Under Lambda the handlers run on the container's own loop; this one only drives the users
+    probe = asyncio.create_task(collector.probe_loop()) if args.entry == 'webhook' else None
+    values = {'token': args.token, 'recipient': args.recipient,
+              'buy_amount': args.buy_amount, 'withdraw_amount': args.withdraw_amount}
+    users = []
+    rows = []
+    next_id = args.first_user
+    print(' '.join(COLUMNS), file=sys.stderr)
+    for rate in args.rates:
+        before, started = collector.snapshot(), time.perf_counter()
+        ends = started + args.step_seconds
+        # Poisson arrivals at rate users per second
+        while True:
+            await asyncio.sleep(random.expovariate(rate))
+            if time.perf_counter() >= ends:
+                break
+            users.append(asyncio.create_task(simulate_user(entry, collector, next_id, args, values)))
+            next_id += 1
+        rows.append(collector.window(rate, started, time.perf_counter(), before, collector.snapshot()))
+        print_row(rows[-1])
+    # Let the users still mid-conversation finish, so the bot is left quiet
+    if users:
+        await asyncio.wait(users, timeout=args.drain)
+    for task in users:
+        task.cancel()
+    if probe:
+        probe.cancel()
+    await entry.stop()
+    return rows
+
+
+def saturation(rows, slo_ms):
+    """
+    The first step where the bot stopped keeping up (throughput grew by under 10% while the offered
+    load grew, or p95 broke the SLO), and the resource that degraded most by then.
+    """
+    baseline = rows[0]
+    for previous, row in zip(rows, rows[1:]):
+        plateaued = row['updates_per_s'] < previous['updates_per_s'] * 1.1
+        if not plateaued and row['p95_ms'] <= slo_ms:
+            continue
+        if row['busy_pct'] >= 90 or row['loop_lag_p95_ms'] >= 100:
+            cause = f"handlers ({row['busy_pct']}% busy, event loop lag p95 {row['loop_lag_p95_ms']} ms)"
+        else:
+            growth = {
+                'RPC': row['rpc_avg_ms'] / max(baseline['rpc_avg_ms'], 0.1),
+                'DynamoDB': row['dynamodb_avg_ms'] / max(baseline['dynamodb_avg_ms'], 0.1),
+            }
+            name = max(growth, key=growth.get)
+            cause = f"{name} latency ({growth[name]:.1f}x the first step)"
+        return row['offered_users_per_s'], cause
+    return None, None
+
+
+COLUMNS = ('offered_users_per_s', 'updates_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'loop_lag_p95_ms', 'busy_pct',
+           'rpc_per_s', 'rpc_avg_ms', 'rpc_errors', 'dynamodb_avg_ms', 'errors')
+
+
+def print_row(row):
+    print(' '.join(f"{row[column]:>{len(column)}}" for column in COLUMNS), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step-load the bot with simulated users and find where it saturates.")
+    parser.add_argument('token', help="the launch token users buy; needs a WETH pool on the devnet")
+    parser.add_argument('--entry', choices=('webhook', 'lambda'), default='webhook')
+    parser.add_argument('--rates', type=float, nargs='+', default=[5, 10, 20, 50, 100, 200],
+                        help="new users per second, one step each")
+    parser.add_argument('--step-seconds', type=float, default=30)
+    parser.add_argument('--think', type=float, default=2.0, help="mean seconds a user waits between updates")
+    parser.add_argument('--drain', type=float, default=60, help="seconds to let conversations finish after the last step")
+    parser.add_argument('--slo', type=float, default=2000, help="p95 update latency in ms that counts as saturated")
+    parser.add_argument('--csv', help="write the curves (one row per step) to this file")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rpc', default='http://127.0.0.1:8545')
+    parser.add_argument('--first-user', type=int, default=800000000)
+    parser.add_argument('--buy-amount', default='0.001')
+    parser.add_argument('--withdraw-amount', default='0.0001')
+    parser.add_argument('--recipient', default='0x000000000000000000000000000000000000dEaD')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    # Thousands of users would drown the report in handler logs
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from moto import mock_aws
+    with tempfile.TemporaryDirectory() as state_dir, mock_aws(), open(os.devnull, 'w') as devnull:
+        benchmark.prepare_environment(args, state_dir)
+        benchmark.create_tables()
+        # lambda_handler ends each invocation by printing CloudWatch EMF lines
+        with contextlib.redirect_stdout(devnull):
+            rows = asyncio.run(run(args))
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    rate, cause = saturation(rows, args.slo)
+    if rate is None:
+        print(f"No saturation up to {rows[-1]['offered_users_per_s']} users/s")
+    else:
+        print(f"Saturated at {rate} users/s: {cause}")
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    # Usage: anvil --fork-url https://ink.drpc.org &
+    #        python loadgen.py <token> [--entry webhook|lambda] [--rates 5 10 20 50] [--step-seconds 30] [--csv curves.csv]
+    # Each step brings in new simulated users at a fixed rate (Poisson arrivals) for --step-seconds.
+    # Each user follows a weighted path (/start then buy, buy and sell, wallet, or just /start) with
+    # exponential think times, against the same local stand-ins as benchmark.py. Every step prints a
+    # row of the throughput and saturation curves (to stderr while running), and the step where the
+    # bot tipped over is reported with the resource that degraded: handlers/event loop, RPC or DynamoDB.
+    main()
@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+from web3 import Web3
+from config import RPC_URL, POOL_STATE_TTL, POOL_STATE_POLL_INTERVAL, LOG_BLOCK_RANGE
+import admission
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+
+class LogFollower:
+    """
+    Per-contract state kept current from its logs: pool_state (V3 Swap/Mint/Burn) and pair_state
+    (V2 Sync). bootstrap(address, block) reads a contract's state at a block; apply_log(state, log)
+    returns the state with one log applied.
+
+    State is copy-on-write: every update builds a new dict and swaps the reference, so readers
+    can use whatever get() returned without locking. Callers must not mutate it. Each state
+    carries 'synced_block', the last block whose logs it reflects; logs are only ever applied
+    above it, so a contract tracked while a sync is fetching logs is caught up from its own
+    block instead of being skipped.
+    """
+
+    def __init__(self, tag, topics, bootstrap, apply_log, thread_name):
+        self.tag = tag
+        self.topics = topics
+        self.bootstrap = bootstrap
+        self.apply_log = apply_log
+        self.thread_name = thread_name
+        self.states = {}
+        self.lock = threading.Lock()
+        # Last block sync() has fetched logs up to; once it returns, every state is synced at least this far
+        self.cursor = None
+        self.last_sync = 0.0
+        self.stream_thread = None
+
+    def _bootstrap(self, address, block):
+        state = self.bootstrap(address, block)
+        # Logs up to and including this block are already reflected in the snapshot
+        state['bootstrap_block'] = state['synced_block'] = block
+        return state
+
+    def track(self, address):
+        """
+        Starts tracking a contract, bootstrapping it at the current cursor. If sync() moved the
+        cursor meanwhile, it is caught up from its own snapshot block with the logs it missed.
+        """
+        key = address.lower()
+        if key in self.states:
+            return self.states[key]
+        with self.lock:
+            if self.cursor is None:
+                self.cursor = w3.eth.block_number
+            block = self.cursor
+        state = self._bootstrap(address, block)
+        with self.lock:
+            self.states.setdefault(key, state)
+            cursor = self.cursor
+        if self.states[key]['synced_block'] < cursor:
+            self._catch_up([key], self.states[key]['synced_block'] + 1, cursor)
+        logging.info("[%s] Tracking %s at block %s", self.tag, state['address'], block)
+        return self.states[key]
+
+    def _catch_up(self, keys, start, end):
+        """
+        Fetches the logs of the contracts keys from start to end and applies them. A state only
+        takes a range if it was synced up to start - 1 (anything else is picked up by a later
+        catch-up from its own synced_block), and only logs above its synced_block, so nothing
+        is applied twice. The RPCs run without holding the lock.
+        """
+        addresses = [self.states[key]['address'] for key in keys]
+        while addresses and start <= end:
+            chunk_end = min(start + LOG_BLOCK_RANGE - 1, end)
+            logs = w3.eth.get_logs({
+                'fromBlock': start,
+                'toBlock': chunk_end,
+                'address': addresses,
+                'topics': self.topics,
+            })
+            by_contract = {}
+            for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+                by_contract.setdefault(log['address'].lower(), []).append(log)
+            with self.lock:
+                for key in keys:
+                    state = self.states[key]
+                    if state['synced_block'] < start - 1:
+                        continue
+                    for log in by_contract.get(key, ()):
+                        if log['blockNumber'] > state['synced_block']:
+                            state = self.apply_log(state, log)
+                    self.states[key] = {**state, 'synced_block': max(state['synced_block'], chunk_end)}
+            start = chunk_end + 1
+
+    def sync(self, to_block=None):
+        """Applies the logs of every tracked contract up to to_block (default: latest). Returns the new cursor."""
+        latest = w3.eth.block_number if to_block is None else to_block
+        with self.lock:
+            if self.cursor is None:
+                self.cursor = latest
+            start = self.cursor + 1
+            keys = list(self.states)
+        self._catch_up(keys, start, latest)
+        with self.lock:
+            self.cursor = max(self.cursor, latest)
+        # Contracts tracked while the logs above were fetched were not in them; each catches up from its own block
+        while True:
+            with self.lock:
+                lagging = [key for key, state in self.states.items() if state['synced_block'] < self.cursor]
+                end = self.cursor
+            if not lagging:
+                break
+            self._catch_up(lagging, min(self.states[key]['synced_block'] for key in lagging) + 1, end)
+        self.last_sync = time.time()
+        return self.cursor
+
+    def get(self, address):
+        """
+        The state of a contract (tracking it on first use). Without the background stream
+        running, the states are caught up on demand once they are older than POOL_STATE_TTL.
+        """
+        state = self.states.get(address.lower())
+        if state is None:
+            return self.track(address)
+        if not self.is_streaming() and time.time() - self.last_sync > POOL_STATE_TTL:
+            self.sync()
+            state = self.states[address.lower()]
+        return state
+
+    def is_streaming(self):
+        return self.stream_thread is not None and self.stream_thread.is_alive()
+
+    def _stream_loop(self):
+        with admission.background():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logging.error("[%s] Sync failed at block %s: %s", self.tag, self.cursor, e)
+                time.sleep(POOL_STATE_POLL_INTERVAL)
+
+    def start_streaming(self):
+        """Starts the background thread that applies new logs every block (polling mode only)."""
+        if self.is_streaming():
+            return
+        self.stream_thread = threading.Thread(target=self._stream_loop, name=self.thread_name, daemon=True)
+        self.stream_thread.start()
+
+    def verify(self, address, fields):
+        """
+        Compares fields of a cached state with a fresh read at the block it is synced to.
+        Returns (cached, fresh, mismatch descriptions).
+        """
+        cached = self.states[address.lower()]
+        fresh = self.bootstrap(cached['address'], cached['synced_block'])
+        mismatches = [f"{field}: cached {cached[field]} != chain {fresh[field]}"
+                      for field in fields if cached[field] != fresh[field]]
+        return cached, fresh, mismatches
+
+    def follow(self, addresses, verify):
+        """
+        Dev loop behind `python pool_state.py` / `python pair_state.py`: tracks addresses, follows
+        the chain and logs verify(address) every 10 blocks.
+        """
+        for address in addresses:
+            self.track(address)
+        last_verified = self.cursor
+        while True:
+            self.sync()
+            if self.cursor - last_verified >= 10:
+                for address in addresses:
+                    problems = verify(address)
+                    logging.info("[%s] %s @ %s: %s", self.tag, address, self.cursor, 'OK' if not problems else problems)
+                last_verified = self.cursor
+            time.sleep(POOL_STATE_POLL_INTERVAL)
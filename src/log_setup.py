@@ -0,0 +1,106 @@
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE, LOG_SAMPLED_HANDLERS
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+_queue = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, plus any structured 'fields' passed via extra."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _SampleFilter(logging.Filter):
+    """Keeps LOG_SAMPLE_RATE of the INFO-and-below handler actions of LOG_SAMPLED_HANDLERS; everything else passes."""
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        fields = getattr(record, 'fields', None)
+        if not fields or fields.get('handler') not in LOG_SAMPLED_HANDLERS:
+            return True
+        return random.random() < LOG_SAMPLE_RATE
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread as they are: no formatting, and no waiting when the queue is full."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Interpolating the message and encoding JSON are left to the writer thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': "[Logging] Dropped %d records while the log queue was full", 'args': (self.dropped,)}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Dropping beats stalling the event loop on a slow stderr; the count is logged once there is room
+            self.dropped += 1
+
+
+def setup():
+    """
+    Routes the root logger through a bounded queue to a background writer thread, which formats
+    records (JSON by default, LOG_FORMAT=text for local runs) to stderr and LOG_FILE if set.
+    Safe to call more than once.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    targets = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        targets.append(logging.FileHandler(LOG_FILE))
+    for target in targets:
+        target.setFormatter(formatter)
+    _queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(_queue)
+    handler.addFilter(_SampleFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    _listener = QueueListener(_queue, *targets, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def flush(timeout=1.0):
+    """Waits (up to timeout seconds) for the writer thread to drain the queue, e.g. before a Lambda invocation returns."""
+    if _queue is None:
+        return
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.005)
@@ -0,0 +1,264 @@
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import METRICS_HOST, METRICS_PORT, METRICS_NAMESPACE
+
+# name -> (type, help, CloudWatch unit). Every metric the bot records is declared here.
+METRICS = {
+    'handler_seconds': ('histogram', 'Telegram handler latency by handler', 'Seconds'),
+    'handler_errors_total': ('counter', 'Handler calls that raised, by handler', 'Count'),
+    'rpc_requests_total': ('counter', 'JSON-RPC requests by method (batches count each call)', 'Count'),
+    'rpc_errors_total': ('counter', 'JSON-RPC requests that raised or returned an error, by method', 'Count'),
+    'rpc_seconds': ('histogram', 'JSON-RPC request latency by method', 'Seconds'),
+    'dynamodb_seconds': ('histogram', 'DynamoDB call latency by operation', 'Seconds'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss)', 'Count'),
+    'trades_in_flight': ('gauge', 'Trades between confirmation and broadcast, by side', 'Count'),
+    'pending_transactions': ('gauge', 'Broadcast transactions awaiting a receipt', 'Count'),
+    'nonce_gaps_reset_total': ('counter', 'Shared nonce counters reset to the chain after a dropped transaction', 'Count'),
+    'telegram_rate_limited_total': ('counter', 'Bot API requests answered with 429, by source', 'Count'),
+    'breaker_open': ('gauge', 'Whether the circuit breaker of a dependency is open (1) or closed (0)', 'Count'),
+    'breaker_rejections_total': ('counter', 'Calls refused by an open breaker or a full trade queue, by dependency', 'Count'),
+    'trade_queue_depth': ('gauge', 'Trades waiting for a trade worker', 'Count'),
+    'stale_views_total': ('counter', 'Read-only views served from their last known value, by view', 'Count'),
+}
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Raw observations kept per series between EMF flushes (CloudWatch takes up to 100 values per metric)
+EMF_MAX_VALUES = 100
+
+# (name, labels) -> value; labels is a sorted tuple of (key, value) pairs
+_counters = {}
+_gauges = {}
+# (name, labels) -> {'buckets': [count per bound], 'sum', 'count', 'values': observations since the last EMF flush}
+_histograms = {}
+# (name, labels) -> counter value at the last EMF flush, so EMF lines carry deltas
+_flushed = {}
+_lock = threading.Lock()
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge_add(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+
+def gauge_set(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0, 'values': []}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series['buckets'][i] += 1
+                break
+        series['sum'] += seconds
+        series['count'] += 1
+        if len(series['values']) < EMF_MAX_VALUES:
+            series['values'].append(seconds)
+
+
+def counter_values(name):
+    """{labels: value} of every series of counter name, labels as sorted (key, value) tuples."""
+    with _lock:
+        return {labels: value for (series, labels), value in _counters.items() if series == name}
+
+
+def histogram_totals(name):
+    """{labels: (count, sum)} of every series of histogram name."""
+    with _lock:
+        return {labels: (series['count'], series['sum']) for (key, labels), series in _histograms.items() if key == name}
+
+
+def cache_lookup(cache, hit, count=1):
+    inc('cache_requests_total', count, cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observes the block's duration in histogram name, even when it raises. Also usable as a decorator."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def in_flight(name, **labels):
+    """Counts the block (or decorated call) in gauge name while it runs."""
+    gauge_add(name, 1, **labels)
+    try:
+        yield
+    finally:
+        gauge_add(name, -1, **labels)
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+def render():
+    """All series in the Prometheus text exposition format."""
+    with _lock:
+        counters, gauges = dict(_counters), dict(_gauges)
+        histograms = {key: {**series, 'buckets': list(series['buckets'])} for key, series in _histograms.items()}
+    lines = []
+    for name, (kind, help_text, _) in METRICS.items():
+        series = {'counter': counters, 'gauge': gauges, 'histogram': histograms}[kind]
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in keys:
+            labels = key[1]
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels_text(labels)} {series[key]}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, series[key]['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {series[key]['count']}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {series[key]['sum']}")
+            lines.append(f"{name}_count{_labels_text(labels)} {series[key]['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def flush_emf():
+    """
+    Prints one CloudWatch Embedded Metric Format line per series recorded since the last flush:
+    counter deltas, current gauges and the raw histogram observations. For Lambda, where stdout
+    goes to CloudWatch Logs and the metrics are extracted from it.
+    """
+    timestamp = int(time.time() * 1000)
+    entries = []
+    with _lock:
+        for key, value in _counters.items():
+            delta = value - _flushed.get(key, 0)
+            if delta:
+                entries.append((key, delta))
+                _flushed[key] = value
+        entries.extend(_gauges.items())
+        for key, series in _histograms.items():
+            if series['values']:
+                entries.append((key, series['values']))
+                series['values'] = []
+    for (name, labels), value in entries:
+        dimensions = [k for k, _ in labels]
+        record = {
+            '_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [dimensions],
+                'Metrics': [{'Name': name, 'Unit': METRICS[name][2]}],
+            }]},
+            name: value,
+            **dict(labels),
+        }
+        print(json.dumps(record, separators=(',', ':')), flush=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the bot's own log
+
+
+def start_server(port=None):
+    """Serves /metrics on METRICS_HOST:port (METRICS_PORT by default) from a daemon thread (polling mode)."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    if _server is not None or not port:
+        return
+    _server = ThreadingHTTPServer((METRICS_HOST, port), _Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info("[Metrics] Serving http://%s:%s/metrics", METRICS_HOST, port)
+
+
+def instrument_web3():
+    """Counts and times every HTTPProvider request by RPC method; a batch counts each of its calls."""
+    from web3 import HTTPProvider
+    if getattr(HTTPProvider, '_metered', False):
+        return
+    make_request, make_batch_request = HTTPProvider.make_request, HTTPProvider.make_batch_request
+
+    def metered_make_request(self, method, params):
+        inc('rpc_requests_total', method=method)
+        try:
+            with timer('rpc_seconds', method=method):
+                response = make_request(self, method, params)
+        except Exception:
+            inc('rpc_errors_total', method=method)
+            raise
+        # JSON-RPC errors (reverts, rate limits, unknown methods) come back as a response, not an exception
+        if isinstance(response, dict) and response.get('error'):
+            inc('rpc_errors_total', method=method)
+        return response
+
+    def metered_make_batch_request(self, requests):
+        for method, _ in requests:
+            inc('rpc_requests_total', method=method)
+        try:
+            with timer('rpc_seconds', method='batch'):
+                responses = make_batch_request(self, requests)
+        except Exception:
+            inc('rpc_errors_total', method='batch')
+            raise
+        if isinstance(responses, dict):
+            # The whole batch was refused with one error response
+            if responses.get('error'):
+                inc('rpc_errors_total', method='batch')
+            return responses
+        for (method, _), response in zip(requests, responses):
+            if isinstance(response, dict) and response.get('error'):
+                inc('rpc_errors_total', method=method)
+        return responses
+
+    HTTPProvider.make_request = metered_make_request
+    HTTPProvider.make_batch_request = metered_make_batch_request
+    HTTPProvider._metered = True
+
+
+instrument_web3()
+
+
+if __name__ == "__main__":
+    # Usage: python metrics.py [url]
+    # Prints a running bot's metrics (http://METRICS_HOST:METRICS_PORT/metrics by default).
+    import requests
+    url = sys.argv[1] if len(sys.argv) > 1 else f"http://{METRICS_HOST}:{METRICS_PORT}/metrics"
+    print(requests.get(url, timeout=5).text)
@@ -0,0 +1,35 @@
+from web3 import Web3
+from config import RPC_URL, MULTICALL3
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+MULTICALL3_ABI = [
+    {"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"}, {"internalType": "bool", "name": "allowFailure", "type": "bool"}, {"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]", "name": "calls", "type": "tuple[]"}], "name": "aggregate3", "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"}, {"internalType": "bytes", "name": "returnData", "type": "bytes"}], "internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}], "stateMutability": "payable", "type": "function"}
+]
+
+# Calls per eth_call, keeps request size well under typical RPC limits
+BATCH_SIZE = 200
+
+multicall_contract = w3.eth.contract(address=Web3.to_checksum_address(MULTICALL3), abi=MULTICALL3_ABI)
+
+
+def selector(signature):
+    """4-byte function selector for a signature such as 'slot0()'."""
+    return Web3.keccak(text=signature)[:4]
+
+
+def encode_call(signature, arg_types=(), args=()):
+    return selector(signature) + (w3.codec.encode(list(arg_types), list(args)) if arg_types else b'')
+
+
+def aggregate(calls, block_identifier='latest'):
+    """
+    Runs [(target, calldata), ...] through Multicall3 in as few eth_calls as possible.
+    Returns the raw return data for each call, or None where the call reverted.
+    """
+    results = []
+    for i in range(0, len(calls), BATCH_SIZE):
+        batch = [(Web3.to_checksum_address(target), True, data) for target, data in calls[i:i + BATCH_SIZE]]
+        for success, data in multicall_contract.functions.aggregate3(batch).call(block_identifier=block_identifier):
+            results.append(bytes(data) if success else None)
+    return results
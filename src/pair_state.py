@@ -0,0 +1,86 @@
+import sys
+import logging
+from web3 import Web3
+from config import RPC_URL, V2_SWAP_FEE_BPS
+import multicall
+import log_follower
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+# Emitted by every V2 pair after any reserve change, with the new reserves
+SYNC_TOPIC = Web3.keccak(text="Sync(uint112,uint112)")
+
+
+def _decode(types, data):
+    return w3.codec.decode(types, bytes(data))
+
+
+def get_amount_out(amount_in, reserve_in, reserve_out):
+    """UniswapV2Library.getAmountOut with the pair's swap fee."""
+    if amount_in <= 0 or reserve_in <= 0 or reserve_out <= 0:
+        raise ValueError("Insufficient input amount or liquidity")
+    amount_in_with_fee = amount_in * (10000 - V2_SWAP_FEE_BPS)
+    return amount_in_with_fee * reserve_out // (reserve_in * 10000 + amount_in_with_fee)
+
+
+def get_amount_in(amount_out, reserve_in, reserve_out):
+    """UniswapV2Library.getAmountIn with the pair's swap fee."""
+    if amount_out <= 0 or reserve_in <= 0 or amount_out >= reserve_out:
+        raise ValueError("Insufficient output amount or liquidity")
+    return reserve_in * amount_out * 10000 // ((reserve_out - amount_out) * (10000 - V2_SWAP_FEE_BPS)) + 1
+
+
+def _bootstrap(pair_address, block):
+    pair_address = Web3.to_checksum_address(pair_address)
+    calls = [(pair_address, multicall.encode_call(sig)) for sig in ("getReserves()", "token0()", "token1()")]
+    results = multicall.aggregate(calls, block_identifier=block)
+    if None in results:
+        raise ValueError(f"{pair_address} is not a V2 pair (a state call failed at block {block})")
+    reserves, token0, token1 = results
+    reserve0, reserve1, _ = _decode(['uint112', 'uint112', 'uint32'], reserves)
+    return {
+        'address': pair_address,
+        'token0': _decode(['address'], token0)[0],
+        'token1': _decode(['address'], token1)[0],
+        'reserve0': reserve0,
+        'reserve1': reserve1,
+    }
+
+
+def _apply_log(state, log):
+    # Each Sync carries absolute reserves, so no replay of Swap/Mint/Burn amounts is needed
+    reserve0, reserve1 = _decode(['uint112', 'uint112'], log['data'])
+    return {**state, 'reserve0': reserve0, 'reserve1': reserve1}
+
+
+# Copy-on-write like pool_state: callers can use what get_pair() returned without locking
+_follower = log_follower.LogFollower('PairState', [SYNC_TOPIC], _bootstrap, _apply_log, "pair-state")
+track_pair = _follower.track
+sync = _follower.sync
+get_pair = _follower.get
+is_streaming = _follower.is_streaming
+start_streaming = _follower.start_streaming
+
+
+def swap(state, token_in, amount_in):
+    """Exact-input swap against cached reserves. Returns amount_out and the price impact as a fraction."""
+    if token_in.lower() == state['token0'].lower():
+        reserve_in, reserve_out = state['reserve0'], state['reserve1']
+    else:
+        reserve_in, reserve_out = state['reserve1'], state['reserve0']
+    amount_out = get_amount_out(amount_in, reserve_in, reserve_out)
+    # Relative move of the reserve ratio, as v3_math.price_impact does for sqrt prices
+    impact = 1 - (reserve_out - amount_out) * reserve_in / ((reserve_in + amount_in) * reserve_out)
+    return {'amount_out': amount_out, 'price_impact': impact}
+
+
+def verify_pair(pair_address):
+    """Compares the cached reserves of a pair against chain state at the same block. Returns mismatch descriptions."""
+    return _follower.verify(pair_address, ('reserve0', 'reserve1'))[2]
+
+
+if __name__ == "__main__":
+    # Usage: python pair_state.py <pair> [<pair> ...]
+    # Streams the given pairs (e.g. on a local devnet) and verifies the cached reserves every 10 blocks.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    _follower.follow(sys.argv[1:], verify_pair)
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from web3 import Web3
+from config import ROUTERS, RPC_URL, LOG_BLOCK_RANGE, POOL_INDEX_FILE, POOL_INDEX_START_BLOCK, POOL_INDEX_POLL_INTERVAL
+import token_metadata
+import admission
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+POOL_CREATED_TOPIC = Web3.keccak(text="PoolCreated(address,address,uint24,int24,address)")
+PAIR_CREATED_TOPIC = Web3.keccak(text="PairCreated(address,address,address,uint256)")
+
+V3_ROUTER = next(r for r in ROUTERS if r['type'] == 'v3')
+V2_ROUTER = next(r for r in ROUTERS if r['type'] == 'v2')
+FACTORY = Web3.to_checksum_address(V3_ROUTER['factory'])
+V2_FACTORY = Web3.to_checksum_address(V2_ROUTER['factory'])
+WETH = V3_ROUTER['weth'].lower()
+
+# token (lowercase) -> {'address', 'symbol', 'decimals', 'pools': {fee: V3 pool}, 'v2_pair': pair or None}
+_tokens = {}
+# Sorted (symbol lowercase, token lowercase) pairs for prefix search
+_symbols = []
+# Every V3 pool and V2 pair seen, WETH-paired or not (routing needs the hub pairs too):
+# {'protocol': 'v3'|'v2', 'token0', 'token1', 'fee' (None for v2), 'pool'}
+_pools = []
+# Callables notified with each batch of newly indexed pools
+_listeners = []
+_lock = threading.Lock()
+# Last block whose PoolCreated/PairCreated logs are in the index, and the last one saved to POOL_INDEX_FILE
+_checkpoint = None
+_saved_checkpoint = None
+_last_sync = 0.0
+_index_thread = None
+
+
+def _decode(types, data):
+    return w3.codec.decode(types, bytes(data))
+
+
+def load():
+    """Loads the index and its checkpoint from POOL_INDEX_FILE, if present."""
+    global _checkpoint, _saved_checkpoint, _symbols
+    if not os.path.exists(POOL_INDEX_FILE):
+        return
+    try:
+        with open(POOL_INDEX_FILE) as f:
+            data = json.load(f)
+    except Exception as e:
+        logging.warning("[PoolIndex] Ignoring unreadable %s: %s", POOL_INDEX_FILE, e)
+        return
+    with _lock:
+        for token in data['tokens']:
+            token['pools'] = {int(fee): pool for fee, pool in token['pools'].items()}
+            _tokens[token['address'].lower()] = token
+        _symbols = sorted((t['symbol'].lower(), key) for key, t in _tokens.items())
+        _pools.extend(data.get('pools', []))
+        _checkpoint = _saved_checkpoint = data['block']
+    token_metadata.prewarm(data['tokens'])
+    _notify(list(_pools))
+    logging.info("[PoolIndex] Loaded %s tokens up to block %s", len(_tokens), _checkpoint)
+
+
+def save():
+    global _saved_checkpoint
+    with _lock:
+        data = {'block': _checkpoint, 'tokens': list(_tokens.values()), 'pools': _pools}
+        # Per-process tmp name: every shard worker writes this shared file
+        tmp_file = f"{POOL_INDEX_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, POOL_INDEX_FILE)
+        _saved_checkpoint = _checkpoint
+
+
+def add_listener(listener):
+    """Registers listener(pools) to be called with every batch of newly indexed pools."""
+    _listeners.append(listener)
+
+
+def _notify(pools):
+    for listener in _listeners:
+        try:
+            listener(pools)
+        except Exception as e:
+            logging.error("[PoolIndex] Listener %s failed: %s", listener, e)
+
+
+def _add_pools(created):
+    """created: pool dicts (see _pools) in log order."""
+    weth_paired = []
+    for pool in created:
+        if pool['token0'].lower() == WETH:
+            weth_paired.append((pool['token1'], pool))
+        elif pool['token1'].lower() == WETH:
+            weth_paired.append((pool['token0'], pool))
+    new_tokens = sorted({token for token, _ in weth_paired if token.lower() not in _tokens})
+    # One batched lookup for the whole log range; it also persists them in the metadata cache
+    metadata = token_metadata.get_many(new_tokens) if new_tokens else {}
+    with _lock:
+        _pools.extend(created)
+        for token, pool in weth_paired:
+            key = token.lower()
+            if key not in _tokens:
+                symbol, decimals = metadata[key]['symbol'], metadata[key]['decimals']
+                _tokens[key] = {'address': token, 'symbol': symbol, 'decimals': decimals, 'pools': {}, 'v2_pair': None}
+                if metadata[key].get('fallback'):
+                    # Placeholder metadata; _refresh_fallbacks() fills in the real one later
+                    _tokens[key]['fallback'] = True
+                _symbols.insert(bisect_left(_symbols, (symbol.lower(), key)), (symbol.lower(), key))
+            if pool['protocol'] == 'v3':
+                _tokens[key]['pools'][pool['fee']] = pool['pool']
+            else:
+                _tokens[key]['v2_pair'] = pool['pool']
+    _notify(created)
+
+
+def deployment_block():
+    """
+    The block the earlier of the two factories was deployed in, found by bisecting eth_getCode.
+    Used when POOL_INDEX_START_BLOCK is not set, so the first start doesn't scan the chain from genesis.
+    """
+    latest = w3.eth.block_number
+    blocks = []
+    for factory in (FACTORY, V2_FACTORY):
+        if not w3.eth.get_code(factory, latest):
+            raise ValueError(f"No factory code at {factory}; set POOL_INDEX_START_BLOCK")
+        low, high = 0, latest
+        while low < high:
+            middle = (low + high) // 2
+            if w3.eth.get_code(factory, middle):
+                high = middle
+            else:
+                low = middle + 1
+        blocks.append(low)
+    return min(blocks)
+
+
+def _refresh_fallbacks():
+    """Re-reads the metadata of indexed tokens whose symbol/decimals could not be read when they were indexed."""
+    global _symbols
+    with _lock:
+        stale = [token['address'] for token in _tokens.values() if token.get('fallback')]
+    if not stale:
+        return
+    metadata = token_metadata.get_many(stale)
+    with _lock:
+        fixed = 0
+        for key, entry in metadata.items():
+            if not entry.get('fallback'):
+                _tokens[key].update(symbol=entry['symbol'], decimals=entry['decimals'])
+                _tokens[key].pop('fallback', None)
+                fixed += 1
+        if fixed:
+            _symbols = sorted((t['symbol'].lower(), key) for key, t in _tokens.items())
+    if fixed:
+        save()
+
+
+def sync(to_block=None):
+    """Indexes PoolCreated/PairCreated logs from the checkpoint up to to_block (default: latest). Returns the new checkpoint."""
+    global _checkpoint, _last_sync
+    latest = w3.eth.block_number if to_block is None else to_block
+    if _checkpoint is None:
+        start = POOL_INDEX_START_BLOCK if POOL_INDEX_START_BLOCK >= 0 else deployment_block()
+        logging.info("[PoolIndex] Indexing from block %s", start)
+    else:
+        start = _checkpoint + 1
+    found = 0
+    while start <= latest:
+        end = min(start + LOG_BLOCK_RANGE - 1, latest)
+        logs = w3.eth.get_logs({
+            'fromBlock': start,
+            'toBlock': end,
+            'address': [FACTORY, V2_FACTORY],
+            'topics': [[POOL_CREATED_TOPIC, PAIR_CREATED_TOPIC]],
+        })
+        created = []
+        for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+            token0 = Web3.to_checksum_address(_decode(['address'], log['topics'][1])[0])
+            token1 = Web3.to_checksum_address(_decode(['address'], log['topics'][2])[0])
+            if bytes(log['topics'][0]) == POOL_CREATED_TOPIC:
+                fee = _decode(['uint24'], log['topics'][3])[0]
+                pool = _decode(['int24', 'address'], log['data'])[1]
+                created.append({'protocol': 'v3', 'token0': token0, 'token1': token1, 'fee': fee, 'pool': Web3.to_checksum_address(pool)})
+            else:
+                pair = _decode(['address', 'uint256'], log['data'])[0]
+                created.append({'protocol': 'v2', 'token0': token0, 'token1': token1, 'fee': None, 'pool': Web3.to_checksum_address(pair)})
+        if created:
+            _add_pools(created)
+            found += len(created)
+        _checkpoint = end
+        # Saved every chunk of a catch-up (and whenever pools were found), so a restart resumes from here
+        if created or _saved_checkpoint is None or _checkpoint - _saved_checkpoint >= LOG_BLOCK_RANGE:
+            save()
+        start = end + 1
+    _last_sync = time.time()
+    if found:
+        logging.info("[PoolIndex] Indexed %s new pools up to block %s", found, _checkpoint)
+    _refresh_fallbacks()
+    return _checkpoint
+
+
+def get_pool(token, fee=None):
+    """WETH pool for a token (at the given fee tier, or any tier), or None if the index has none."""
+    entry = _tokens.get(token.lower())
+    if not entry:
+        return None
+    if fee is None:
+        return next(iter(entry['pools'].values()), None)
+    return entry['pools'].get(fee)
+
+
+def all_pools():
+    return list(_pools)
+
+
+def get_token(token):
+    return _tokens.get(token.lower())
+
+
+def search(prefix, limit=10):
+    """Indexed tokens whose symbol starts with prefix (case-insensitive), in symbol order."""
+    prefix = prefix.lower()
+    symbols = _symbols
+    i = bisect_left(symbols, (prefix, ''))
+    matches = []
+    while i < len(symbols) and symbols[i][0].startswith(prefix) and len(matches) < limit:
+        matches.append(_tokens[symbols[i][1]])
+        i += 1
+    return matches
+
+
+def _index_loop():
+    with admission.background():
+        while True:
+            try:
+                sync()
+            except Exception as e:
+                logging.error("[PoolIndex] Sync failed after block %s: %s", _checkpoint, e)
+            time.sleep(POOL_INDEX_POLL_INTERVAL)
+
+
+def start_indexing():
+    """Loads the checkpoint and follows new PoolCreated/PairCreated logs in a background thread (polling mode)."""
+    global _index_thread
+    if _index_thread is not None and _index_thread.is_alive():
+        return
+    load()
+    _index_thread = threading.Thread(target=_index_loop, name="pool-index", daemon=True)
+    _index_thread.start()
@@ -0,0 +1,144 @@
+import sys
+import logging
+from web3 import Web3
+from config import RPC_URL
+import multicall
+import metrics
+import log_follower
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+SWAP_TOPIC = Web3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)")
+MINT_TOPIC = Web3.keccak(text="Mint(address,address,int24,int24,uint128,uint256,uint256)")
+BURN_TOPIC = Web3.keccak(text="Burn(address,int24,int24,uint128,uint256,uint256)")
+
+
+def _decode(types, data):
+    return w3.codec.decode(types, bytes(data))
+
+
+def _read_ticks(pool_address, tick_spacing, block):
+    """Reads every initialized tick of a pool via tickBitmap + ticks, batched through Multicall3."""
+    min_word = (MIN_TICK // tick_spacing) >> 8
+    max_word = (MAX_TICK // tick_spacing) >> 8
+    words = list(range(min_word, max_word + 1))
+    bitmaps = multicall.aggregate(
+        [(pool_address, multicall.encode_call("tickBitmap(int16)", ['int16'], [word])) for word in words],
+        block_identifier=block)
+    initialized = []
+    for word, data in zip(words, bitmaps):
+        bitmap = _decode(['uint256'], data)[0] if data else 0
+        while bitmap:
+            bit = (bitmap & -bitmap).bit_length() - 1
+            initialized.append(((word << 8) + bit) * tick_spacing)
+            bitmap &= bitmap - 1
+    infos = multicall.aggregate(
+        [(pool_address, multicall.encode_call("ticks(int24)", ['int24'], [tick])) for tick in initialized],
+        block_identifier=block)
+    ticks = {}
+    for tick, data in zip(initialized, infos):
+        if not data:
+            # A missing tick would silently misprice every swap crossing it
+            raise ValueError(f"ticks({tick}) failed on {pool_address}")
+        gross, net = _decode(['uint128', 'int128'], data[:64])
+        if gross:
+            ticks[tick] = (gross, net)
+    return ticks
+
+
+def _bootstrap(pool_address, block):
+    pool_address = Web3.to_checksum_address(pool_address)
+    calls = [(pool_address, multicall.encode_call(sig)) for sig in ("slot0()", "liquidity()", "tickSpacing()", "fee()", "token0()", "token1()")]
+    results = multicall.aggregate(calls, block_identifier=block)
+    if None in results:
+        raise ValueError(f"{pool_address} is not a V3 pool (a state call failed at block {block})")
+    slot0, liquidity, spacing, fee, token0, token1 = results
+    sqrt_price_x96, tick = _decode(['uint160', 'int24'], slot0[:64])
+    tick_spacing = _decode(['int24'], spacing)[0]
+    return {
+        'address': pool_address,
+        'token0': _decode(['address'], token0)[0],
+        'token1': _decode(['address'], token1)[0],
+        'fee': _decode(['uint24'], fee)[0],
+        'tick_spacing': tick_spacing,
+        'sqrt_price_x96': sqrt_price_x96,
+        'tick': tick,
+        'liquidity': _decode(['uint128'], liquidity)[0],
+        'ticks': _read_ticks(pool_address, tick_spacing, block),
+    }
+
+
+def read_pool(pool_address):
+    """A pool's state read from chain at the latest block, bypassing (and not touching) the cache."""
+    return _bootstrap(pool_address, w3.eth.block_number)
+
+
+def _apply_log(state, log):
+    """Returns a new state with one Swap/Mint/Burn log applied."""
+    topic = bytes(log['topics'][0])
+    state = dict(state)
+    if topic == SWAP_TOPIC:
+        _, _, sqrt_price_x96, liquidity, tick = _decode(['int256', 'int256', 'uint160', 'uint128', 'int24'], log['data'])
+        state.update(sqrt_price_x96=sqrt_price_x96, liquidity=liquidity, tick=tick)
+        return state
+    tick_lower = _decode(['int24'], log['topics'][2])[0]
+    tick_upper = _decode(['int24'], log['topics'][3])[0]
+    if topic == MINT_TOPIC:
+        amount = _decode(['address', 'uint128', 'uint256', 'uint256'], log['data'])[1]
+    else:
+        amount = -_decode(['uint128', 'uint256', 'uint256'], log['data'])[0]
+    if amount == 0:
+        # Zero-amount burns are used to poke fees and leave liquidity untouched
+        return state
+    ticks = dict(state['ticks'])
+    for tick, net_sign in ((tick_lower, 1), (tick_upper, -1)):
+        gross, net = ticks.get(tick, (0, 0))
+        gross += amount
+        if gross:
+            ticks[tick] = (gross, net + net_sign * amount)
+        else:
+            ticks.pop(tick, None)
+    state['ticks'] = ticks
+    if tick_lower <= state['tick'] < tick_upper:
+        state['liquidity'] += amount
+    return state
+
+
+_follower = log_follower.LogFollower('PoolState', [[SWAP_TOPIC, MINT_TOPIC, BURN_TOPIC]], _bootstrap, _apply_log,
+                                     "pool-state")
+track_pool = _follower.track
+sync = _follower.sync
+is_streaming = _follower.is_streaming
+start_streaming = _follower.start_streaming
+
+
+def get_pool(pool_address):
+    """
+    Returns the cached state of a pool (tracking it on first use). Without the background
+    stream running, the cache is caught up on demand once it is older than POOL_STATE_TTL.
+    """
+    metrics.cache_lookup('pool_state', pool_address.lower() in _follower.states)
+    return _follower.get(pool_address)
+
+
+def verify_pool(pool_address):
+    """
+    Compares the cached state of a pool against chain state at the same block.
+    Returns a list of mismatch descriptions (empty when the cache is exact).
+    """
+    cached, fresh, mismatches = _follower.verify(pool_address, ('sqrt_price_x96', 'tick', 'liquidity'))
+    for tick in set(cached['ticks']) | set(fresh['ticks']):
+        if cached['ticks'].get(tick) != fresh['ticks'].get(tick):
+            mismatches.append(f"tick {tick}: cached {cached['ticks'].get(tick)} != chain {fresh['ticks'].get(tick)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    # Usage: python pool_state.py <pool> [<pool> ...]
+    # Streams the given pools (e.g. on a local devnet while swapping/minting against them)
+    # and verifies the incrementally maintained state against the chain every 10 blocks.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    _follower.follow(sys.argv[1:], verify_pool)
@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from config import PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MAX_SECONDS
+
+LOOP_PROBE_INTERVAL = 0.05
+# asyncio task stacks are sampled every this many CPU samples; walking every task is costlier than one frame dump
+TASK_SAMPLE_EVERY = 10
+TOP = 10
+
+_lock = threading.Lock()
+# The profiling window in progress, if any
+_session = None
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded(frame):
+    """A frame's stack as root-first labels."""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class Session:
+    """
+    One profiling window: a sampler thread collects the stack of every thread (and, less often,
+    of every asyncio task) into folded-stack counts, a probe on the event loop measures its lag,
+    and handler calls finishing inside the window are timed.
+    """
+
+    def __init__(self, seconds, loop):
+        self.seconds = seconds
+        self.loop = loop
+        self.started = time.time()
+        self.threads = {}
+        self.tasks = {}
+        self.samples = 0
+        self.lags = []
+        self.handlers = []  # (seconds, handler)
+        self.loop_thread = threading.main_thread().ident
+        self.done = threading.Event()
+
+    def _add(self, counts, stack):
+        key = ';'.join(stack)
+        counts[key] = counts.get(key, 0) + 1
+
+    def _sample_tasks(self):
+        try:
+            tasks = asyncio.all_tasks(self.loop)
+        except RuntimeError:
+            return  # the task set changed while it was copied; the next sample will do
+        for task in tasks:
+            stack = []
+            for frame in task.get_stack():
+                stack.append(_label(frame.f_code))
+            if stack:
+                self._add(self.tasks, [f"task {task.get_name()}"] + stack)
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.perf_counter() + self.seconds
+        while time.perf_counter() < deadline and not self.done.is_set():
+            for ident, frame in sys._current_frames().items():
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                if ident != me:
+                    self._add(self.threads, [names.get(ident, str(ident))] + _folded(frame))
+            self.samples += 1
+            if self.loop is not None and self.samples % TASK_SAMPLE_EVERY == 0:
+                self._sample_tasks()
+            time.sleep(PROFILE_INTERVAL)
+        self.done.set()
+
+    async def _probe(self):
+        self.loop_thread = threading.get_ident()
+        while not self.done.is_set():
+            expected = time.perf_counter() + LOOP_PROBE_INTERVAL
+            await asyncio.sleep(LOOP_PROBE_INTERVAL)
+            self.lags.append(time.perf_counter() - expected)
+
+    def start(self):
+        threading.Thread(target=self._sample, name="profiler", daemon=True).start()
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._probe(), self.loop)
+
+    def write(self):
+        """
+        Writes the folded stacks (flamegraph.pl / speedscope input; wall-clock samples of every
+        thread, so waits on RPC show up too) and returns the summary and the file paths.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        paths = []
+        for name, counts in (('threads', self.threads), ('tasks', self.tasks)):
+            if not counts:
+                continue
+            path = os.path.join(PROFILE_DIR, f"profile-{stamp}-{os.getpid()}-{name}.folded")
+            with open(path, 'w') as f:
+                for stack, count in sorted(counts.items()):
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+        return self.summary(), paths
+
+    def summary(self):
+        # Handlers run on the event loop thread, so its busy samples are the hot paths; idle, it sits in select()
+        loop_thread = {thread.ident: thread.name for thread in threading.enumerate()}.get(self.loop_thread, 'MainThread')
+        own = {}
+        busy = 0
+        for stack, count in self.threads.items():
+            frames = stack.split(';')
+            if frames[0] != loop_thread or frames[-1].startswith('select '):
+                continue
+            busy += count
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+        lags = sorted(self.lags)
+        pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000 if lags else 0.0
+        lines = [f"Profiled {self.seconds:g}s, {self.samples} samples every {PROFILE_INTERVAL * 1000:.0f} ms"]
+        if self.loop is not None:
+            lines.append(f"Event loop lag: p50 {pick(0.5):.1f} ms, p95 {pick(0.95):.1f} ms, "
+                         f"max {lags[-1] * 1000 if lags else 0.0:.1f} ms")
+        lines.append(f"Event loop thread busy in {busy} of {self.samples} samples. Hottest functions there:")
+        for label, count in sorted(own.items(), key=lambda item: item[1], reverse=True)[:TOP]:
+            lines.append(f"  {count:>6}  {label}")
+        lines.append("Slowest handler calls:")
+        for seconds, handler in sorted(self.handlers, reverse=True)[:TOP]:
+            lines.append(f"  {seconds * 1000:>8.1f} ms  {handler}")
+        return '\n'.join(lines)
+
+
+def record_handler(name, seconds):
+    """Called by tracing.handler for every handler call; kept only while a window is open."""
+    session = _session
+    if session is not None and not session.done.is_set():
+        session.handlers.append((seconds, name))
+
+
+def start(seconds=None, loop=None):
+    """
+    Opens a profiling window of seconds (capped at PROFILE_MAX_SECONDS) unless one is open.
+    loop, the bot's event loop, adds event-loop lag and asyncio task stacks. Returns the session or None.
+    """
+    global _session
+    seconds = min(float(seconds or 30), PROFILE_MAX_SECONDS)
+    with _lock:
+        if _session is not None and not _session.done.is_set():
+            return None
+        _session = Session(seconds, loop)
+    _session.start()
+    logging.warning("[Profiler] Profiling for %gs", seconds)
+    return _session
+
+
+def finish(session):
+    """Blocks until the window closes; then writes and logs its results. Returns (summary, paths)."""
+    session.done.wait()
+    summary, paths = session.write()
+    logging.warning("[Profiler] %s\nFolded stacks: %s", summary, ', '.join(paths))
+    return summary, paths
+
+
+async def profile(seconds=None):
+    """start() on the running loop, awaited until the results are written. None if a window is already open."""
+    session = start(seconds, asyncio.get_running_loop())
+    if session is None:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(None, finish, session)
+
+
+def install_signal(signum=None):
+    """
+    Makes SIGUSR1 (by default) open a 30 second window in the running bot, with the results in the
+    log and PROFILE_DIR. Must be called from the main thread; a no-op where the signal doesn't exist.
+    """
+    import signal
+    signum = signum or getattr(signal, 'SIGUSR1', None)
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return
+
+    def on_signal(number, frame):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        session = start(loop=loop)
+        if session is not None:
+            threading.Thread(target=finish, args=(session,), name="profiler-report", daemon=True).start()
+    signal.signal(signum, on_signal)
+
+
+if __name__ == "__main__":
+    # Usage: python profiler.py <folded file> [top]
+    # Prints the heaviest stacks of a folded-stack file, e.g. to skim one without rendering a flamegraph.
+    # (flamegraph.pl profile.folded > profile.svg, or load the file in https://www.speedscope.app)
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with open(sys.argv[1]) as f:
+        stacks = [line.rsplit(' ', 1) for line in f if line.strip()]
+    total = sum(int(count) for _, count in stacks) or 1
+    for stack, count in sorted(stacks, key=lambda item: int(item[1]), reverse=True)[:top]:
+        frames = stack.split(';')
+        print(f"{int(count) / total:6.1%}  {frames[0]}: {' > '.join(frames[-3:])}")
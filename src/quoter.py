@@ -0,0 +1,247 @@
+import sys
+import random
+import logging
+from web3 import Web3
+from config import ROUTERS, RPC_URL, QUOTER_V2, SLIPPAGE_BPS
+import pool_state
+import pair_state
+import pool_index
+import v3_math
+import metrics
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+V3_FACTORY_ABI = [
+    {"inputs": [{"internalType": "address", "name": "tokenA", "type": "address"}, {"internalType": "address", "name": "tokenB", "type": "address"}, {"internalType": "uint24", "name": "fee", "type": "uint24"}], "name": "getPool", "outputs": [{"internalType": "address", "name": "pool", "type": "address"}], "stateMutability": "view", "type": "function"}
+]
+QUOTER_V2_ABI = [
+    {"inputs": [{"components": [{"internalType": "address", "name": "tokenIn", "type": "address"}, {"internalType": "address", "name": "tokenOut", "type": "address"}, {"internalType": "uint256", "name": "amountIn", "type": "uint256"}, {"internalType": "uint24", "name": "fee", "type": "uint24"}, {"internalType": "uint160", "name": "sqrtPriceLimitX96", "type": "uint160"}], "internalType": "struct IQuoterV2.QuoteExactInputSingleParams", "name": "params", "type": "tuple"}], "name": "quoteExactInputSingle", "outputs": [{"internalType": "uint256", "name": "amountOut", "type": "uint256"}, {"internalType": "uint160", "name": "sqrtPriceX96After", "type": "uint160"}, {"internalType": "uint32", "name": "initializedTicksCrossed", "type": "uint32"}, {"internalType": "uint256", "name": "gasEstimate", "type": "uint256"}], "stateMutability": "nonpayable", "type": "function"},
+    {"inputs": [{"components": [{"internalType": "address", "name": "tokenIn", "type": "address"}, {"internalType": "address", "name": "tokenOut", "type": "address"}, {"internalType": "uint256", "name": "amount", "type": "uint256"}, {"internalType": "uint24", "name": "fee", "type": "uint24"}, {"internalType": "uint160", "name": "sqrtPriceLimitX96", "type": "uint160"}], "internalType": "struct IQuoterV2.QuoteExactOutputSingleParams", "name": "params", "type": "tuple"}], "name": "quoteExactOutputSingle", "outputs": [{"internalType": "uint256", "name": "amountIn", "type": "uint256"}, {"internalType": "uint160", "name": "sqrtPriceX96After", "type": "uint160"}, {"internalType": "uint32", "name": "initializedTicksCrossed", "type": "uint32"}, {"internalType": "uint256", "name": "gasEstimate", "type": "uint256"}], "stateMutability": "nonpayable", "type": "function"}
+]
+V2_ROUTER_QUOTE_ABI = [
+    {"inputs": [{"internalType": "uint256", "name": "amountIn", "type": "uint256"}, {"internalType": "address[]", "name": "path", "type": "address[]"}], "name": "getAmountsOut", "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}], "stateMutability": "view", "type": "function"}
+]
+
+# Share of fuzz rounds that must reach QuoterV2 for a run to count as a pass
+FUZZ_MIN_COMPARED = 0.5
+
+# Pool addresses never change once created, so they are cached for the process lifetime
+_pool_addresses = {}
+
+
+def apply_slippage(amount_out, slippage_bps=None):
+    """Minimum acceptable output for a quoted amount, given a slippage tolerance in basis points."""
+    bps = SLIPPAGE_BPS if slippage_bps is None else slippage_bps
+    return amount_out * (10000 - bps) // 10000
+
+
+def get_pool_address(token_a, token_b, fee):
+    """Returns the InkyFactory V3 pool for the pair, or None if it does not exist."""
+    token_a = Web3.to_checksum_address(token_a)
+    token_b = Web3.to_checksum_address(token_b)
+    key = (min(token_a.lower(), token_b.lower()), max(token_a.lower(), token_b.lower()), fee)
+    if key in _pool_addresses:
+        return _pool_addresses[key]
+    weth = ROUTERS[0]['weth'].lower()
+    if weth in key[:2]:
+        indexed = pool_index.get_pool(key[1] if key[0] == weth else key[0], fee)
+        if indexed:
+            _pool_addresses[key] = indexed
+            return indexed
+    v3_router = next(r for r in ROUTERS if r['type'] == 'v3')
+    factory = w3.eth.contract(address=Web3.to_checksum_address(v3_router['factory']), abi=V3_FACTORY_ABI)
+    pool = factory.functions.getPool(token_a, token_b, fee).call()
+    if pool == ZERO_ADDRESS:
+        # Don't cache misses, the pool may be created later
+        return None
+    _pool_addresses[key] = pool
+    return pool
+
+
+def _quoter_contract():
+    return w3.eth.contract(address=Web3.to_checksum_address(QUOTER_V2), abi=QUOTER_V2_ABI)
+
+
+def _simulate_v3(state, zero_for_one, amount, exact_output, source):
+    result = v3_math.swap(state, zero_for_one, -amount if exact_output else amount)
+    filled = result['amount_out'] if exact_output else result['amount_in']
+    if filled != amount:
+        # Ran out of liquidity before the full amount could be swapped
+        return None
+    return {
+        'amount_in': result['amount_in'],
+        'amount_out': result['amount_out'],
+        'price_impact': v3_math.price_impact(state['sqrt_price_x96'], result['sqrt_price_x96']),
+        'source': source,
+    }
+
+
+def _quote_v3(token_in, token_out, amount, fee, exact_output=False):
+    """
+    Simulates the swap locally over the cached pool ticks (v3_math). When the pool cache is
+    unavailable, QuoterV2 is asked if configured; otherwise the pool is read from chain and
+    simulated the same way. amount is the input, or the output if exact_output.
+    """
+    pool = get_pool_address(token_in, token_out, fee)
+    if not pool:
+        return None
+    zero_for_one = int(token_in, 16) < int(token_out, 16)
+    try:
+        return _simulate_v3(pool_state.get_pool(pool), zero_for_one, amount, exact_output, 'cache')
+    except Exception as e:
+        logging.warning("[Quoter] Cached pool state unavailable for %s: %s", pool, e)
+    if not QUOTER_V2:
+        return _simulate_v3(pool_state.read_pool(pool), zero_for_one, amount, exact_output, 'chain')
+    if exact_output:
+        amount_in, sqrt_after, _, _ = _quoter_contract().functions.quoteExactOutputSingle({
+            'tokenIn': token_in, 'tokenOut': token_out, 'amount': amount, 'fee': fee, 'sqrtPriceLimitX96': 0
+        }).call()
+        amount_out = amount
+    else:
+        amount_out, sqrt_after, _, _ = _quoter_contract().functions.quoteExactInputSingle({
+            'tokenIn': token_in, 'tokenOut': token_out, 'amountIn': amount, 'fee': fee, 'sqrtPriceLimitX96': 0
+        }).call()
+        amount_in = amount
+    return {'amount_in': amount_in, 'amount_out': amount_out, 'price_impact': None, 'source': 'quoter'}
+
+
+def _quote_v2(router, hops, amount_in):
+    """
+    Constant-product quote over the cached pair reserves (pair_state). getAmountsOut is only
+    used when the reserve cache is unavailable.
+    """
+    try:
+        amount, remaining = amount_in, 1.0
+        for hop in hops:
+            result = pair_state.swap(pair_state.get_pair(hop['pool']), hop['token_in'], amount)
+            amount = result['amount_out']
+            remaining *= 1 - result['price_impact']
+        return {'amount_in': amount_in, 'amount_out': amount, 'price_impact': 1 - remaining, 'source': 'cache'}
+    except Exception as e:
+        logging.warning("[Quoter] Cached pair reserves unavailable: %s", e)
+    path = [hops[0]['token_in']] + [hop['token_out'] for hop in hops]
+    router_contract = w3.eth.contract(address=Web3.to_checksum_address(router['router']), abi=V2_ROUTER_QUOTE_ABI)
+    amounts = router_contract.functions.getAmountsOut(amount_in, path).call()
+    return {'amount_in': amount_in, 'amount_out': amounts[-1], 'price_impact': None, 'source': 'v2_router'}
+
+
+def _quote_v3_path(hops, amount_in):
+    """Chains single-pool quotes along the hops; price impact compounds as 1 - prod(1 - impact)."""
+    amount, remaining, source = amount_in, 1.0, 'cache'
+    for hop in hops:
+        quote = _quote_v3(hop['token_in'], hop['token_out'], amount, hop['fee'])
+        if not quote:
+            return None
+        amount = quote['amount_out']
+        if quote['price_impact'] is None:
+            remaining = None
+        elif remaining is not None:
+            remaining *= 1 - quote['price_impact']
+        if quote['source'] != 'cache':
+            source = quote['source']
+    return {'amount_in': amount_in, 'amount_out': amount,
+            'price_impact': None if remaining is None else 1 - remaining, 'source': source}
+
+
+def quote_route(route, amount_in, slippage_bps=None):
+    """
+    Quotes an exact-input swap along a route from routing. Returns a dict with amount_out,
+    amount_out_min, price_impact (fraction, may be None) and source, or {'error': ...}.
+    """
+    try:
+        if route['protocol'] == 'v3':
+            quote = _quote_v3_path(route['hops'], amount_in)
+        else:
+            quote = _quote_v2(route['router'], route['hops'], amount_in)
+    except Exception as e:
+        return {'error': f'Quote failed: {e}'}
+    if not quote:
+        return {'error': 'Unable to quote this trade.'}
+    # A quote served from cached pool state or reserves, or one that needed the on-chain quoter
+    metrics.cache_lookup('quote', quote['source'] == 'cache')
+    quote['amount_out_min'] = apply_slippage(quote['amount_out'], slippage_bps)
+    return quote
+
+
+def quote_exact_output(token_in, token_out, amount_out, slippage_bps=None):
+    """
+    Quotes an exactOutputSingle swap on the InkyFactory V3 pool. Returns a dict with
+    amount_in, amount_in_max (amount_in plus slippage), price_impact and source, or {'error': ...}.
+    """
+    token_in = Web3.to_checksum_address(token_in)
+    token_out = Web3.to_checksum_address(token_out)
+    v3_router = next(r for r in ROUTERS if r['type'] == 'v3')
+    try:
+        quote = _quote_v3(token_in, token_out, amount_out, v3_router['fee'], exact_output=True)
+    except Exception as e:
+        return {'error': f'Quote failed: {e}'}
+    if not quote:
+        return {'error': 'Unable to quote this trade.'}
+    bps = SLIPPAGE_BPS if slippage_bps is None else slippage_bps
+    quote['amount_in_max'] = quote['amount_in'] * (10000 + bps) // 10000
+    return quote
+
+
+def fuzz_against_quoter(pool_address, rounds=100, seed=None):
+    """
+    Compares local v3_math quotes with on-chain QuoterV2 results for random exact-input and
+    exact-output amounts in both directions, at the block the pool cache is synced to.
+    Returns (mismatches, compared): the differing quotes, and how many rounds QuoterV2 answered.
+    Rounds the local math can't fill are skipped; QuoterV2 failures are logged and not compared.
+    """
+    if not QUOTER_V2:
+        raise ValueError("QUOTER_V2 is not set")
+    rng = random.Random(seed)
+    pool_state.sync()
+    state = pool_state.get_pool(pool_address)
+    block = state['synced_block']
+    quoter_contract = _quoter_contract()
+    mismatches = []
+    compared = 0
+    for _ in range(rounds):
+        zero_for_one = rng.random() < 0.5
+        exact_output = rng.random() < 0.5
+        token_in, token_out = (state['token0'], state['token1']) if zero_for_one else (state['token1'], state['token0'])
+        # Log-uniform amounts cover both the single-step fast path and multi-tick swaps
+        amount = int(10 ** rng.uniform(3, 24))
+        try:
+            local = v3_math.swap(state, zero_for_one, -amount if exact_output else amount)
+        except ValueError:
+            continue
+        if (local['amount_out'] if exact_output else local['amount_in']) != amount:
+            continue
+        try:
+            if exact_output:
+                chain_value = quoter_contract.functions.quoteExactOutputSingle({
+                    'tokenIn': token_in, 'tokenOut': token_out, 'amount': amount, 'fee': state['fee'], 'sqrtPriceLimitX96': 0
+                }).call(block_identifier=block)[0]
+            else:
+                chain_value = quoter_contract.functions.quoteExactInputSingle({
+                    'tokenIn': token_in, 'tokenOut': token_out, 'amountIn': amount, 'fee': state['fee'], 'sqrtPriceLimitX96': 0
+                }).call(block_identifier=block)[0]
+        except Exception as e:
+            logging.warning("[Quoter] QuoterV2 failed for %s (%s): %s", amount, 'exact output' if exact_output else 'exact input', e)
+            continue
+        compared += 1
+        local_value = local['amount_in'] if exact_output else local['amount_out']
+        if local_value != chain_value:
+            mismatches.append({'zero_for_one': zero_for_one, 'exact_output': exact_output, 'amount': amount,
+                               'local': local_value, 'quoter': chain_value})
+    return mismatches, compared
+
+
+if __name__ == "__main__":
+    # Usage: python quoter.py <pool> [rounds]  (needs QUOTER_V2 set; works against a devnet fork too)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    problems, compared = fuzz_against_quoter(sys.argv[1], rounds)
+    for problem in problems:
+        logging.error("[Quoter] Mismatch: %s", problem)
+    logging.info("[Quoter] Fuzz finished with %s mismatches in %s of %s rounds compared", len(problems), compared, rounds)
+    if compared < rounds * FUZZ_MIN_COMPARED:
+        # A wrong QUOTER_V2 or an unreachable node fails every call; that is not a pass
+        logging.error("[Quoter] Only %s of %s rounds could be compared against QuoterV2", compared, rounds)
+        sys.exit(1)
+    sys.exit(1 if problems else 0)
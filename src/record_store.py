@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+import metrics
+
+
+class _FileStore:
+    """
+    Records in a JSON file, for a single process. Every record carries '_version', and update()
+    and delete() are compare-and-set on it, with the same semantics as the DynamoDB store.
+    """
+
+    def __init__(self, path, tag):
+        self.path = path
+        self.tag = tag
+        self._records = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._records is not None:
+            return
+        self._records = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self._records.update(json.load(f))
+            for record in self._records.values():
+                # Files written before records were versioned
+                record.setdefault('_version', 0)
+        except Exception as e:
+            logging.warning("[%s] Ignoring unreadable %s: %s", self.tag, self.path, e)
+
+    def _save(self):
+        try:
+            # Per-process tmp name: sharded workers may share the directory
+            tmp_file = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self._records, f)
+            os.replace(tmp_file, self.path)
+        except Exception as e:
+            logging.warning("[%s] Could not persist %s: %s", self.tag, self.path, e)
+
+    def all(self):
+        with self._lock:
+            self._load()
+            return {key: dict(record) for key, record in self._records.items()}
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            record = self._records.get(key)
+            return dict(record) if record is not None else None
+
+    def add(self, key, record):
+        """Stores a new record (replacing any record under key)."""
+        record['_version'] = 0
+        with self._lock:
+            self._load()
+            self._records[key] = dict(record)
+            self._save()
+
+    def update(self, key, record):
+        """
+        Writes record if the stored one still has its '_version' (or, for a record without one, if
+        key is absent). False if it changed, is gone or already exists.
+        """
+        with self._lock:
+            self._load()
+            stored = self._records.get(key)
+            if '_version' not in record:
+                if stored is not None:
+                    return False
+                record['_version'] = -1
+            elif stored is None or stored['_version'] != record['_version']:
+                return False
+            record['_version'] += 1
+            self._records[key] = dict(record)
+            self._save()
+            return True
+
+    def delete(self, key, record=None):
+        """Removes key (only at record's '_version', if given). True for the one caller that removed it."""
+        with self._lock:
+            self._load()
+            stored = self._records.get(key)
+            if stored is None or (record is not None and stored['_version'] != record['_version']):
+                return False
+            del self._records[key]
+            self._save()
+            return True
+
+
+class _DynamoStore:
+    """
+    Records in a DynamoDB table (partition key key_name, string), shared by every instance: each
+    item holds the record as JSON and its version, and update()/delete() are conditional writes on it.
+    """
+
+    def __init__(self, table_name, key_name):
+        import boto3
+        from botocore.exceptions import ClientError
+        self._table = boto3.resource('dynamodb').Table(table_name)
+        self._key_name = key_name
+        self._client_error = ClientError
+
+    def _record(self, item):
+        record = json.loads(item['record'])
+        record['_version'] = int(item['version'])
+        return record
+
+    def _item(self, key, record, version):
+        body = {k: v for k, v in record.items() if k != '_version'}
+        return {self._key_name: key, 'record': json.dumps(body, default=str), 'version': version}
+
+    def _conditional(self, operation, call, **kwargs):
+        try:
+            with metrics.timer('dynamodb_seconds', operation=operation):
+                call(**kwargs)
+            return True
+        except self._client_error as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def all(self):
+        records = {}
+        kwargs = {'ConsistentRead': True}
+        while True:
+            with metrics.timer('dynamodb_seconds', operation='Scan'):
+                page = self._table.scan(**kwargs)
+            for item in page.get('Items', []):
+                records[item[self._key_name]] = self._record(item)
+            if 'LastEvaluatedKey' not in page:
+                return records
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    def get(self, key):
+        with metrics.timer('dynamodb_seconds', operation='GetItem'):
+            item = self._table.get_item(Key={self._key_name: key}, ConsistentRead=True).get('Item')
+        return self._record(item) if item else None
+
+    def add(self, key, record):
+        record['_version'] = 0
+        with metrics.timer('dynamodb_seconds', operation='PutItem'):
+            self._table.put_item(Item=self._item(key, record, 0))
+
+    def update(self, key, record):
+        if '_version' not in record:
+            version = -1
+            condition = {'ConditionExpression': f'attribute_not_exists({self._key_name})'}
+        else:
+            version = record['_version']
+            condition = {'ConditionExpression': 'version = :version', 'ExpressionAttributeValues': {':version': version}}
+        if not self._conditional('PutItem', self._table.put_item, Item=self._item(key, record, version + 1), **condition):
+            return False
+        record['_version'] = version + 1
+        return True
+
+    def delete(self, key, record=None):
+        kwargs = {'Key': {self._key_name: key}, 'ConditionExpression': f'attribute_exists({self._key_name})'}
+        if record is not None:
+            kwargs['ConditionExpression'] += ' AND version = :version'
+            kwargs['ExpressionAttributeValues'] = {':version': record['_version']}
+        return self._conditional('DeleteItem', self._table.delete_item, **kwargs)
+
+
+def open_store(table_name, path, key_name, tag):
+    """
+    Keyed JSON records: in DynamoDB table_name when it is set (shared by every instance, and
+    the only option that survives under Lambda), otherwise in the JSON file path.
+    """
+    if table_name:
+        return _DynamoStore(table_name, key_name)
+    return _FileStore(path, tag)
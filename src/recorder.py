@@ -0,0 +1,482 @@
+import os
+import re
+import sys
+import copy
+import gzip
+import hmac
+import json
+import time
+import queue
+import atexit
+import hashlib
+import importlib
+import logging
+import argparse
+import tempfile
+import functools
+import threading
+import contextvars
+from config import RECORD_FILE, RECORD_SALT
+
+# Private keys (64 hex digits, with or without 0x) and seed phrases (12 or more lowercase words)
+SECRET_PATTERNS = [re.compile(r'\b(0x)?[0-9a-fA-F]{64}\b'), re.compile(r'\b[a-z]{3,8}(\s+[a-z]{3,8}){11,}\b')]
+REDACTED = '<redacted>'
+# Fields of an update kept in a recording; names, usernames, photos and the bot's own message texts are dropped
+USER_FIELDS = ('id', 'is_bot')
+CHAT_FIELDS = ('id', 'type')
+MESSAGE_FIELDS = ('message_id', 'date', 'text', 'entities')
+CALLBACK_FIELDS = ('id', 'data', 'chat_instance')
+# Handler groups of the recording hooks: before and after all of the bot's own handlers
+FIRST_GROUP, LAST_GROUP = -1000, 999
+# Runs of hex digits long enough to hold an address: plain, 0x-prefixed, padded in a topic or inside calldata
+HEX_RUN = re.compile(r'[0-9a-fA-F]{40,}')
+# Transaction fields that give the sender away (it can be recovered from the signature)
+SIGNATURE_FIELDS = ('r', 's', 'v', 'yParity')
+# Updates waiting for the writer thread; when it is full, updates are dropped rather than waited on
+QUEUE_SIZE = 1000
+
+# Calls made while handling the current update, as [kind, args, result]
+_capture = contextvars.ContextVar('recorder_capture', default=None)
+_lock = threading.Lock()
+# update_id -> perf_counter() when its handling started
+_started = {}
+# The replay in progress, if any
+_replay = None
+# Lowercase hex of every wallet address seen -> its pseudonym
+_wallets = {}
+_queue = queue.Queue(QUEUE_SIZE)
+_writer = None
+_dropped = 0
+
+
+def enabled():
+    return bool(RECORD_FILE)
+
+
+def pseudonym(telegram_id):
+    """A stable stand-in for a Telegram user or chat id (same sign, so group chats stay negative)."""
+    digest = hmac.new(RECORD_SALT.encode(), str(abs(telegram_id)).encode(), hashlib.sha256).hexdigest()
+    value = int(digest[:12], 16) % 10 ** 10 + 1
+    return -value if telegram_id < 0 else value
+
+
+def pseudonym_address(address):
+    """A stable stand-in for a wallet address, as 40 lowercase hex digits (no 0x)."""
+    return hmac.new(RECORD_SALT.encode(), address.lower().encode(), hashlib.sha256).hexdigest()[:40]
+
+
+def add_wallet(address):
+    """Marks address as a user's wallet: wherever it appears in a recorded call, its pseudonym is written instead."""
+    if address:
+        key = address.lower().removeprefix('0x')
+        if key not in _wallets:
+            _wallets[key] = pseudonym_address(key)
+
+
+def _hide_wallets(line):
+    """Replaces every known wallet address in line, in any case and at any offset of a hex run."""
+    if not _wallets:
+        return line
+
+    def hide(match):
+        run = match.group(0)
+        lowered = run.lower()
+        parts, start, i = [], 0, 0
+        while i <= len(run) - 40:
+            hidden = _wallets.get(lowered[i:i + 40])
+            if hidden is None:
+                i += 1
+                continue
+            parts += [run[start:i], hidden]
+            i = start = i + 40
+        parts.append(run[start:])
+        return ''.join(parts)
+
+    return HEX_RUN.sub(hide, line)
+
+
+def _scrub(calls):
+    """Drops signed transactions and signatures from RPC calls: the sender's address can be recovered from them."""
+    for call in calls:
+        kind, args, result = call
+        if kind != 'rpc':
+            continue
+        if args[0] == 'eth_sendRawTransaction':
+            call[1] = [args[0], [REDACTED]]
+        transaction = result.get('result') if isinstance(result, dict) else None
+        if isinstance(transaction, dict):
+            for field in SIGNATURE_FIELDS:
+                transaction.pop(field, None)
+    return calls
+
+
+def redact(text):
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(REDACTED, text)
+    return text
+
+
+def _pick(source, fields):
+    return {field: source[field] for field in fields if field in source}
+
+
+def _message(message):
+    kept = _pick(message, MESSAGE_FIELDS)
+    if 'text' in kept:
+        kept['text'] = redact(kept['text'])
+    kept['chat'] = _pick(message.get('chat', {}), CHAT_FIELDS)
+    kept['chat']['id'] = pseudonym(kept['chat'].get('id', 0))
+    if 'from' in message:
+        kept['from'] = _pick(message['from'], USER_FIELDS)
+        if not kept['from'].get('is_bot'):
+            kept['from']['id'] = pseudonym(kept['from']['id'])
+    return kept
+
+
+def sanitize(update):
+    """A raw update with user ids pseudonymized, profile fields dropped and secrets redacted from texts."""
+    kept = {'update_id': update['update_id']}
+    if 'message' in update:
+        kept['message'] = _message(update['message'])
+    if 'callback_query' in update:
+        query = update['callback_query']
+        kept['callback_query'] = _pick(query, CALLBACK_FIELDS)
+        kept['callback_query']['from'] = _pick(query['from'], USER_FIELDS)
+        kept['callback_query']['from']['id'] = pseudonym(query['from']['id'])
+        if 'message' in query:
+            message = _message(query['message'])
+            message.pop('text', None)  # the bot's own message: balances and addresses
+            kept['callback_query']['message'] = message
+    return kept
+
+
+def _record_call(kind, args, result):
+    calls = _capture.get()
+    if calls is not None:
+        calls.append([kind, args, result])
+
+
+def recorded(kind):
+    """
+    Decorator for a lookup outside JSON-RPC whose result a replay needs (e.g. the explorer API):
+    results are captured while recording and served from the recording while replaying.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            if _replay is not None:
+                return _replay.lookup(kind, list(args), default=[])
+            result = fn(*args)
+            _record_call(kind, list(args), result)
+            return result
+        return wrapper
+    return decorate
+
+
+async def _start_update(update, context):
+    _capture.set([])
+    _started[update.update_id] = time.perf_counter()
+
+
+async def _end_update(update, context):
+    calls = _capture.get()
+    started = _started.pop(update.update_id, None)
+    _capture.set(None)
+    if calls is None:
+        return
+    entry = {'t': round(time.time(), 3), 'update': sanitize(update.to_dict()), 'calls': calls,
+             'ms': round((time.perf_counter() - started) * 1000, 1) if started else None}
+    write(entry)
+
+
+def write(entry):
+    """Hands entry to the writer thread; never blocks the event loop."""
+    global _dropped
+    _start_writer()
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        _dropped += 1
+
+
+def _start_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="recorder", daemon=True)
+            _writer.start()
+            atexit.register(_close)
+
+
+def _open():
+    return gzip.open(RECORD_FILE, 'at') if RECORD_FILE.endswith('.gz') else open(RECORD_FILE, 'a')
+
+
+def _write_loop():
+    """
+    Keeps RECORD_FILE open for the life of the process (one gzip member, not one per line),
+    sanitizes and writes each entry, and flushes whenever the queue runs dry.
+    """
+    global _dropped
+    try:
+        f = _open()
+    except Exception as e:
+        logging.warning("[Recorder] Could not open %s: %s", RECORD_FILE, e)
+        f = None
+    while True:
+        entry = _queue.get()
+        try:
+            if entry is None:
+                if f is not None:
+                    f.close()
+                return
+            if f is None:
+                continue
+            entry['calls'] = _scrub(entry['calls'])
+            f.write(_hide_wallets(json.dumps(entry, separators=(',', ':'), default=str)) + '\n')
+            if _queue.empty():
+                f.flush()
+            if _dropped:
+                logging.warning("[Recorder] Dropped %s updates while the queue was full", _dropped)
+                _dropped = 0
+        except Exception as e:
+            logging.warning("[Recorder] Could not write %s: %s", RECORD_FILE, e)
+        finally:
+            _queue.task_done()
+
+
+def _close():
+    """Writes what is queued and closes the file (the gzip trailer), at exit."""
+    _queue.put(None)
+    _writer.join(timeout=5)
+
+
+def flush(timeout=1.0):
+    """Waits (up to timeout seconds) for the writer thread to drain the queue, e.g. before a Lambda invocation returns."""
+    if _writer is None:
+        return
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.005)
+
+
+def _watch_wallets():
+    """Registers every wallet address the bot loads or creates, so recorded calls never carry it."""
+    import wallet_utils
+    get_wallet, store_wallet = wallet_utils.get_wallet, wallet_utils.store_wallet
+
+    @functools.wraps(get_wallet)
+    def watched_get_wallet(telegram_id):
+        wallet = get_wallet(telegram_id)
+        add_wallet(wallet[0])
+        return wallet
+
+    @functools.wraps(store_wallet)
+    def watched_store_wallet(telegram_id, address, encrypted_private_key):
+        add_wallet(address)
+        return store_wallet(telegram_id, address, encrypted_private_key)
+
+    wallet_utils.get_wallet = watched_get_wallet
+    wallet_utils.store_wallet = watched_store_wallet
+
+
+def install(app):
+    """Adds the hooks that capture each update and the RPC responses of handling it to app."""
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    _watch_wallets()
+    app.add_handler(TypeHandler(Update, _start_update), group=FIRST_GROUP)
+    app.add_handler(TypeHandler(Update, _end_update), group=LAST_GROUP)
+
+
+def instrument_web3():
+    """Captures every HTTPProvider response made while an update is being handled."""
+    from web3 import HTTPProvider
+    if getattr(HTTPProvider, '_recorded', False):
+        return
+    make_request, make_batch_request = HTTPProvider.make_request, HTTPProvider.make_batch_request
+
+    def recording_make_request(self, method, params):
+        response = make_request(self, method, params)
+        _record_call('rpc', [method, params], response)
+        return response
+
+    def recording_make_batch_request(self, requests):
+        responses = make_batch_request(self, requests)
+        for (method, params), response in zip(requests, responses):
+            _record_call('rpc', [method, params], response)
+        return responses
+
+    HTTPProvider.make_request = recording_make_request
+    HTTPProvider.make_batch_request = recording_make_batch_request
+    HTTPProvider._recorded = True
+
+
+def read(path):
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except EOFError:
+            # A process that was killed (or a frozen Lambda container) leaves the gzip stream without its trailer
+            logging.warning("[Recorder] %s ends without a gzip trailer; read up to the last flush", path)
+
+
+def _args_key(args):
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+class Replay:
+    """
+    Serves recorded results: first from the update being replayed (exact arguments, then the next
+    result of the same call in order), then from any update of the recording with the same
+    arguments. Anything else is a miss, answered with an error and counted. Calls on wallets were
+    recorded with pseudonymous addresses, so they are matched by order.
+    """
+
+    def __init__(self, entries):
+        self.everywhere = {}
+        for entry in entries:
+            for kind, args, result in entry['calls']:
+                self.everywhere.setdefault((kind, _args_key(args)), result)
+        self.calls = []
+        self.misses = 0
+
+    def begin(self, entry):
+        self.calls = [list(call) for call in entry['calls']]
+
+    def _take(self, match):
+        for i, call in enumerate(self.calls):
+            if match(call):
+                return self.calls.pop(i)[2]
+        return None
+
+    def lookup(self, kind, args, default=None):
+        key = _args_key(args)
+        result = self._take(lambda call: call[0] == kind and _args_key(call[1]) == key)
+        if result is None:
+            result = self._take(lambda call: call[0] == kind and (kind != 'rpc' or call[1][0] == args[0]))
+        if result is None:
+            result = self.everywhere.get((kind, key))
+        if result is None:
+            self.misses += 1
+            return default
+        return copy.deepcopy(result)
+
+    def rpc(self, method, params):
+        response = self.lookup('rpc', [method, params])
+        if response is None:
+            return {'jsonrpc': '2.0', 'id': 0, 'error': {'code': -32000, 'message': f"replay: no recorded {method}"}}
+        return response
+
+    def install(self, serve_rpc):
+        """Answers web3 from the recording (serve_rpc) and the recorded() lookups always."""
+        global _replay
+        _replay = self
+        if not serve_rpc:
+            return
+        from web3 import HTTPProvider
+        HTTPProvider.make_request = lambda provider, method, params: self.rpc(method, params)
+        HTTPProvider.make_batch_request = lambda provider, requests: [
+            {**self.rpc(method, params), 'id': i} for i, (method, params) in enumerate(requests)]
+
+
+async def replay(entries, fake_request, recorder, rpc_url=None):
+    """
+    Feeds recorded updates through the application back to back; per handler, the latency of each.
+    With rpc_url (a devnet) the users' wallets are funded there first.
+    """
+    import bot
+    import wallet_utils
+    import metrics
+    import benchmark
+    from telegram import Update
+    app = bot.get_application(request=fake_request)
+    await app.initialize()
+    # Every recorded user gets a fresh wallet, so handlers find one whether or not /start was recorded
+    telegram_ids = sorted({_sender(entry['update']) for entry in entries} - {None})
+    for telegram_id in telegram_ids:
+        wallet_utils.store_wallet(str(telegram_id), *wallet_utils.create_wallet())
+    if rpc_url:
+        benchmark.fund(rpc_url, telegram_ids)
+    for entry in entries:
+        _replay.begin(entry)
+        misses = _replay.misses
+        mark = recorder.begin()
+        before = metrics.histogram_totals('handler_seconds')
+        await app.process_update(Update.de_json(entry['update'], app.bot))
+        recorder.updates += 1
+        for labels, (count, seconds) in metrics.histogram_totals('handler_seconds').items():
+            previous_count, previous_seconds = before.get(labels, (0, 0.0))
+            if count > previous_count:
+                recorder.end(dict(labels)['handler'], [seconds - previous_seconds], mark)
+                mark = recorder.begin()
+        if _replay.misses > misses:
+            logging.debug("[Recorder] Update %s: %d calls not in the recording", entry['update']['update_id'],
+                          _replay.misses - misses)
+    await app.shutdown()
+
+
+def _sender(update):
+    for field in ('message', 'callback_query'):
+        sender = (update.get(field) or {}).get('from')
+        if sender and not sender.get('is_bot'):
+            return sender['id']
+    return None
+
+
+def main():
+    import asyncio
+    import benchmark
+    parser = argparse.ArgumentParser(description="Replay a RECORD_FILE recording through the bot's handlers at full speed.")
+    parser.add_argument('recording')
+    parser.add_argument('--rpc', help="answer JSON-RPC from this devnet instead of the recording")
+    parser.add_argument('--json', help="also write the report to this file (a baseline for --compare)")
+    parser.add_argument('--compare', help="baseline report; exit 1 if any handler regressed beyond --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    entries = list(read(args.recording))
+    from moto import mock_aws
+    with tempfile.TemporaryDirectory() as state_dir, mock_aws():
+        os.environ['RECORD_FILE'] = ''  # don't record the replay
+        benchmark.prepare_environment(argparse.Namespace(rpc=args.rpc or 'http://127.0.0.1:8545', token=None), state_dir)
+        benchmark.create_tables()
+        # This script's config was read before the stand-ins were set; the bot's modules import it from here on
+        import config
+        importlib.reload(config)
+        import recorder as recording
+        replayer = recording.Replay(entries)
+        replayer.install(serve_rpc=not args.rpc)
+        fake_request = benchmark.FakeTelegramRequest()
+        recorder = benchmark.Recorder(fake_request)
+        started = time.perf_counter()
+        asyncio.run(recording.replay(entries, fake_request, recorder, args.rpc))
+        recorder.elapsed = time.perf_counter() - started
+    report = recorder.report()
+    report['replay_misses'] = replayer.misses
+    benchmark.print_report(report)
+    print(f"{replayer.misses} calls had no recorded result")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = benchmark.compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if RECORD_FILE:
+    instrument_web3()
+
+
+if __name__ == "__main__":
+    # Usage: python recorder.py <recording[.gz]> [--rpc http://127.0.0.1:8545] [--json report.json] [--compare baseline.json]
+    # Replays a recording made with RECORD_FILE set: every update goes through the handlers back to
+    # back, against a fake Bot API and moto, with JSON-RPC (and explorer) answers taken from the
+    # recording, or from --rpc. Prints per-handler latency and RPC counts like benchmark.py, so two
+    # versions of the bot can be compared on the same real traffic.
+    main()
@@ -0,0 +1,178 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+from web3 import Web3
+from config import ROUTERS, RPC_URL, V3_FEE_TIERS, MAX_ROUTE_CANDIDATES, NO_ROUTE_TTL
+import pool_index
+import quoter
+import tracing
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+V3_ROUTER = next(r for r in ROUTERS if r['type'] == 'v3')
+V2_ROUTER = next(r for r in ROUTERS if r['type'] == 'v2')
+WETH = Web3.to_checksum_address(V3_ROUTER['weth'])
+
+V2_FACTORY_ABI = [
+    {"inputs": [{"internalType": "address", "name": "tokenA", "type": "address"}, {"internalType": "address", "name": "tokenB", "type": "address"}], "name": "getPair", "outputs": [{"internalType": "address", "name": "pair", "type": "address"}], "stateMutability": "view", "type": "function"}
+]
+
+# token (lowercase) -> {pool (lowercase): pool dict from pool_index}
+_edges = defaultdict(dict)
+# token (lowercase) -> {'buy': [route, ...], 'sell': [route, ...]}, best static rank first.
+# Precomputed so the trade path only does a dict lookup plus local quotes.
+_routes = {}
+# token (lowercase) -> monotonic time a direct lookup found no WETH pool; saves its 5 factory calls for NO_ROUTE_TTL
+_no_route = {}
+# Past this many, expired entries are pruned (users can paste any number of dead addresses)
+NO_ROUTE_MAX = 10000
+_lock = threading.Lock()
+
+
+def encode_v3_path(hops):
+    """exactInput path: tokenIn | fee (uint24) | token | fee | ... | tokenOut."""
+    path = bytes.fromhex(hops[0]['token_in'][2:])
+    for hop in hops:
+        path += hop['fee'].to_bytes(3, 'big') + bytes.fromhex(hop['token_out'][2:])
+    return path
+
+
+def _hop(pool, token_in):
+    token_out = pool['token1'] if pool['token0'].lower() == token_in.lower() else pool['token0']
+    return {'protocol': pool['protocol'], 'pool': pool['pool'], 'fee': pool['fee'],
+            'token_in': Web3.to_checksum_address(token_in), 'token_out': Web3.to_checksum_address(token_out)}
+
+
+def _make_route(hops):
+    protocol = hops[0]['protocol']
+    if protocol == 'v3':
+        path = encode_v3_path(hops)
+    else:
+        path = [hops[0]['token_in']] + [hop['token_out'] for hop in hops]
+    return {'protocol': protocol, 'router': V3_ROUTER if protocol == 'v3' else V2_ROUTER, 'hops': hops, 'path': path}
+
+
+def _reverse(hops):
+    return [{**hop, 'token_in': hop['token_out'], 'token_out': hop['token_in']} for hop in reversed(hops)]
+
+
+def _rank(hops):
+    # Static order: direct before two-hop, V3 before V2, the configured V3 fee tier before the others
+    return (len(hops), hops[0]['protocol'] != 'v3', any(hop['fee'] != V3_ROUTER['fee'] for hop in hops if hop['protocol'] == 'v3'))
+
+
+def _compute_routes(token):
+    """Candidate WETH -> token routes: direct pools, and two hops via any token paired with both."""
+    key = token.lower()
+    weth_key = WETH.lower()
+    candidates = []
+    for pool in _edges[key].values():
+        other = _hop(pool, token)['token_out']
+        if other.lower() == weth_key:
+            candidates.append([_hop(pool, WETH)])
+            continue
+        for hub_pool in _edges[other.lower()].values():
+            # Routes are executed on a single router, so both hops must share a protocol
+            if hub_pool['protocol'] == pool['protocol'] and _hop(hub_pool, other)['token_out'].lower() == weth_key:
+                candidates.append([_hop(hub_pool, WETH), _hop(pool, other)])
+    candidates.sort(key=_rank)
+    buy_routes = [_make_route(hops) for hops in candidates[:MAX_ROUTE_CANDIDATES]]
+    sell_routes = [_make_route(_reverse(hops)) for hops in candidates[:MAX_ROUTE_CANDIDATES]]
+    return {'buy': buy_routes, 'sell': sell_routes}
+
+
+def _on_pools(pools):
+    """pool_index listener: adds edges and recomputes only the route tables the new pools affect."""
+    with _lock:
+        affected = set()
+        for pool in pools:
+            token0, token1 = pool['token0'].lower(), pool['token1'].lower()
+            _edges[token0][pool['pool'].lower()] = pool
+            _edges[token1][pool['pool'].lower()] = pool
+            affected.update((token0, token1))
+            _no_route.pop(token0, None)
+            _no_route.pop(token1, None)
+            # A new WETH pair for X opens two-hop routes for every token paired with X
+            for hub in (token0, token1):
+                if (token1 if hub == token0 else token0) == WETH.lower():
+                    for neighbour_pool in _edges[hub].values():
+                        affected.update((neighbour_pool['token0'].lower(), neighbour_pool['token1'].lower()))
+        affected.discard(WETH.lower())
+        for token in affected:
+            _routes[token] = _compute_routes(token)
+
+
+def _discover_direct(token):
+    """Route table for a token the index hasn't seen (e.g. Lambda without the indexer): direct pools only."""
+    pools = []
+    for fee in V3_FEE_TIERS:
+        pool = quoter.get_pool_address(WETH, token, fee)
+        if pool:
+            pools.append({'protocol': 'v3', 'token0': WETH, 'token1': token, 'fee': fee, 'pool': pool})
+    factory = w3.eth.contract(address=Web3.to_checksum_address(V2_ROUTER['factory']), abi=V2_FACTORY_ABI)
+    pair = factory.functions.getPair(WETH, Web3.to_checksum_address(token)).call()
+    if pair != ZERO_ADDRESS:
+        pools.append({'protocol': 'v2', 'token0': WETH, 'token1': token, 'fee': None, 'pool': pair})
+    if pools:
+        _on_pools(pools)
+    return _routes.get(token.lower(), {'buy': [], 'sell': []})
+
+
+def get_routes(token_in, token_out):
+    """Precomputed candidate routes between WETH and a token, in either direction."""
+    if token_in.lower() == WETH.lower():
+        token, side = token_out, 'buy'
+    elif token_out.lower() == WETH.lower():
+        token, side = token_in, 'sell'
+    else:
+        raise ValueError("Routes are only tabled against WETH")
+    key = token.lower()
+    table = _routes.get(key)
+    if table is None or not table[side]:
+        found_none = _no_route.get(key)
+        if found_none is not None and time.monotonic() - found_none < NO_ROUTE_TTL:
+            return []
+        table = _discover_direct(Web3.to_checksum_address(token))
+        if not table[side]:
+            now = time.monotonic()
+            if len(_no_route) >= NO_ROUTE_MAX:
+                for stale in [t for t, at in list(_no_route.items()) if now - at >= NO_ROUTE_TTL]:
+                    _no_route.pop(stale, None)
+            _no_route[key] = now
+    return table[side]
+
+
+def has_route(token):
+    """Whether a token trades against WETH. Blocking: an unseen token is looked up on chain."""
+    try:
+        return bool(get_routes(WETH, token))
+    except Exception as e:
+        logging.error("[Routing] Route lookup failed for %s: %s", token, e)
+        return False
+
+
+@tracing.traced()
+def best_route(token_in, token_out, amount_in, slippage_bps=None):
+    """
+    Quotes every candidate route locally and returns the one with the highest output, as the
+    route dict merged with its quote (amount_out, amount_out_min, price_impact), or {'error': ...}.
+    """
+    try:
+        routes = get_routes(token_in, token_out)
+    except Exception as e:
+        return {'error': f'Route lookup failed: {e}'}
+    if not routes:
+        return {'error': 'No supported pool/pair for this token.'}
+    best = None
+    for route in routes:
+        quote = quoter.quote_route(route, amount_in, slippage_bps)
+        if 'error' in quote:
+            continue
+        if best is None or quote['amount_out'] > best['amount_out']:
+            best = {**route, **quote}
+    return best or {'error': 'Unable to quote this trade.'}
+
+
+pool_index.add_listener(_on_pools)
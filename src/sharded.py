@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import zlib
+import asyncio
+import logging
+import importlib
+import multiprocessing
+
+# Update fields whose 'from' identifies the user; their updates always go to the same worker
+USER_UPDATE_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                      'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member')
+# Files written by per-user state; each worker gets its own copy since a user never leaves their shard.
+# BATCH_FILE only works per shard with a single worker: batches mix users (run() requires BATCH_TABLE otherwise)
+SHARDED_FILES = ('PENDING_TX_FILE', 'FEE_LEDGER_FILE', 'BATCH_FILE', 'TRACE_FILE', 'RECORD_FILE')
+
+
+def telegram_id_of(update):
+    """The telegram_id of the user behind a raw Bot API update, or None."""
+    for field in USER_UPDATE_FIELDS:
+        sender = (update.get(field) or {}).get('from')
+        if sender:
+            return str(sender['id'])
+    return None
+
+
+def shard_of(update, workers):
+    # crc32 rather than hash(): the mapping must survive restarts, since per-shard files follow it
+    key = telegram_id_of(update) or str(update.get('update_id'))
+    return zlib.crc32(key.encode()) % workers
+
+
+async def _process(app, update, previous):
+    from telegram import Update
+    if previous is not None:
+        try:
+            await previous
+        except Exception:
+            pass
+    await app.process_update(Update.de_json(update, app.bot))
+
+
+async def _serve(app, updates):
+    """
+    Feeds a worker's queue into its application. Updates of different users run concurrently;
+    each user's updates are chained, so they are handled strictly in arrival order.
+    """
+    await app.initialize()
+    loop = asyncio.get_running_loop()
+    tails = {}
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is None:
+            break
+        key = telegram_id_of(update)
+        task = asyncio.create_task(_process(app, update, tails.get(key)))
+        tails[key] = task
+        task.add_done_callback(lambda done, key=key: tails.pop(key) if tails.get(key) is done else None)
+    await asyncio.gather(*tails.values(), return_exceptions=True)
+    await app.shutdown()
+
+
+def _run_worker(index, updates):
+    import config
+    for name in SHARDED_FILES:
+        if not getattr(config, name):
+            continue  # unset means the feature is off (TRACE_FILE, RECORD_FILE)
+        root, ext = os.path.splitext(getattr(config, name))
+        os.environ[name] = f"{root}.shard{index}{ext}"
+    if config.METRICS_PORT:
+        # One scrape endpoint per worker, on consecutive ports
+        os.environ['METRICS_PORT'] = str(config.METRICS_PORT + index)
+    # Everything imported from here on sees this shard's file names and port
+    importlib.reload(config)
+    import bot
+    app = bot.get_application()
+    bot.start_background_workers()
+    logging.info("[Sharded] Worker %s ready (pid %s)", index, os.getpid())
+    asyncio.run(_serve(app, updates))
+
+
+def _start_worker(ctx, index, updates):
+    process = ctx.Process(target=_run_worker, args=(index, updates), name=f"shard-{index}", daemon=True)
+    process.start()
+    return process
+
+
+def run(workers=None):
+    """
+    Long-polls the Bot API in this process and hands each update to one of `workers` processes by
+    telegram_id, each running its own event loop, RPC clients, caches and background threads.
+    """
+    import requests
+    from config import BOT_TOKEN, SHARD_WORKERS, BATCH_SWAPPER, BATCH_EXECUTOR_KEY, BATCH_TABLE, WALLET_LOCK_TABLE
+    workers = workers or SHARD_WORKERS
+    if workers > 1 and BATCH_SWAPPER and BATCH_EXECUTOR_KEY and not (BATCH_TABLE and WALLET_LOCK_TABLE):
+        # Per-shard batch files would split every token's buys by shard, and the workers would race
+        # each other for the executor wallet's nonces
+        raise SystemExit("[Sharded] Batch buys with several workers need BATCH_TABLE and WALLET_LOCK_TABLE "
+                         "(or set SHARD_WORKERS=1)")
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [_start_worker(ctx, i, q) for i, q in enumerate(queues)]
+    offset = None
+    while True:
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error("[Sharded] Worker %s exited with %s, restarting", i, process.exitcode)
+                processes[i] = _start_worker(ctx, i, queues[i])
+        try:
+            response = requests.get(f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates",
+                                    params={'timeout': 30, 'offset': offset}, timeout=40).json()
+        except Exception as e:
+            logging.error("[Sharded] getUpdates failed: %s", e)
+            time.sleep(1)
+            continue
+        for update in response.get('result', []):
+            queues[shard_of(update, workers)].put(update)
+            offset = update['update_id'] + 1
+
+
+def _bench_work(telegram_id):
+    """The CPU-bound part of a trade confirmation: decrypt the key, encode the swap call, sign."""
+    from web3 import Web3
+    from eth_account import Account
+    private_key = _bench_work.fernet.decrypt(_bench_work.encrypted_key).decode()
+    data = Web3.to_hex(Web3().codec.encode(
+        ['address', 'address', 'uint24', 'address', 'uint256', 'uint256', 'uint160'],
+        [_bench_work.address, _bench_work.address, 10000, _bench_work.address, int(telegram_id), 0, 0]))
+    Account.sign_transaction({'to': _bench_work.address, 'value': 0, 'gas': 600000, 'gasPrice': 10 ** 9,
+                              'nonce': int(telegram_id) % 1000, 'chainId': 57073, 'data': data}, private_key)
+
+
+def _run_bench_worker(updates, done):
+    from eth_account import Account
+    from cryptography.fernet import Fernet
+    account = Account.create()
+    _bench_work.fernet = Fernet(Fernet.generate_key())
+    _bench_work.encrypted_key = _bench_work.fernet.encrypt(account.key.hex().encode())
+    _bench_work.address = account.address
+    done.put('ready')
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        _bench_work(telegram_id_of(update))
+        done.put(update['update_id'])
+
+
+def bench(workers, total):
+    """Updates per second through the dispatcher with `workers` processes doing the per-trade CPU work."""
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue() for _ in range(workers)]
+    done = ctx.Queue()
+    processes = [ctx.Process(target=_run_bench_worker, args=(q, done), daemon=True) for q in queues]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        done.get()
+    started = time.perf_counter()
+    for update_id in range(total):
+        update = {'update_id': update_id, 'callback_query': {'from': {'id': 10 ** 8 + update_id % 997}}}
+        queues[shard_of(update, workers)].put(update)
+    for _ in range(total):
+        done.get()
+    elapsed = time.perf_counter() - started
+    for q in queues:
+        q.put(None)
+    for process in processes:
+        process.join()
+    return total / elapsed
+
+
+if __name__ == "__main__":
+    # Usage: python sharded.py [workers]                  runs the bot with N worker processes
+    #        python sharded.py bench [max_workers] [updates]
+    # The benchmark pushes synthetic updates through the dispatcher for 1, 2, 4, ... workers and
+    # prints throughput and speedup over one worker; scaling is bounded by the machine's cores.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+        total = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+        baseline = None
+        workers = 1
+        while workers <= max_workers:
+            rate = bench(workers, total)
+            baseline = baseline or rate
+            print(f"{workers:>3} workers: {rate:8.1f} updates/s  speedup {rate / baseline:.2f}x (ideal {workers}x)")
+            workers *= 2
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else None)
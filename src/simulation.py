@@ -0,0 +1,107 @@
+import time
+import logging
+import threading
+from web3 import Web3
+from web3.exceptions import ContractLogicError
+from config import RPC_URL, SIMULATION_BLOCK, SIMULATION_CACHE_TTL
+import multicall
+import tracing
+import metrics
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+MAX_UINT256 = 2 ** 256 - 1
+# Storage slots probed for an ERC-20's allowance mapping (OpenZeppelin uses 1, most others are below 10)
+ALLOWANCE_SLOT_CANDIDATES = range(0, 12)
+
+# (token lowercase, side, sender lowercase, amount, amountOutMinimum) -> {'ok', 'error', 'at'} of the last simulation
+# of that exact trade, trusted for SIMULATION_CACHE_TTL. A revert can be the sender's (balance, allowance) or the
+# slippage bound's as easily as the token's, so an outcome is never reused for another sender or bound.
+_outcomes = {}
+# token (lowercase) -> allowance mapping slot, or None when no candidate slot matched
+_allowance_slots = {}
+_lock = threading.Lock()
+
+
+def _allowance_key(owner, spender, slot):
+    """Storage key of allowance[owner][spender] for a Solidity mapping(address => mapping(address => uint256)) at slot."""
+    inner = Web3.keccak(w3.codec.encode(['address', 'uint256'], [owner, slot]))
+    return Web3.to_hex(Web3.keccak(w3.codec.encode(['address', 'bytes32'], [spender, inner])))
+
+
+def _read_allowance(token, owner, spender, state_override=None):
+    data = multicall.encode_call("allowance(address,address)", ['address', 'address'], [owner, spender])
+    result = w3.eth.call({'to': token, 'data': Web3.to_hex(data)}, SIMULATION_BLOCK, state_override)
+    return w3.codec.decode(['uint256'], bytes(result))[0]
+
+
+def allowance_override(token, owner, spender):
+    """
+    State override that gives spender an unlimited allowance over owner's tokens, so a sell can be
+    simulated before its approve is mined. None if the token's allowance slot can't be found.
+    """
+    token = Web3.to_checksum_address(token)
+    key = token.lower()
+    if key not in _allowance_slots:
+        found = None
+        for slot in ALLOWANCE_SLOT_CANDIDATES:
+            override = {token: {'stateDiff': {_allowance_key(owner, spender, slot): Web3.to_hex(MAX_UINT256)}}}
+            try:
+                if _read_allowance(token, owner, spender, override) == MAX_UINT256:
+                    found = slot
+                    break
+            except Exception:
+                continue
+        _allowance_slots[key] = found
+    slot = _allowance_slots[key]
+    if slot is None:
+        return None
+    return {token: {'stateDiff': {_allowance_key(owner, spender, slot): Web3.to_hex(MAX_UINT256)}}}
+
+
+def _outcome_key(token, side, sender, amount, min_out):
+    return token.lower(), side, sender.lower(), amount, min_out
+
+
+def cached_outcome(token, side, sender, amount, min_out):
+    """
+    A recent outcome of the same trade (token, side, sender, amount and amountOutMinimum) that
+    settles it without a new eth_call. Returns (True, None), (False, error) or None.
+    """
+    outcome = _outcomes.get(_outcome_key(token, side, sender, amount, min_out))
+    if not outcome or time.time() - outcome['at'] > SIMULATION_CACHE_TTL:
+        return None
+    return outcome['ok'], outcome['error']
+
+
+@tracing.traced()
+def simulate(tx, token, side, amount, min_out, state_override=None):
+    """
+    Runs a built (unsigned) transaction as eth_call against SIMULATION_BLOCK. Returns None when it
+    would succeed, or an error message with the revert reason. Outcomes are cached per trade: token,
+    side, sender (tx['from']), amount and min_out (the swap's amountOutMinimum).
+    """
+    cached = cached_outcome(token, side, tx['from'], amount, min_out)
+    metrics.cache_lookup('simulation', bool(cached))
+    if cached:
+        return cached[1]
+    call = {key: tx[key] for key in ('from', 'to', 'data', 'value') if key in tx}
+    try:
+        w3.eth.call(call, SIMULATION_BLOCK, state_override)
+        error = None
+    except ContractLogicError as e:
+        error = f"Trade simulation failed: {e}"
+        logging.info("[Simulation] %s %s reverted: %s", side, token, e)
+    except Exception as e:
+        if 'revert' not in str(e).lower():
+            # The node couldn't run the call at all; don't block (or cache) the trade over it
+            logging.warning("[Simulation] Could not simulate %s %s: %s", side, token, e)
+            return None
+        error = f"Trade simulation failed: {e}"
+        logging.info("[Simulation] %s %s reverted: %s", side, token, e)
+    now = time.time()
+    with _lock:
+        for key in [key for key, outcome in _outcomes.items() if now - outcome['at'] > SIMULATION_CACHE_TTL]:
+            del _outcomes[key]
+        _outcomes[_outcome_key(token, side, tx['from'], amount, min_out)] = {'ok': error is None, 'error': error, 'at': now}
+    return error
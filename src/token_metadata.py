@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+from web3 import Web3
+from config import RPC_URL, TOKEN_METADATA_FILE, TOKEN_METADATA_RETRY
+import multicall
+import metrics
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+# token (lowercase) -> {'symbol': str, 'decimals': int}. symbol/decimals are immutable for
+# all practical purposes, so entries never expire.
+_metadata = {}
+# token (lowercase) -> (entry, monotonic expiry) for reads that failed and fell back to ?/18. Kept
+# in memory for TOKEN_METADATA_RETRY only: a transient RPC error must not fix wrong decimals for good.
+_fallbacks = {}
+_lock = threading.Lock()
+_loaded = False
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not os.path.exists(TOKEN_METADATA_FILE):
+        return
+    try:
+        with open(TOKEN_METADATA_FILE) as f:
+            _metadata.update(json.load(f))
+    except Exception as e:
+        logging.warning("[TokenMetadata] Ignoring unreadable %s: %s", TOKEN_METADATA_FILE, e)
+
+
+def _save():
+    try:
+        # Per-process tmp name: every shard worker writes this shared file
+        tmp_file = f"{TOKEN_METADATA_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(_metadata, f)
+        os.replace(tmp_file, TOKEN_METADATA_FILE)
+    except Exception as e:
+        # Read-only filesystems (e.g. Lambda outside /tmp) just keep the in-memory cache
+        logging.warning("[TokenMetadata] Could not persist cache: %s", e)
+
+
+def _decode_symbol(data):
+    """The symbol in a symbol() return, or None if it can't be read."""
+    if not data:
+        return None
+    try:
+        return w3.codec.decode(['string'], data)[0]
+    except Exception:
+        pass
+    try:
+        # Some older tokens return bytes32 instead of string
+        return w3.codec.decode(['bytes32'], data)[0].rstrip(b'\0').decode()
+    except Exception:
+        return None
+
+
+def _fetch(tokens):
+    calls = []
+    for token in tokens:
+        calls.append((token, multicall.encode_call("symbol()")))
+        calls.append((token, multicall.encode_call("decimals()")))
+    results = multicall.aggregate(calls)
+    fetched = {}
+    for i, token in enumerate(tokens):
+        symbol_data, decimals_data = results[2 * i], results[2 * i + 1]
+        try:
+            decimals = w3.codec.decode(['uint8'], decimals_data)[0]
+        except Exception:
+            decimals = None
+        symbol = _decode_symbol(symbol_data)
+        if symbol is None or decimals is None:
+            fetched[token.lower()] = {'symbol': symbol or '?', 'decimals': 18 if decimals is None else decimals, 'fallback': True}
+        else:
+            fetched[token.lower()] = {'symbol': symbol, 'decimals': decimals}
+    return fetched
+
+
+def _cached(key):
+    entry = _metadata.get(key)
+    if entry is not None:
+        return entry
+    fallback = _fallbacks.get(key)
+    if fallback is not None and fallback[1] > time.monotonic():
+        return fallback[0]
+    return None
+
+
+def get_many(tokens):
+    """Metadata for several tokens; all cache misses are filled with a single batched multicall."""
+    with _lock:
+        _load()
+        missing = sorted({Web3.to_checksum_address(t) for t in tokens if _cached(t.lower()) is None})
+    metrics.cache_lookup('token_metadata', True, len(tokens) - len(missing))
+    metrics.cache_lookup('token_metadata', False, len(missing))
+    fetched = {}
+    if missing:
+        fetched = _fetch(missing)
+        with _lock:
+            complete = {key: entry for key, entry in fetched.items() if not entry.get('fallback')}
+            expires = time.monotonic() + TOKEN_METADATA_RETRY
+            for key, entry in fetched.items():
+                if entry.get('fallback'):
+                    logging.warning("[TokenMetadata] Could not read symbol/decimals of %s; retrying in %gs", key, TOKEN_METADATA_RETRY)
+                    _fallbacks[key] = (entry, expires)
+                else:
+                    _fallbacks.pop(key, None)
+            if complete:
+                _metadata.update(complete)
+                _save()
+    return {t.lower(): _cached(t.lower()) or fetched.get(t.lower()) or {'symbol': '?', 'decimals': 18, 'fallback': True} for t in tokens}
+
+
+def get(token):
+    """
+    {'symbol', 'decimals'} for a token, fetched on first use and cached persistently. If the
+    token's calls failed, '?'/18 with 'fallback': True, cached briefly (TOKEN_METADATA_RETRY).
+    """
+    entry = _metadata.get(token.lower())
+    if entry is not None:
+        metrics.cache_lookup('token_metadata', True)
+        return entry
+    return get_many([token])[token.lower()]
+
+
+def prewarm(entries):
+    """Seeds the cache from already-known metadata, e.g. [{'address', 'symbol', 'decimals'}] from the pool index."""
+    with _lock:
+        _load()
+        changed = False
+        for entry in entries:
+            key = entry['address'].lower()
+            if key not in _metadata and not entry.get('fallback'):
+                _metadata[key] = {'symbol': entry['symbol'], 'decimals': entry['decimals']}
+                changed = True
+        if changed:
+            _save()
@@ -0,0 +1,234 @@
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from web3 import Web3
+from config import (RPC_URL, CHAIN_ID, ROUTERS, TOKEN_PROFILE_FILE, TOKEN_PROFILE_TABLE,
+                    TOKEN_PROFILE_TTL, TOKEN_PROFILE_PROBE_WEI,
+                    TOKEN_TAX_WARN_BPS, TOKEN_TAX_BLOCK_BPS, SIMULATION_CACHE_TTL)
+import routing
+import multicall
+import swap_handler
+import tracing
+import metrics
+import record_store
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+WETH = ROUTERS[0]['weth']
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+MAX_UINT256 = 2 ** 256 - 1
+# Fresh address with no code that the simulated round trip trades from; funded by a state override
+PROBE_ADDRESS = Web3.to_checksum_address("0x00000000000000000000000000000000c0ffee01")
+PROBE_GAS = 1000000
+
+# token (lowercase) -> {'buy_tax', 'sell_tax', 'sellable', 'measured_at'}; taxes are fractions,
+# sellable is None when the round trip couldn't get as far as the sell. In DynamoDB when TOKEN_PROFILE_TABLE
+# is set, so every instance and Lambda container reuses a measurement; _profiles caches what was read
+_store = record_store.open_store(TOKEN_PROFILE_TABLE, TOKEN_PROFILE_FILE, 'token', 'TokenProfile')
+_profiles = {}
+# token (lowercase) -> (time, error) of the last failed measurement, retried after SIMULATION_CACHE_TTL
+_failures = {}
+# token (lowercase) -> Future of the measurement in progress, shared by every caller that needs it meanwhile
+_measuring = {}
+_lock = threading.Lock()
+
+
+def _swap_call(route, amount_in, side):
+    """Calldata of an unguarded (amountOutMinimum 0) swap along route, as the probe address."""
+    router_type = route['protocol']
+    router_contract = w3.eth.contract(address=Web3.to_checksum_address(route['router']['router']),
+                                      abi=swap_handler.load_abi(swap_handler.ROUTER_ABI_FILES[router_type]))
+    if router_type == 'v3':
+        call = swap_handler.v3_swap_call(router_contract, route, PROBE_ADDRESS, amount_in, 0)
+    elif side == 'buy':
+        call = router_contract.functions.swapExactETHForTokens(0, route['path'], PROBE_ADDRESS, MAX_UINT256)
+    else:
+        call = router_contract.functions.swapExactTokensForETH(amount_in, 0, route['path'], PROBE_ADDRESS, MAX_UINT256)
+    # Every field is given, so building the transaction makes no RPC requests
+    tx = call.build_transaction({
+        'from': PROBE_ADDRESS,
+        'value': amount_in if side == 'buy' else 0,
+        'gas': PROBE_GAS,
+        'gasPrice': 0,
+        'nonce': 0,
+        'chainId': CHAIN_ID
+    })
+    return {'from': PROBE_ADDRESS, 'to': tx['to'], 'data': tx['data'], 'value': Web3.to_hex(tx['value'])}
+
+
+def _erc20_call(token, signature, types=(), args=()):
+    return {'from': PROBE_ADDRESS, 'to': token, 'data': Web3.to_hex(multicall.encode_call(signature, list(types), list(args)))}
+
+
+def _transfers(call_result, token):
+    """(from, to, amount) of every Transfer the token emitted during a simulated call, addresses lowercase."""
+    transfers = []
+    for log in call_result.get('logs', []):
+        topics = log['topics']
+        if log['address'].lower() != token.lower() or len(topics) != 3 or topics[0].lower() != TRANSFER_TOPIC:
+            continue
+        transfers.append(('0x' + topics[1][-40:].lower(), '0x' + topics[2][-40:].lower(), int(log['data'], 16)))
+    return transfers
+
+
+def _sell_route(buy_route, token):
+    """The sell route through the same pools as buy_route, so the sell trades against the post-buy state."""
+    routes = routing.get_routes(token, WETH)
+    pools = [hop['pool'].lower() for hop in reversed(buy_route['hops'])]
+    return next((r for r in routes if [hop['pool'].lower() for hop in r['hops']] == pools), routes[0])
+
+
+def _simulate_round_trip(token, buy_route, sell_route, sell_amount):
+    """
+    Buys, checks the balance, approves and sells in one eth_simulateV1 request, where each call
+    sees the state left by the previous one. Returns the per-call results.
+    """
+    calls = [
+        _swap_call(buy_route, TOKEN_PROFILE_PROBE_WEI, 'buy'),
+        _erc20_call(token, "balanceOf(address)", ['address'], [PROBE_ADDRESS]),
+        _erc20_call(token, "approve(address,uint256)", ['address', 'uint256'],
+                    [Web3.to_checksum_address(sell_route['router']['router']), MAX_UINT256]),
+        _swap_call(sell_route, sell_amount, 'sell'),
+    ]
+    payload = {
+        'blockStateCalls': [{
+            'stateOverrides': {PROBE_ADDRESS: {'balance': Web3.to_hex(TOKEN_PROFILE_PROBE_WEI * 2)}},
+            'calls': calls,
+        }],
+        'validation': False,
+    }
+    response = w3.provider.make_request('eth_simulateV1', [payload, 'latest'])
+    if response.get('error'):
+        raise RuntimeError(response['error'].get('message', response['error']))
+    return response['result'][0]['calls']
+
+
+def measure(token):
+    """
+    Measures a token's buy tax, sell tax and sellability with a simulated ETH -> token -> ETH round
+    trip of TOKEN_PROFILE_PROBE_WEI. Taxes are read off the token's own Transfer logs: the share of
+    what left the pool that reached the buyer, and the share of what the seller sent that reached the pool.
+    """
+    token = Web3.to_checksum_address(token)
+    buy_route = routing.best_route(WETH, token, TOKEN_PROFILE_PROBE_WEI)
+    if 'error' in buy_route:
+        raise RuntimeError(buy_route['error'])
+    sell_route = _sell_route(buy_route, token)
+    # Half the untaxed output: still covered by the balance when the buy tax is below 50%
+    sell_amount = buy_route['amount_out'] // 2
+    buy, balance, approve, sell = _simulate_round_trip(token, buy_route, sell_route, sell_amount)
+    if int(buy['status'], 16) != 1:
+        raise RuntimeError(f"Simulated buy reverted: {buy.get('error', {}).get('message', 'no reason')}")
+
+    buy_pool = buy_route['hops'][-1]['pool'].lower()
+    left_pool = sum(amount for src, _, amount in _transfers(buy, token) if src == buy_pool)
+    received = int(balance['returnData'], 16) if int(balance['status'], 16) == 1 else 0
+    buy_tax = max(0.0, 1 - received / left_pool) if left_pool else 0.0
+
+    sellable, sell_tax = None, None
+    if received >= sell_amount:
+        sellable = int(approve['status'], 16) == 1 and int(sell['status'], 16) == 1
+        if sellable:
+            sell_pool = sell_route['hops'][0]['pool'].lower()
+            transfers = [(dst, amount) for src, dst, amount in _transfers(sell, token) if src == PROBE_ADDRESS.lower()]
+            sent = sum(amount for _, amount in transfers)
+            reached_pool = sum(amount for dst, amount in transfers if dst == sell_pool)
+            sell_tax = max(0.0, 1 - reached_pool / sent) if sent else 0.0
+    return {'buy_tax': buy_tax, 'sell_tax': sell_tax, 'sellable': sellable, 'measured_at': time.time()}
+
+
+def _fresh(profile):
+    return profile is not None and time.time() - profile['measured_at'] <= TOKEN_PROFILE_TTL
+
+
+def _measure(token, key):
+    """Measures and stores a token's profile. None (remembered as a failure) when it can't be measured."""
+    profile = _store.get(key)
+    if _fresh(profile):
+        # Another instance measured it
+        return profile
+    try:
+        profile = measure(token)
+    except Exception as e:
+        logging.warning("[TokenProfile] Could not profile %s: %s", token, e)
+        with _lock:
+            _failures[key] = (time.time(), str(e))
+        return None
+    logging.info("[TokenProfile] %s: %s", token, profile)
+    _store.add(key, profile)
+    with _lock:
+        _failures.pop(key, None)
+    return profile
+
+
+@tracing.traced()
+def get(token):
+    """
+    The token's tradability profile, measured on first use and trusted for TOKEN_PROFILE_TTL.
+    None when it can't be measured (e.g. the RPC lacks eth_simulateV1); failures are retried
+    after SIMULATION_CACHE_TTL. Blocking: concurrent callers for a token share one measurement.
+    """
+    key = token.lower()
+    with _lock:
+        profile = _profiles.get(key)
+        failure = _failures.get(key)
+        if not _fresh(profile) and not (failure and time.time() - failure[0] <= SIMULATION_CACHE_TTL):
+            future = _measuring.get(key)
+            owner = future is None
+            if owner:
+                future = _measuring[key] = Future()
+        else:
+            future = None
+    if future is None:
+        metrics.cache_lookup('token_profile', True)
+        return profile if _fresh(profile) else None
+    metrics.cache_lookup('token_profile', False)
+    if not owner:
+        return future.result()
+    try:
+        profile = _measure(token, key)
+        if profile is not None:
+            with _lock:
+                _profiles[key] = profile
+        future.set_result(profile)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _measuring.pop(key, None)
+    return profile
+
+
+def assess(token, side):
+    """
+    Checks a token's profile before a buy or sell. Returns (blocked, message): a honeypot, or a buy
+    tax above TOKEN_TAX_BLOCK_BPS, blocks a buy; taxes above TOKEN_TAX_WARN_BPS get a warning.
+    (False, None) when there is nothing to report or no profile is available. Blocking (it may
+    measure the token): handlers run it in a thread.
+    """
+    profile = get(token)
+    if profile is None:
+        return False, None
+    if profile['sellable'] is False:
+        if side == 'buy':
+            return True, "This token can't be sold back (honeypot): a simulated sell reverted."
+        return False, "A simulated sell of this token reverted; it may not be sellable."
+    taxes = [(label, profile[label]) for label in ('buy_tax', 'sell_tax') if profile[label] is not None]
+    if side == 'buy' and any(tax * 10000 > TOKEN_TAX_BLOCK_BPS for _, tax in taxes):
+        worst = max(tax for _, tax in taxes)
+        return True, f"This token takes a {worst * 100:.1f}% transfer tax, above the {TOKEN_TAX_BLOCK_BPS / 100:.0f}% limit."
+    high = [f"{tax * 100:.1f}% {label.split('_')[0]} tax" for label, tax in taxes if tax * 10000 > TOKEN_TAX_WARN_BPS]
+    if high:
+        return False, f"This token has a {', '.join(high)}. Expect to receive less than quoted."
+    return False, None
+
+
+if __name__ == "__main__":
+    # Usage: python token_profile.py <token> [<token> ...]
+    # Measures the given tokens afresh and prints their profiles.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    for address in sys.argv[1:]:
+        print(address, measure(address))
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import random
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from config import TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_FLUSH_INTERVAL
+import metrics
+import profiler
+
+SERVICE_NAME = 'inky-bot'
+# OTLP enum values
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+class Span:
+    """An open span; set() adds attributes until it ends."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'kind', 'attributes', 'start_ns')
+
+    def __init__(self, name, trace_id, parent_id, kind, attributes, start_ns):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = start_ns
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+# The innermost open span of the running task or thread
+_current = contextvars.ContextVar('tracing_span', default=None)
+# Finished spans in OTLP/JSON form, written out by the flush thread
+_finished = []
+_lock = threading.Lock()
+_flush_thread = None
+
+
+def enabled():
+    return bool(TRACE_FILE)
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _finish(span, end_ns, error):
+    record = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'parentSpanId': span.parent_id,
+        'name': span.name,
+        'kind': span.kind,
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(end_ns),
+        'attributes': [{'key': key, 'value': _value(value)} for key, value in span.attributes.items()],
+        'status': {'code': STATUS_ERROR, 'message': error} if error else {'code': STATUS_OK},
+    }
+    with _lock:
+        _finished.append(record)
+    _start_flushing()
+
+
+def context():
+    """(trace_id, span_id) of the current span, to continue its trace later (e.g. when a tx is mined), or None."""
+    span = _current.get()
+    return (span.trace_id, span.span_id) if span else None
+
+
+@contextmanager
+def span(name, attributes=None, root=False, kind=SPAN_KIND_INTERNAL, parent=None, start_time=None):
+    """
+    Times the block as a span, a child of the current one. Outside any span it is a no-op unless
+    root is set (handlers and background cycles) or parent continues an earlier context(); this
+    keeps every-second background RPCs out of the trace file. Roots are sampled at TRACE_SAMPLE_RATE.
+    start_time (epoch seconds) backdates the span, for waits that began before the block.
+    """
+    current = _current.get()
+    if not TRACE_FILE or (current is None and parent is None and not root):
+        yield None
+        return
+    if current is not None:
+        trace_id, parent_id = current.trace_id, current.span_id
+    elif parent is not None:
+        trace_id, parent_id = parent
+    elif random.random() < TRACE_SAMPLE_RATE:
+        trace_id, parent_id = os.urandom(16).hex(), ''
+    else:
+        yield None
+        return
+    start_ns = int(start_time * 1e9) if start_time is not None else time.time_ns()
+    opened = Span(name, trace_id, parent_id, kind, dict(attributes or {}), start_ns)
+    token = _current.set(opened)
+    error = None
+    try:
+        yield opened
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        _finish(opened, time.time_ns(), error)
+
+
+def traced(name=None, root=False, kind=SPAN_KIND_INTERNAL):
+    """Decorator: each call of the function (sync or async) is a span named module.function by default."""
+    def decorate(fn):
+        span_name = name or f"{fn.__module__}.{fn.__name__}"
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, root=root, kind=kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, root=root, kind=kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def handler(fn):
+    """
+    Decorator for bot handlers: each update handled is the root span of a new trace, and its
+    latency, errors and Bot API rate limits are recorded in metrics (and in an open profiling window).
+    """
+    from telegram.error import RetryAfter
+    span_name = f"handler {fn.__name__}"
+
+    @functools.wraps(fn)
+    async def wrapper(update, context, *args, **kwargs):
+        user = getattr(update, 'effective_user', None)
+        attributes = {'telegram.user_id': str(user.id) if user else ''}
+        if getattr(update, 'callback_query', None):
+            attributes['telegram.callback'] = update.callback_query.data
+        started = time.perf_counter()
+        try:
+            with span(span_name, attributes, root=True, kind=SPAN_KIND_SERVER):
+                return await fn(update, context, *args, **kwargs)
+        except Exception as e:
+            metrics.inc('handler_errors_total', handler=fn.__name__)
+            if isinstance(e, RetryAfter):
+                metrics.inc('telegram_rate_limited_total', source='handler')
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe('handler_seconds', elapsed, handler=fn.__name__)
+            profiler.record_handler(fn.__name__, elapsed)
+    return wrapper
+
+
+def flush():
+    """Appends every finished span to TRACE_FILE as one OTLP/JSON ExportTraceServiceRequest line."""
+    global _finished
+    with _lock:
+        spans, _finished = _finished, []
+    if not spans:
+        return
+    request = {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                                    {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]},
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}],
+    }]}
+    try:
+        with open(TRACE_FILE, 'a') as f:
+            f.write(json.dumps(request, separators=(',', ':')) + '\n')
+    except Exception as e:
+        logging.warning("[Tracing] Could not write %s: %s", TRACE_FILE, e)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(TRACE_FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flushing():
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _lock:
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_flush_loop, name="trace-flusher", daemon=True)
+            _flush_thread.start()
+
+
+def instrument_web3():
+    """Wraps every HTTPProvider request (single and batched) in a client span named after its RPC method."""
+    from web3 import HTTPProvider
+    if getattr(HTTPProvider, '_traced', False):
+        return
+    make_request, make_batch_request = HTTPProvider.make_request, HTTPProvider.make_batch_request
+
+    def traced_make_request(self, method, params):
+        # Hostnames only: endpoint URLs often carry API keys
+        with span(f"rpc {method}", {'rpc.method': method, 'server.address': urlsplit(self.endpoint_uri).hostname or ''},
+                  kind=SPAN_KIND_CLIENT):
+            return make_request(self, method, params)
+
+    def traced_make_batch_request(self, requests):
+        with span("rpc batch", {'rpc.method': ','.join(sorted({method for method, _ in requests})),
+                                'rpc.batch_size': len(requests),
+                                'server.address': urlsplit(self.endpoint_uri).hostname or ''}, kind=SPAN_KIND_CLIENT):
+            return make_batch_request(self, requests)
+
+    HTTPProvider.make_request = traced_make_request
+    HTTPProvider.make_batch_request = traced_make_batch_request
+    HTTPProvider._traced = True
+
+
+def summarize(path):
+    """Per span name: count and p50/p95/p99/max duration in ms, slowest p99 first."""
+    durations = {}
+    with open(path) as f:
+        for line in f:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    for s in scope['spans']:
+                        ms = (int(s['endTimeUnixNano']) - int(s['startTimeUnixNano'])) / 1e6
+                        durations.setdefault(s['name'], []).append(ms)
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        rows.append((name, len(values), pick(0.5), pick(0.95), pick(0.99), values[-1]))
+    return sorted(rows, key=lambda row: row[4], reverse=True)
+
+
+if TRACE_FILE:
+    instrument_web3()
+
+
+if __name__ == "__main__":
+    # Usage: python tracing.py [trace file]
+    # Prints latency percentiles per span name from an OTLP/JSON trace file (TRACE_FILE by default).
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE
+    print(f"{'span':<48} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, count, p50, p95, p99, worst in summarize(path):
+        print(f"{name:<48} {count:>7} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {worst:>9.1f}")
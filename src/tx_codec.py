@@ -0,0 +1,116 @@
+import sys
+import time
+import functools
+from eth_abi import encode
+from eth_account import Account
+from web3 import Web3
+from config import CHAIN_ID
+
+# The only functions the trade paths send, with their ABI argument types, encoded without going
+# through a Contract: no ABI lookup, argument matching or build_transaction validation per call.
+SIGNATURES = {
+    'exactInputSingle': ('exactInputSingle((address,address,uint24,address,uint256,uint256,uint160))',
+                         ['(address,address,uint24,address,uint256,uint256,uint160)']),
+    'exactInput': ('exactInput((bytes,address,uint256,uint256))', ['(bytes,address,uint256,uint256)']),
+    'multicall': ('multicall(uint256,bytes[])', ['uint256', 'bytes[]']),
+    'unwrapWETH9WithFee': ('unwrapWETH9WithFee(uint256,address,uint256,address)', ['uint256', 'address', 'uint256', 'address']),
+    'swapExactETHForTokens': ('swapExactETHForTokens(uint256,address[],address,uint256)', ['uint256', 'address[]', 'address', 'uint256']),
+    'swapExactTokensForETH': ('swapExactTokensForETH(uint256,uint256,address[],address,uint256)',
+                              ['uint256', 'uint256', 'address[]', 'address', 'uint256']),
+    'approve': ('approve(address,uint256)', ['address', 'uint256']),
+    'transfer': ('transfer(address,uint256)', ['address', 'uint256']),
+    'withdraw': ('withdraw(uint256)', ['uint256']),
+}
+SELECTORS = {name: Web3.keccak(text=signature)[:4] for name, (signature, _) in SIGNATURES.items()}
+# Field order of the SwapRouter02 param structs, so the dicts from swap_handler.v3_swap_params encode as tuples
+STRUCT_FIELDS = {
+    'exactInputSingle': ('tokenIn', 'tokenOut', 'fee', 'recipient', 'amountIn', 'amountOutMinimum', 'sqrtPriceLimitX96'),
+    'exactInput': ('path', 'recipient', 'amountIn', 'amountOutMinimum'),
+}
+
+# Routers, tokens and user wallets repeat constantly; checksumming each one once is enough
+checksum = functools.lru_cache(maxsize=4096)(Web3.to_checksum_address)
+
+
+def encode_call(name, *args):
+    """Calldata for one of SIGNATURES. Struct params (exactInputSingle, exactInput) may be passed as dicts."""
+    if name in STRUCT_FIELDS and isinstance(args[0], dict):
+        args = (tuple(args[0][field] for field in STRUCT_FIELDS[name]),)
+    return SELECTORS[name] + encode(SIGNATURES[name][1], args)
+
+
+def transaction(sender, to, data, nonce, gas, gas_price, value=0):
+    """
+    A legacy transaction in the shape build_transaction returns, so simulation.simulate can run it
+    as an eth_call before it is signed.
+    """
+    return {
+        'from': checksum(sender),
+        'to': checksum(to),
+        'data': '0x' + data.hex(),
+        'value': value,
+        'gas': gas,
+        'gasPrice': gas_price,
+        'nonce': nonce,
+        'chainId': CHAIN_ID
+    }
+
+
+def sign(tx, private_key):
+    """The raw signed bytes of a transaction from transaction(), ready for broadcast.send_raw_transaction."""
+    return Account.sign_transaction({key: value for key, value in tx.items() if key != 'from'}, private_key).raw_transaction
+
+
+def _bench(label, build, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        raw = build()
+    per_trade = (time.perf_counter() - started) / iterations * 1e6
+    print(f"{label:>8}: {per_trade:8.1f} us per trade")
+    return raw, per_trade
+
+
+if __name__ == "__main__":
+    # Usage: python tx_codec.py [iterations]
+    # Builds and signs the same V3 buy and V3 sell (approve + multicall swap/unwrap) through the
+    # web3 Contract path and through this module, checks the raw transactions are byte-identical
+    # and prints the CPU time per trade for each. Runs offline; nothing is sent.
+    import swap_handler
+    from config import ROUTERS
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    account = Account.create()
+    user, key = account.address, account.key
+    router = checksum(ROUTERS[0]['router'])
+    weth = checksum(ROUTERS[0]['weth'])
+    token = checksum('0x' + '11' * 20)
+    fee_wallet = checksum(swap_handler.FEE_WALLET)
+    offline = Web3()
+    router_contract = offline.eth.contract(address=router, abi=swap_handler.load_abi('SwapRouter02_ABI.json'))
+    token_contract = offline.eth.contract(address=token, abi=swap_handler.ERC20_ABI)
+    route = {'hops': [{'token_in': weth, 'token_out': token, 'fee': 10000}]}
+    sell_route = {'hops': [{'token_in': token, 'token_out': weth, 'fee': 10000}]}
+    fields = {'gas': 600000, 'gasPrice': 2 * 10 ** 9, 'nonce': 7, 'chainId': CHAIN_ID}
+
+    def web3_path():
+        buy = swap_handler.v3_swap_call(router_contract, route, user, 10 ** 16, 1).build_transaction(
+            {'from': user, 'value': 10 ** 16, **fields})
+        approve = token_contract.functions.approve(router, 10 ** 21).build_transaction({'from': user, **fields, 'gas': 80000})
+        fn_name, params = swap_handler.v3_swap_params(sell_route, swap_handler.ADDRESS_THIS, 10 ** 21, 1)
+        calls = [router_contract.encode_abi(fn_name, args=[params]),
+                 router_contract.encode_abi('unwrapWETH9WithFee(uint256,address,uint256,address)',
+                                            args=[1, user, swap_handler.FEE_BIPS, fee_wallet])]
+        sell = router_contract.get_function_by_signature('multicall(uint256,bytes[])')(2 ** 32, calls).build_transaction(
+            {'from': user, **fields, 'nonce': 8})
+        return [offline.eth.account.sign_transaction(tx, key).raw_transaction for tx in (buy, approve, sell)]
+
+    def codec_path():
+        buy = transaction(user, router, encode_call(*swap_handler.v3_swap_params(route, user, 10 ** 16, 1)),
+                          7, 600000, 2 * 10 ** 9, 10 ** 16)
+        approve = transaction(user, token, encode_call('approve', router, 10 ** 21), 7, 80000, 2 * 10 ** 9)
+        sell = transaction(user, router, swap_handler.v3_sell_with_fee_data(sell_route, user, 10 ** 21, 1, 2 ** 32),
+                           8, 600000, 2 * 10 ** 9)
+        return [sign(tx, key) for tx in (buy, approve, sell)]
+
+    web3_raw, web3_us = _bench('web3', web3_path, iterations)
+    codec_raw, codec_us = _bench('tx_codec', codec_path, iterations)
+    print(f"identical: {web3_raw == codec_raw}, saved {web3_us - codec_us:.1f} us per trade ({web3_us / codec_us:.1f}x)")
@@ -0,0 +1,324 @@
+import sys
+import time
+import logging
+import threading
+import requests
+from web3 import Web3
+from config import (RPC_URL, CHAIN_ID, BOT_TOKEN, EXPLORER_URL, PENDING_TX_FILE, PENDING_TX_TABLE,
+                    TX_TRACKER_POLL_INTERVAL, STUCK_TX_BLOCKS, TX_REPLACE_BUMP_PCT, TX_REPLACE_MAX_GAS_MULTIPLIER)
+import token_metadata
+import broadcast
+import tracing
+import metrics
+import record_store
+import admission
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+WITHDRAWAL_TOPIC = Web3.to_hex(Web3.keccak(text="Withdrawal(address,uint256)"))
+
+# Labels for the chat notification; kinds without a label are tracked silently
+KIND_LABELS = {'buy': 'Buy', 'sell': 'Sell', 'withdraw': 'Withdrawal', 'unwrap': 'Unwrap'}
+
+# original tx hash (lowercase, 0x-prefixed) -> {'tx_hash', 'kind', 'chat_id', 'telegram_id', 'address', 'sent_at',
+# 'data', 'hashes' (original plus replacements, any of which may be mined), 'sent_block', 'tx' (last signed params)}.
+# In DynamoDB when PENDING_TX_TABLE is set, so every poller and Lambda container sees every pending transaction
+_store = record_store.open_store(PENDING_TX_TABLE, PENDING_TX_FILE, 'tx_hash', 'TxTracker')
+# kind -> [hook(record, receipt)], run once the transaction is mined; may return extra notification lines
+_hooks = {}
+# signer(telegram_id) -> private key, needed to re-sign replacements
+_signer = None
+_last_block = None
+_tracker_thread = None
+
+
+def _hex_hash(tx_hash):
+    return tx_hash if tx_hash.startswith('0x') else '0x' + tx_hash
+
+
+def _records():
+    records = _store.all()
+    for tx_hash, record in records.items():
+        # Records written before replacement tracking existed
+        record.setdefault('hashes', [tx_hash])
+        record.setdefault('sent_block', 0)
+        record.setdefault('tx', None)
+    return records
+
+
+def add_hook(kind, hook):
+    """Registers hook(record, receipt) to run when a transaction of this kind is mined (success or revert)."""
+    _hooks.setdefault(kind, []).append(hook)
+
+
+def set_signer(signer):
+    """Registers signer(telegram_id) -> private key, used to re-sign stuck transactions at a higher gas price."""
+    global _signer
+    _signer = signer
+
+
+def track(tx_hash, kind, chat_id, telegram_id, address, data=None):
+    """
+    Records a broadcast transaction; its final status is pushed to chat_id once mined. Kinds without
+    a label in KIND_LABELS (e.g. 'fee', 'approve') are only tracked so they can be repriced if stuck.
+    """
+    tx_hash = _hex_hash(tx_hash).lower()
+    sent_block = _last_block if _last_block is not None else w3.eth.block_number
+    _store.add(tx_hash, {
+        'tx_hash': tx_hash,
+        'kind': kind,
+        'chat_id': chat_id,
+        'telegram_id': telegram_id,
+        'address': address,
+        'sent_at': time.time(),
+        'data': data or {},
+        'hashes': [tx_hash],
+        'sent_block': sent_block,
+        'tx': None,
+        # The handler's trace, continued by the receipt wait and settlement spans
+        'trace': tracing.context(),
+    })
+
+
+def pending_for(telegram_id):
+    """Transactions still awaiting confirmation for a user."""
+    return [record for record in _records().values() if record['telegram_id'] == telegram_id]
+
+
+def send_message(chat_id, text):
+    """Pushes a message through the Bot API directly, so it works from the worker thread and from Lambda."""
+    try:
+        response = requests.post(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", json={
+            'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True,
+        }, timeout=10)
+        if response.status_code == 429:
+            metrics.inc('telegram_rate_limited_total', source='tx_tracker')
+            logging.warning("[TxTracker] Rate limited notifying chat %s", chat_id)
+    except Exception as e:
+        logging.error("[TxTracker] Could not notify chat %s: %s", chat_id, e)
+
+
+def _fetch_receipts(tx_hashes):
+    """All receipts in one JSON-RPC batch. Returns {tx_hash: raw receipt} for the mined ones."""
+    responses = w3.provider.make_batch_request([("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes])
+    receipts = {}
+    for tx_hash, response in zip(tx_hashes, responses):
+        if response.get('result'):
+            receipts[tx_hash] = response['result']
+    return receipts
+
+
+def tokens_received(receipt, address):
+    """{token: amount} of ERC-20 transfers to address in a raw receipt."""
+    received = {}
+    topic_to = '0x' + address.lower()[2:].rjust(64, '0')
+    for log in receipt['logs']:
+        topics = [topic.lower() for topic in log['topics']]
+        if len(topics) == 3 and topics[0] == TRANSFER_TOPIC and topics[2] == topic_to:
+            token = Web3.to_checksum_address(log['address'])
+            received[token] = received.get(token, 0) + int(log['data'], 16)
+    return received
+
+
+def eth_unwrapped(receipt):
+    """WETH withdrawn to ETH in a raw receipt (the Withdrawal event amount)."""
+    return sum(int(log['data'], 16) for log in receipt['logs']
+               if log['topics'] and log['topics'][0].lower() == WITHDRAWAL_TOPIC)
+
+
+def _summary(record, receipt, extra_lines):
+    label = KIND_LABELS[record['kind']]
+    success = int(receipt['status'], 16) == 1
+    gas_used = int(receipt['gasUsed'], 16)
+    gas_cost = gas_used * int(receipt.get('effectiveGasPrice', '0x0'), 16)
+    text = (f"{'✅' if success else '❌'} <b>{label} {'confirmed' if success else 'reverted'}</b> "
+            f"in block <code>{int(receipt['blockNumber'], 16)}</code>\n"
+            f"• <b>Gas used:</b> <code>{gas_used:,}</code> (<code>{gas_cost / 1e18:.6f} ETH</code>)\n")
+    if success:
+        for token, amount in tokens_received(receipt, record['address']).items():
+            meta = token_metadata.get(token)
+            text += f"• <b>Received:</b> <code>{amount / (10 ** meta['decimals']):,.6f} {meta['symbol']}</code>\n"
+    for line in extra_lines:
+        text += line
+    if record['mined_hash'] != record['tx_hash']:
+        text += f"• <b>Sped up:</b> repriced {len(record['hashes']) - 1}x after being stuck\n"
+    text += f"<a href='{EXPLORER_URL}/tx/{record['mined_hash']}'>View on Explorer</a>"
+    return text
+
+
+def _finalize(record, receipt):
+    trace = record.get('trace')
+    with tracing.span(f"receipt wait {record['kind']}", {'tx.hash': record.get('mined_hash') or record['tx_hash'],
+                                                         'tx.status': int(receipt['status'], 16),
+                                                         'tx.replacements': len(record['hashes']) - 1},
+                      parent=trace, start_time=record['sent_at']):
+        pass
+    with tracing.span(f"settle {record['kind']}", parent=trace):
+        extra_lines = []
+        for hook in _hooks.get(record['kind'], []):
+            try:
+                line = hook(record, receipt)
+                if line:
+                    extra_lines.append(line)
+            except Exception as e:
+                logging.error("[TxTracker] %s hook failed for %s: %s", record['kind'], record['tx_hash'], e)
+                extra_lines.append(f"⚠️ <b>Follow-up failed:</b> {e}\n")
+        if record['kind'] in KIND_LABELS and record['chat_id'] is not None:
+            send_message(record['chat_id'], _summary(record, receipt, extra_lines))
+
+
+def _fetch_tx(tx_hash):
+    """Signable legacy params of a transaction the node still knows about, or None."""
+    try:
+        tx = w3.eth.get_transaction(tx_hash)
+    except Exception:
+        return None
+    return {
+        'to': tx['to'],
+        'value': tx['value'],
+        'data': Web3.to_hex(tx['input']),
+        'gas': tx['gas'],
+        'gasPrice': tx['gasPrice'],
+        'nonce': tx['nonce'],
+        'chainId': CHAIN_ID,
+    }
+
+
+def _replace(record, block):
+    """
+    Rebroadcasts a stuck transaction with the same nonce and a bumped gas price: at least
+    TX_REPLACE_BUMP_PCT over the last attempt and 2x the network price, capped at
+    TX_REPLACE_MAX_GAS_MULTIPLIER times the network price. Returns the fields of the record
+    to update.
+    """
+    tx = record['tx'] or _fetch_tx(record['hashes'][-1])
+    if tx is None:
+        logging.warning("[TxTracker] %s is unknown to the node, cannot reprice it", record['tx_hash'])
+        return {}
+    network_price = w3.eth.gas_price
+    gas_price = max(tx['gasPrice'] * (100 + TX_REPLACE_BUMP_PCT) // 100, network_price * 2)
+    if gas_price > network_price * TX_REPLACE_MAX_GAS_MULTIPLIER:
+        if record.get('capped'):
+            return {}
+        logging.warning("[TxTracker] %s hit the replacement gas cap at nonce %s", record['tx_hash'], tx['nonce'])
+        if record['kind'] in KIND_LABELS and record['chat_id'] is not None:
+            send_message(record['chat_id'], f"⚠️ <b>{KIND_LABELS[record['kind']]} is still pending</b> at the maximum gas price. It will confirm once the network clears.")
+        return {'capped': True}
+    replacement = {**tx, 'gasPrice': gas_price}
+    signed = w3.eth.account.sign_transaction(replacement, _signer(record['telegram_id']))
+    try:
+        new_hash = _hex_hash(broadcast.send_raw_transaction(signed.raw_transaction).hex()).lower()
+    except Exception as e:
+        if 'nonce too low' in str(e):
+            # One of our attempts was just mined (its receipt shows up next block) or something else took
+            # the nonce; if it is still unconfirmed on the next pass, it was superseded
+            return {'nonce_used': True}
+        raise
+    logging.info("[TxTracker] Replaced %s with %s at nonce %d, gas price %d -> %d", record['hashes'][-1], new_hash, tx['nonce'], tx['gasPrice'], gas_price)
+    return {'hashes': record['hashes'] + [new_hash], 'tx': replacement, 'sent_block': block}
+
+
+def check_pending(block=None):
+    """
+    Confirms every pending transaction (and its replacements) with one batched receipt lookup, then
+    reprices the ones stuck for STUCK_TX_BLOCKS or more. Returns how many were finalized.
+
+    Several instances may check the same store: a record is finalized or dropped only by the
+    instance whose delete removed it, and repriced only by the one whose conditional update moved
+    its sent_block forward, so each notification, hook and replacement happens once.
+    """
+    block = w3.eth.block_number if block is None else block
+    records = _records()
+    tx_hashes = [tx_hash for record in records.values() for tx_hash in record['hashes']]
+    if not tx_hashes:
+        metrics.gauge_set('pending_transactions', 0)
+        return 0
+    receipts = _fetch_receipts(tx_hashes)
+    finalized = []
+    dropped = []
+    stuck = []
+    for key, record in records.items():
+        mined_hash = next((tx_hash for tx_hash in record['hashes'] if tx_hash in receipts), None)
+        if mined_hash:
+            if _store.delete(key):
+                record['mined_hash'] = mined_hash
+                finalized.append((record, receipts[mined_hash]))
+        elif record.get('nonce_used'):
+            if _store.delete(key):
+                dropped.append(record)
+        elif _signer is not None and block - record['sent_block'] >= STUCK_TX_BLOCKS:
+            # Claims the replacement; if it fails, the next attempt comes STUCK_TX_BLOCKS later
+            record['sent_block'] = block
+            if _store.update(key, record):
+                stuck.append((key, record))
+    for key, record in stuck:
+        try:
+            changes = _replace(record, block)
+        except Exception as e:
+            logging.error("[TxTracker] Could not replace %s: %s", key, e)
+            continue
+        if changes:
+            record.update(changes)
+            if not _store.update(key, record):
+                logging.warning("[TxTracker] %s was settled while it was being repriced", key)
+    metrics.gauge_set('pending_transactions', len(records) - len(finalized) - len(dropped))
+    for record in dropped:
+        logging.warning("[TxTracker] %s was superseded by another transaction with the same nonce", record['tx_hash'])
+        if record['kind'] in KIND_LABELS and record['chat_id'] is not None:
+            send_message(record['chat_id'], f"⚠️ <b>{KIND_LABELS[record['kind']]} was dropped:</b> another transaction used its nonce.")
+    for record, receipt in finalized:
+        broadcast.record_inclusion(record['mined_hash'])
+        logging.info("[TxTracker] %s %s mined with status %s", record['kind'], record['mined_hash'], receipt['status'])
+        _finalize(record, receipt)
+    return len(finalized)
+
+
+def _track_loop():
+    global _last_block
+    with admission.background():
+        while True:
+            try:
+                block = w3.eth.block_number
+                # Receipts only change when a block lands, so one batched check per block is enough
+                if block != _last_block:
+                    _last_block = block
+                    check_pending(block)
+            except Exception as e:
+                logging.error("[TxTracker] Check failed at block %s: %s", _last_block, e)
+            time.sleep(TX_TRACKER_POLL_INTERVAL)
+
+
+def is_running():
+    return _tracker_thread is not None and _tracker_thread.is_alive()
+
+
+def start_tracking():
+    """Starts the background worker that confirms pending transactions every block (polling mode)."""
+    global _tracker_thread
+    if is_running():
+        return
+    _tracker_thread = threading.Thread(target=_track_loop, name="tx-tracker", daemon=True)
+    _tracker_thread.start()
+
+
+if __name__ == "__main__":
+    # Usage: python tx_tracker.py <funded devnet private key>
+    # Stuck-transaction replacement check against a local devnet with mining paused (e.g. a Hardhat node,
+    # automine off): sends a self-transfer priced at 1 wei, which waits in the mempool below the base fee,
+    # mines blocks with evm_mine until it is STUCK_TX_BLOCKS old, and lets check_pending() reprice it until
+    # it is mined.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    w3.provider.make_request('evm_setAutomine', [False])
+    private_key = sys.argv[1]
+    account = w3.eth.account.from_key(private_key)
+    set_signer(lambda telegram_id: private_key)
+    tx = {'to': account.address, 'value': 0, 'gas': 21000, 'gasPrice': 1,
+          'nonce': w3.eth.get_transaction_count(account.address, 'pending'), 'chainId': CHAIN_ID}
+    tx_hash = w3.eth.send_raw_transaction(w3.eth.account.sign_transaction(tx, private_key).raw_transaction).hex()
+    track(tx_hash, 'test', None, None, account.address)
+    while pending_for(None):
+        w3.provider.make_request('evm_mine', [])
+        check_pending()
+        time.sleep(TX_TRACKER_POLL_INTERVAL)
+    logging.info("[TxTracker] Stuck transaction was replaced and mined")
@@ -0,0 +1,301 @@
+"""
+Integer-exact port of the Uniswap V3 swap math (TickMath, SqrtPriceMath, SwapMath and the
+pool swap loop) so quotes, exact-output estimates and price impact can be computed from
+pool_state without any RPC. All values are plain Python ints; rounding mirrors the contracts.
+"""
+import math
+from bisect import bisect_left, bisect_right
+
+Q96 = 2 ** 96
+MIN_TICK = -887272
+MAX_TICK = 887272
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+UINT256_MAX = (1 << 256) - 1
+UINT160_MAX = (1 << 160) - 1
+
+# TickMath.getSqrtRatioAtTick multipliers, keyed by the bit of |tick| they apply to
+_TICK_MULTIPLIERS = [
+    (0x2, 0xfff97272373d413259a46990580e213a),
+    (0x4, 0xfff2e50f5f656932ef12357cf3c7fdcc),
+    (0x8, 0xffe5caca7e10e4e61c3624eaa0941cd0),
+    (0x10, 0xffcb9843d60f6159c9db58835c926644),
+    (0x20, 0xff973b41fa98c081472e6896dfb254c0),
+    (0x40, 0xff2ea16466c96a3843ec78b326b52861),
+    (0x80, 0xfe5dee046a99a2a811c461f1969c3053),
+    (0x100, 0xfcbe86c7900a88aedcffc83b479aa3a4),
+    (0x200, 0xf987a7253ac413176f2b074cf7815e54),
+    (0x400, 0xf3392b0822b70005940c7a398e4b70f3),
+    (0x800, 0xe7159475a2c29b7443b29c7fa6e889d9),
+    (0x1000, 0xd097f3bdfd2022b8845ad8f792aa5825),
+    (0x2000, 0xa9f746462d870fdf8a65dc1f90e061e5),
+    (0x4000, 0x70d869a156d2a1b890bb3df62baf32f7),
+    (0x8000, 0x31be135f97d08fd981231505542fcfa6),
+    (0x10000, 0x9aa508b5b7a84e1c677de54f3e99bc9),
+    (0x20000, 0x5d6af8dedb81196699c329225ee604),
+    (0x40000, 0x2216e584f5fa1ea926041bedfe98),
+    (0x80000, 0x48a170391f7dc42444e8fa2),
+]
+_LOG_SQRT_1_0001 = math.log(1.0001) / 2
+
+
+def _mul_div_rounding_up(a, b, denominator):
+    return -(-a * b // denominator)
+
+
+def _div_rounding_up(a, b):
+    return -(-a // b)
+
+
+# --- TickMath ---
+
+def get_sqrt_ratio_at_tick(tick):
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError(f"Tick {tick} out of range")
+    ratio = 0xfffcb933bd6fad37aa2d162d1a594001 if abs_tick & 0x1 else 1 << 128
+    for bit, multiplier in _TICK_MULTIPLIERS:
+        if abs_tick & bit:
+            ratio = (ratio * multiplier) >> 128
+    if tick > 0:
+        ratio = UINT256_MAX // ratio
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+
+def get_tick_at_sqrt_ratio(sqrt_price_x96):
+    """Greatest tick whose sqrt ratio is <= sqrt_price_x96 (same result as TickMath.getTickAtSqrtRatio)."""
+    if not MIN_SQRT_RATIO <= sqrt_price_x96 < MAX_SQRT_RATIO:
+        raise ValueError(f"sqrtPriceX96 {sqrt_price_x96} out of range")
+    # A float estimate lands within a tick or two; step to the exact answer from there
+    tick = math.floor(math.log(sqrt_price_x96 / Q96) / _LOG_SQRT_1_0001)
+    tick = max(MIN_TICK, min(MAX_TICK, tick))
+    while tick > MIN_TICK and get_sqrt_ratio_at_tick(tick) > sqrt_price_x96:
+        tick -= 1
+    while tick < MAX_TICK and get_sqrt_ratio_at_tick(tick + 1) <= sqrt_price_x96:
+        tick += 1
+    return tick
+
+
+# --- SqrtPriceMath ---
+
+def get_amount0_delta(sqrt_a, sqrt_b, liquidity, round_up):
+    if sqrt_a > sqrt_b:
+        sqrt_a, sqrt_b = sqrt_b, sqrt_a
+    numerator1 = liquidity << 96
+    numerator2 = sqrt_b - sqrt_a
+    if round_up:
+        return _div_rounding_up(_mul_div_rounding_up(numerator1, numerator2, sqrt_b), sqrt_a)
+    return numerator1 * numerator2 // sqrt_b // sqrt_a
+
+
+def get_amount1_delta(sqrt_a, sqrt_b, liquidity, round_up):
+    if sqrt_a > sqrt_b:
+        sqrt_a, sqrt_b = sqrt_b, sqrt_a
+    if round_up:
+        return _mul_div_rounding_up(liquidity, sqrt_b - sqrt_a, Q96)
+    return liquidity * (sqrt_b - sqrt_a) // Q96
+
+
+def _next_sqrt_price_from_amount0_rounding_up(sqrt_p, liquidity, amount, add):
+    if amount == 0:
+        return sqrt_p
+    numerator1 = liquidity << 96
+    product = amount * sqrt_p
+    if add:
+        # The contract switches formula when amount * sqrtP overflows uint256; so must we
+        if product <= UINT256_MAX and numerator1 + product <= UINT256_MAX:
+            return _mul_div_rounding_up(numerator1, sqrt_p, numerator1 + product)
+        return _div_rounding_up(numerator1, numerator1 // sqrt_p + amount)
+    if product > UINT256_MAX or numerator1 <= product:
+        raise ValueError("Insufficient liquidity for requested output")
+    return _mul_div_rounding_up(numerator1, sqrt_p, numerator1 - product)
+
+
+def _next_sqrt_price_from_amount1_rounding_down(sqrt_p, liquidity, amount, add):
+    if add:
+        return sqrt_p + (amount << 96) // liquidity
+    quotient = _div_rounding_up(amount << 96, liquidity)
+    if sqrt_p <= quotient:
+        raise ValueError("Insufficient liquidity for requested output")
+    return sqrt_p - quotient
+
+
+def get_next_sqrt_price_from_input(sqrt_p, liquidity, amount_in, zero_for_one):
+    if zero_for_one:
+        return _next_sqrt_price_from_amount0_rounding_up(sqrt_p, liquidity, amount_in, True)
+    return _next_sqrt_price_from_amount1_rounding_down(sqrt_p, liquidity, amount_in, True)
+
+
+def get_next_sqrt_price_from_output(sqrt_p, liquidity, amount_out, zero_for_one):
+    if zero_for_one:
+        return _next_sqrt_price_from_amount1_rounding_down(sqrt_p, liquidity, amount_out, False)
+    return _next_sqrt_price_from_amount0_rounding_up(sqrt_p, liquidity, amount_out, False)
+
+
+# --- SwapMath ---
+
+def compute_swap_step(sqrt_current, sqrt_target, liquidity, amount_remaining, fee_pips):
+    """Returns (sqrt_next, amount_in, amount_out, fee_amount); amount_remaining < 0 means exact output."""
+    zero_for_one = sqrt_current >= sqrt_target
+    exact_in = amount_remaining >= 0
+    amount_in = amount_out = 0
+    if exact_in:
+        remaining_less_fee = amount_remaining * (1000000 - fee_pips) // 1000000
+        if zero_for_one:
+            amount_in = get_amount0_delta(sqrt_target, sqrt_current, liquidity, True)
+        else:
+            amount_in = get_amount1_delta(sqrt_current, sqrt_target, liquidity, True)
+        if remaining_less_fee >= amount_in:
+            sqrt_next = sqrt_target
+        else:
+            sqrt_next = get_next_sqrt_price_from_input(sqrt_current, liquidity, remaining_less_fee, zero_for_one)
+    else:
+        if zero_for_one:
+            amount_out = get_amount1_delta(sqrt_target, sqrt_current, liquidity, False)
+        else:
+            amount_out = get_amount0_delta(sqrt_current, sqrt_target, liquidity, False)
+        if -amount_remaining >= amount_out:
+            sqrt_next = sqrt_target
+        else:
+            sqrt_next = get_next_sqrt_price_from_output(sqrt_current, liquidity, -amount_remaining, zero_for_one)
+
+    reached_target = sqrt_target == sqrt_next
+    if zero_for_one:
+        if not (reached_target and exact_in):
+            amount_in = get_amount0_delta(sqrt_next, sqrt_current, liquidity, True)
+        if not (reached_target and not exact_in):
+            amount_out = get_amount1_delta(sqrt_next, sqrt_current, liquidity, False)
+    else:
+        if not (reached_target and exact_in):
+            amount_in = get_amount1_delta(sqrt_current, sqrt_next, liquidity, True)
+        if not (reached_target and not exact_in):
+            amount_out = get_amount0_delta(sqrt_current, sqrt_next, liquidity, False)
+
+    if not exact_in and amount_out > -amount_remaining:
+        amount_out = -amount_remaining
+    if exact_in and sqrt_next != sqrt_target:
+        fee_amount = amount_remaining - amount_in
+    else:
+        fee_amount = _mul_div_rounding_up(amount_in, fee_pips, 1000000 - fee_pips)
+    return sqrt_next, amount_in, amount_out, fee_amount
+
+
+# --- Pool swap ---
+
+def _next_initialized_tick(tick_list, tick, tick_spacing, lte):
+    """TickBitmap.nextInitializedTickWithinOneWord over a sorted list of initialized ticks."""
+    compressed = tick // tick_spacing
+    if lte:
+        word_start = (compressed - (compressed % 256)) * tick_spacing
+        i = bisect_right(tick_list, compressed * tick_spacing) - 1
+        if i >= 0 and tick_list[i] >= word_start:
+            return tick_list[i], True
+        return word_start, False
+    compressed += 1
+    word_end = (compressed + 255 - (compressed % 256)) * tick_spacing
+    i = bisect_left(tick_list, compressed * tick_spacing)
+    if i < len(tick_list) and tick_list[i] <= word_end:
+        return tick_list[i], True
+    return word_end, False
+
+
+def _swap_within_bucket(state, zero_for_one, amount_specified):
+    """
+    Fast path: initialized ticks and bitmap word edges all sit on multiples of tickSpacing,
+    so a swap that ends strictly inside the current bucket is a single step with constant
+    liquidity. Returns None when the swap would reach the bucket edge.
+    """
+    sqrt_p = state['sqrt_price_x96']
+    liquidity = state['liquidity']
+    spacing = state['tick_spacing']
+    tick_lower = (state['tick'] // spacing) * spacing
+    if zero_for_one:
+        edge = get_sqrt_ratio_at_tick(max(tick_lower, MIN_TICK))
+    else:
+        edge = get_sqrt_ratio_at_tick(min(tick_lower + spacing, MAX_TICK))
+    try:
+        sqrt_next, amount_in, amount_out, fee_amount = compute_swap_step(sqrt_p, edge, liquidity, amount_specified, state['fee'])
+    except ValueError:
+        return None
+    if sqrt_next == edge:
+        return None
+    return {
+        'amount_in': amount_in + fee_amount,
+        'amount_out': amount_out,
+        'sqrt_price_x96': sqrt_next,
+        'tick': state['tick'] if sqrt_next == sqrt_p else get_tick_at_sqrt_ratio(sqrt_next),
+        'liquidity': liquidity,
+        'ticks_crossed': 0,
+    }
+
+
+def swap(state, zero_for_one, amount_specified, sqrt_price_limit_x96=None):
+    """
+    Simulates UniswapV3Pool.swap against a pool_state snapshot without modifying it.
+    amount_specified > 0 is exact input, < 0 exact output. Returns a dict with the total
+    amount_in (fees included), amount_out and the pool's sqrt_price_x96/tick/liquidity after.
+    """
+    if amount_specified == 0:
+        raise ValueError("amount_specified must be non-zero")
+    if state['liquidity'] > 0 and sqrt_price_limit_x96 is None:
+        fast = _swap_within_bucket(state, zero_for_one, amount_specified)
+        if fast:
+            return fast
+    if sqrt_price_limit_x96 is None:
+        sqrt_price_limit_x96 = MIN_SQRT_RATIO + 1 if zero_for_one else MAX_SQRT_RATIO - 1
+
+    tick_list = sorted(state['ticks'])
+    ticks = state['ticks']
+    spacing = state['tick_spacing']
+    fee = state['fee']
+    exact_in = amount_specified > 0
+    remaining = amount_specified
+    calculated = 0
+    sqrt_p = state['sqrt_price_x96']
+    tick = state['tick']
+    liquidity = state['liquidity']
+    ticks_crossed = 0
+
+    while remaining != 0 and sqrt_p != sqrt_price_limit_x96:
+        sqrt_start = sqrt_p
+        tick_next, initialized = _next_initialized_tick(tick_list, tick, spacing, zero_for_one)
+        tick_next = max(MIN_TICK, min(MAX_TICK, tick_next))
+        sqrt_next_tick = get_sqrt_ratio_at_tick(tick_next)
+        if zero_for_one:
+            target = sqrt_price_limit_x96 if sqrt_next_tick < sqrt_price_limit_x96 else sqrt_next_tick
+        else:
+            target = sqrt_price_limit_x96 if sqrt_next_tick > sqrt_price_limit_x96 else sqrt_next_tick
+        sqrt_p, step_in, step_out, step_fee = compute_swap_step(sqrt_p, target, liquidity, remaining, fee)
+        if exact_in:
+            remaining -= step_in + step_fee
+            calculated += step_out
+        else:
+            remaining += step_out
+            calculated += step_in + step_fee
+        if sqrt_p == sqrt_next_tick:
+            if initialized:
+                net = ticks[tick_next][1]
+                liquidity += -net if zero_for_one else net
+                ticks_crossed += 1
+            tick = tick_next - 1 if zero_for_one else tick_next
+        elif sqrt_p != sqrt_start:
+            tick = get_tick_at_sqrt_ratio(sqrt_p)
+
+    if exact_in:
+        amount_in, amount_out = amount_specified - remaining, calculated
+    else:
+        amount_in, amount_out = calculated, -amount_specified + remaining
+    return {
+        'amount_in': amount_in,
+        'amount_out': amount_out,
+        'sqrt_price_x96': sqrt_p,
+        'tick': tick,
+        'liquidity': liquidity,
+        'ticks_crossed': ticks_crossed,
+    }
+
+
+def price_impact(sqrt_before, sqrt_after):
+    """Relative move of the pool price caused by a swap, as a fraction."""
+    price_before = sqrt_before * sqrt_before
+    return abs(sqrt_after * sqrt_after - price_before) / price_before
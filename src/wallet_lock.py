@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from web3 import Web3
+from config import RPC_URL, WALLET_LOCK_TABLE, WALLET_LEASE_SECONDS, WALLET_LOCK_WAIT, WALLET_NONCE_GAP_GRACE
+import tracing
+import metrics
+
+w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+# Identifies this process in lease records; threads are told apart by their ident
+_PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WalletBusy(Exception):
+    """Another instance holds the wallet's lease for longer than WALLET_LOCK_WAIT."""
+
+
+class _MemoryBackend:
+    """In-process stand-in for the DynamoDB table, with the same conditional semantics. Used when no table is configured."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, address, owner, lease_until, now):
+        with self._lock:
+            item = self._items.setdefault(address, {})
+            if item.get('lease_owner') not in (None, owner) and item.get('lease_until', 0) >= now:
+                return False
+            item['lease_owner'], item['lease_until'] = owner, lease_until
+            return True
+
+    def release(self, address, owner):
+        with self._lock:
+            item = self._items.get(address, {})
+            if item.get('lease_owner') == owner:
+                item.pop('lease_owner')
+                item.pop('lease_until')
+
+    def get_next_nonce(self, address):
+        with self._lock:
+            item = self._items.get(address, {})
+            return item.get('next_nonce'), item.get('nonce_at', 0)
+
+    def set_next_nonce(self, address, owner, next_nonce, now):
+        with self._lock:
+            item = self._items.get(address, {})
+            if item.get('lease_owner') != owner:
+                return False
+            if next_nonce > item.get('next_nonce', 0):
+                item['next_nonce'], item['nonce_at'] = next_nonce, now
+            return True
+
+    def reset_next_nonce(self, address, owner, expected, next_nonce, now):
+        with self._lock:
+            item = self._items.get(address, {})
+            if item.get('lease_owner') != owner or item.get('next_nonce') != expected:
+                return False
+            item['next_nonce'], item['nonce_at'] = next_nonce, now
+            return True
+
+
+class _DynamoBackend:
+    """Leases and nonce counters in a DynamoDB table keyed by 'address', guarded by conditional writes."""
+
+    def __init__(self, table_name):
+        import boto3
+        from botocore.exceptions import ClientError
+        self._table = boto3.resource('dynamodb').Table(table_name)
+        self._client_error = ClientError
+
+    def _conditional(self, **kwargs):
+        try:
+            with metrics.timer('dynamodb_seconds', operation='UpdateItem'):
+                self._table.update_item(**kwargs)
+            return True
+        except self._client_error as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def acquire(self, address, owner, lease_until, now):
+        return self._conditional(
+            Key={'address': address},
+            UpdateExpression='SET lease_owner = :owner, lease_until = :until',
+            ConditionExpression='attribute_not_exists(lease_owner) OR lease_owner = :owner OR lease_until < :now',
+            ExpressionAttributeValues={':owner': owner, ':until': lease_until, ':now': now})
+
+    def release(self, address, owner):
+        self._conditional(
+            Key={'address': address},
+            UpdateExpression='REMOVE lease_owner, lease_until',
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={':owner': owner})
+
+    def get_next_nonce(self, address):
+        with metrics.timer('dynamodb_seconds', operation='GetItem'):
+            item = self._table.get_item(Key={'address': address}, ConsistentRead=True).get('Item') or {}
+        return (int(item['next_nonce']) if 'next_nonce' in item else None), int(item.get('nonce_at', 0))
+
+    def set_next_nonce(self, address, owner, next_nonce, now):
+        # Only the lease holder may move the counter, and only forward (reset_next_nonce handles gaps)
+        if self._conditional(
+                Key={'address': address},
+                UpdateExpression='SET next_nonce = :next, nonce_at = :now',
+                ConditionExpression='lease_owner = :owner AND (attribute_not_exists(next_nonce) OR next_nonce < :next)',
+                ExpressionAttributeValues={':owner': owner, ':next': next_nonce, ':now': now}):
+            return True
+        # Not moving an already higher counter is fine; only a lost lease is a failure
+        return self._conditional(
+            Key={'address': address},
+            UpdateExpression='SET lease_owner = :owner',
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={':owner': owner})
+
+    def reset_next_nonce(self, address, owner, expected, next_nonce, now):
+        return self._conditional(
+            Key={'address': address},
+            UpdateExpression='SET next_nonce = :next, nonce_at = :now',
+            ConditionExpression='lease_owner = :owner AND next_nonce = :expected',
+            ExpressionAttributeValues={':owner': owner, ':expected': expected, ':next': next_nonce, ':now': now})
+
+
+_backend = _DynamoBackend(WALLET_LOCK_TABLE) if WALLET_LOCK_TABLE else _MemoryBackend()
+# Per-thread hold depth by address, so nested holds on the same wallet share one lease
+_held = threading.local()
+
+
+class WalletSession:
+    """A held wallet: nonce is the next free nonce, used(n) records that nonce n was broadcast."""
+
+    def __init__(self, address, owner, nonce):
+        self.address = address
+        self.owner = owner
+        self.nonce = nonce
+
+    def used(self, nonce):
+        if not _backend.set_next_nonce(self.address.lower(), self.owner, nonce + 1, int(time.time() * 1000)):
+            logging.warning("[WalletLock] Lost the lease on %s before recording nonce %s", self.address, nonce)
+        self.nonce = max(self.nonce, nonce + 1)
+
+
+def _reconcile(key, owner, chain_nonce, stored, stored_at):
+    """
+    The counter is ahead of the node's pending count, so the node has no transaction at nonce
+    chain_nonce: it was dropped (or never reached the node), and every later nonce is stuck behind
+    it. Once the counter has stood still for WALLET_NONCE_GAP_GRACE seconds, so a broadcast can't
+    still be propagating, it is reset to the pending count and the gap is filled by the next
+    transaction. Returns the counter to use.
+    """
+    now = int(time.time() * 1000)
+    if now - stored_at < WALLET_NONCE_GAP_GRACE * 1000:
+        return stored
+    if not _backend.reset_next_nonce(key, owner, stored, chain_nonce, now):
+        return stored
+    metrics.inc('nonce_gaps_reset_total')
+    logging.warning("[WalletLock] Nonces %s..%s of %s are unknown to the node; reset the counter to %s", chain_nonce, stored - 1, key, chain_nonce)
+    return chain_nonce
+
+
+@contextmanager
+def hold(address):
+    """
+    Holds a lease on the wallet for the duration of the block, across every instance sharing
+    WALLET_LOCK_TABLE, and yields a WalletSession. The next nonce is the higher of the chain's
+    pending count and the shared counter, so instances never hand out the same nonce twice.
+    Raises WalletBusy if the lease isn't free within WALLET_LOCK_WAIT seconds.
+
+    Blocking (it polls the lease with time.sleep and makes RPC and DynamoDB calls): async
+    handlers run whatever holds a wallet in a worker thread.
+    """
+    key = address.lower()
+    owner = f"{_PROCESS_ID}:{threading.get_ident()}"
+    depth = getattr(_held, 'depth', None)
+    if depth is None:
+        depth = _held.depth = {}
+    if not depth.get(key):
+        with tracing.span('wallet_lock.acquire') as acquiring:
+            deadline = time.time() + WALLET_LOCK_WAIT
+            delay = 0.05
+            attempts = 1
+            while True:
+                now = int(time.time() * 1000)
+                if _backend.acquire(key, owner, now + int(WALLET_LEASE_SECONDS * 1000), now):
+                    break
+                if time.time() >= deadline:
+                    raise WalletBusy("Another transaction for this wallet is being sent. Please try again in a moment.")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                attempts += 1
+            if acquiring:
+                acquiring.set('lock.attempts', attempts)
+    depth[key] = depth.get(key, 0) + 1
+    try:
+        with tracing.span('wallet_lock.nonce'):
+            chain_nonce = w3.eth.get_transaction_count(Web3.to_checksum_address(address), 'pending')
+            stored, stored_at = _backend.get_next_nonce(key)
+            if stored is not None and stored > chain_nonce:
+                stored = _reconcile(key, owner, chain_nonce, stored, stored_at)
+        yield WalletSession(address, owner, max(chain_nonce, stored or 0))
+    finally:
+        depth[key] -= 1
+        if not depth[key]:
+            _backend.release(key, owner)
+
+
+if __name__ == "__main__":
+    # Usage: python wallet_lock.py <address> [threads]
+    # Race check: every thread takes the wallet and claims one nonce without broadcasting anything,
+    # then the claimed nonces must be unique and consecutive. Uses WALLET_LOCK_TABLE if set (e.g.
+    # DynamoDB Local), otherwise the in-process stand-in.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    address, workers = sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    claimed = []
+
+    def claim():
+        with hold(address) as wallet:
+            claimed.append(wallet.nonce)
+            wallet.used(wallet.nonce)
+
+    threads = [threading.Thread(target=claim) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    claimed.sort()
+    ok = claimed == list(range(claimed[0], claimed[0] + workers))
+    print(f"{'OK' if ok else 'COLLISION'}: {claimed}")
@@ -6,6 +6,9 @@ import boto3
 from cryptography.fernet import Fernet
 from eth_account import Account
 from datetime import datetime
+import tracing
+import metrics
+import admission
 
 # DynamoDB setup
 DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'InkyWallets')
@@ -16,12 +19,16 @@ table = dynamodb.Table(DYNAMODB_TABLE)
 ENCRYPTION_KEY = os.environ['ENCRYPTION_KEY']
 fernet = Fernet(ENCRYPTION_KEY.encode())
 
+@tracing.traced()
 def create_wallet():
     acct = Account.create()
     private_key = acct.key.hex()
     encrypted_pk = fernet.encrypt(private_key.encode()).decode()
     return acct.address, encrypted_pk
 
+@tracing.traced('dynamodb PutItem', kind=tracing.SPAN_KIND_CLIENT)
+@metrics.timer('dynamodb_seconds', operation='PutItem')
+@admission.guard('dynamodb')
 def store_wallet(telegram_id, address, encrypted_private_key):
     table.put_item(Item={
         'telegram_id': telegram_id,
@@ -30,6 +37,9 @@ def store_wallet(telegram_id, address, encrypted_private_key):
         'created_at': datetime.utcnow().isoformat()
     })
 
+@tracing.traced('dynamodb GetItem', kind=tracing.SPAN_KIND_CLIENT)
+@metrics.timer('dynamodb_seconds', operation='GetItem')
+@admission.guard('dynamodb')
 def get_wallet(telegram_id):
     resp = table.get_item(Key={'telegram_id': telegram_id})
     item = resp.get('Item')
@@ -37,8 +47,12 @@ def get_wallet(telegram_id):
         return item['address'], item['encrypted_private_key']
     return None, None
 
+@tracing.traced('dynamodb DeleteItem', kind=tracing.SPAN_KIND_CLIENT)
+@metrics.timer('dynamodb_seconds', operation='DeleteItem')
+@admission.guard('dynamodb')
 def delete_wallet(telegram_id):
     table.delete_item(Key={'telegram_id': telegram_id})
 
+@tracing.traced()
 def decrypt_private_key(encrypted_private_key):
     return fernet.decrypt(encrypted_private_key.encode()).decode() 
\ No newline at end of file